@@ -0,0 +1,59 @@
+import fcntl
+import os
+import pty
+import select
+import struct
+import sys
+import termios
+import time
+
+# drives the single-key viewer of a streamed run through a pseudo terminal:
+# step past the first eviction, branch from the newest step (must work), then
+# from an evicted one (must show the error instead of crashing)
+ARGS = ["--interactive", "--stream-window", "16", "--max-new-tokens", "40",
+        "--refresh-rate", "0.05"]
+
+pid, fd = pty.fork()
+if pid == 0:
+    os.execvp(sys.executable,
+              [sys.executable, "-c", "from openmav.mav import main; main()", *ARGS])
+
+fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", 60, 200, 0, 0))
+output = b""
+
+
+def read_until(text, timeout):
+    global output
+    deadline = time.time() + timeout
+    while text.encode() not in output:
+        if time.time() > deadline:
+            raise SystemExit(f"timed out waiting for {text!r}")
+        if select.select([fd], [], [], 0.5)[0]:
+            try:
+                output += os.read(fd, 65536)
+            except OSError:
+                raise SystemExit(f"mav exited before {text!r}:\n{output.decode(errors='ignore')}")
+
+
+def press(keys, wait_for, timeout=120):
+    global output
+    output = b""
+    os.write(fd, keys.encode())
+    read_until(wait_for, timeout)
+
+
+read_until("space n/p", 600)
+time.sleep(1)  # the key reader starts right after the first frame
+press("n" * 30, "step 30")
+press("b", "branches:")
+assert b"can't branch" not in output, "branching from the newest step failed"
+press("xpb", "can't branch")
+os.write(fd, b"xq")
+try:
+    while os.read(fd, 65536):
+        pass
+except OSError:  # the terminal closes with mav
+    pass
+_, status = os.waitpid(pid, 0)
+assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0, status
+print("ok")
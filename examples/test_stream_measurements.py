@@ -0,0 +1,15 @@
+import asyncio
+
+from openmav.api.stream import astream_measurements, stream_measurements
+
+for measurements in stream_measurements("gpt2", "hello world ", max_new_tokens=5):
+    print(measurements.step, repr(measurements.predicted_char))
+
+
+async def main():
+    async with astream_measurements("gpt2", "hello world ", max_new_tokens=5) as stream:
+        async for measurements in stream:
+            print(measurements.step, repr(measurements.predicted_char))
+
+
+asyncio.run(main())
@@ -1,6 +1,7 @@
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
 
+import numpy as np
 import torch
 
 # this has to be reasonably stable
@@ -8,6 +9,49 @@ import torch
 # choosing torch.tensor is ok now since this project 80% works around hf transformers
 
 
+@dataclass
+class PrefillChunk:
+    index: int
+    num_chunks: int
+    start: int
+    end: int
+    total_tokens: int
+    seconds: float
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return (self.end - self.start) / self.seconds if self.seconds > 0 else 0.0
+
+
+@dataclass
+class PrefillStats:
+    num_tokens: int = 0
+    chunk_size: int = 0
+    seconds: float = 0.0
+    chunks: List[PrefillChunk] = field(default_factory=list)
+    cached_tokens: int = 0  # restored from the on-disk prefix cache
+
+    @property
+    def tokens_per_sec(self) -> float:
+        computed = self.num_tokens - self.cached_tokens
+        return computed / self.seconds if self.seconds > 0 else 0.0
+
+
+@dataclass
+class ComparisonMeasurements:
+    model_name: str
+    mlp_activations: torch.Tensor
+    attention_entropy_values: torch.Tensor
+    mlp_delta: torch.Tensor
+    attention_entropy_delta: torch.Tensor
+    kl_divergence: float
+    top_ids: torch.Tensor
+    top_probs: torch.Tensor
+    decoded_tokens: List[str]
+    top1_agrees: bool
+    generated_text: Optional[str] = None  # when the compared sequence diverges
+
+
 @dataclass
 class ModelMeasurements:
     mlp_activations: torch.Tensor
@@ -21,3 +65,38 @@ class ModelMeasurements:
     top_probs: torch.Tensor
     logits: torch.Tensor
     decoded_tokens: List[str]
+    step: Optional[int] = None  # index of the generated token in its session
+    # False for lean steps, whose per-layer fields come from captured_step
+    captured: bool = True
+    captured_step: Optional[int] = None
+    # tokens dropped from the KV cache and sequence so far when streaming
+    evicted_tokens: int = 0
+    prefill_stats: Optional[PrefillStats] = None
+    load_timings: Optional[Dict[str, float]] = None  # seconds per model load phase
+    decode_tokens_per_sec: float = 0.0
+    logit_lens_ids: Optional[torch.Tensor] = None
+    logit_lens_probs: Optional[torch.Tensor] = None
+    logit_lens_tokens: Optional[List[List[str]]] = None
+    comparison: Optional[ComparisonMeasurements] = None
+    residual_trajectories: Optional[Dict[int, np.ndarray]] = None
+    attention_source_positions: Optional[torch.Tensor] = None  # [layers, heads, k]
+    attention_source_weights: Optional[torch.Tensor] = None
+    attention_source_tokens: Optional[List[List[List[str]]]] = None
+    attention_layer_source_positions: Optional[torch.Tensor] = None  # [layers, k]
+    attention_layer_source_weights: Optional[torch.Tensor] = None
+    attention_layer_source_tokens: Optional[List[List[str]]] = None
+    mlp_neuron_ids: Optional[torch.Tensor] = None  # [layers, k]
+    mlp_neuron_values: Optional[torch.Tensor] = None
+    mlp_reference_band: Optional[np.ndarray] = None  # [2, layers] low / high
+    entropy_reference_band: Optional[np.ndarray] = None
+    attention_rollout_positions: Optional[torch.Tensor] = None  # [k] prompt positions
+    attention_rollout_weights: Optional[torch.Tensor] = None
+    attention_rollout_tokens: Optional[List[str]] = None
+    attention_rollout_prompt_share: Optional[float] = None  # rollout mass on the prompt
+    sae_feature_ids: Optional[torch.Tensor] = None  # [k]
+    sae_feature_values: Optional[torch.Tensor] = None
+    sae_feature_labels: Optional[List[str]] = None
+    head_importance: Optional[np.ndarray] = None  # [layers, heads], NaN = not measured
+    head_importance_metric: Optional[str] = None  # "kl" or "logit"
+    # MeasurementPlugin name -> its outputs for this sequence, on the CPU
+    plugin_outputs: Optional[Dict[str, Dict[str, Any]]] = None
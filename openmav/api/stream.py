@@ -0,0 +1,181 @@
+"""
+UI-free access to measurements, for scripts and asyncio services.
+
+Nothing here imports rich, use it when there is no terminal to draw on:
+
+    for measurements in stream_measurements("gpt2", "hello", max_new_tokens=5):
+        print(measurements.predicted_char)
+
+    async with astream_measurements("gpt2", "hello") as stream:
+        async for measurements in stream:
+            ...
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from openmav.backends.model_backend_transformers import TransformersBackend
+from openmav.processors.state_fetcher import StateFetcher
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def create_state_fetcher(
+    model,
+    backend="transformers",
+    device="cpu",
+    seed=42,
+    model_obj=None,
+    tokenizer_obj=None,
+    **fetcher_options,
+):
+    """
+    Loads a backend and wraps it in a StateFetcher.
+
+    fetcher_options are passed to StateFetcher (max_new_tokens, aggregation,
+    prefill_chunk_size, logit_lens_top_k, ...).
+    """
+    if backend == "transformers":
+        backend = TransformersBackend(
+            model_name=model,
+            device=device,
+            seed=seed,
+            model_obj=model_obj,
+            tokenizer_obj=tokenizer_obj,
+        )
+    else:
+        raise ValueError(f"Unsupported backend: {backend}")
+
+    return StateFetcher(backend, **fetcher_options)
+
+
+def stream_measurements(
+    model,
+    prompt,
+    temp=0.0,
+    top_k=50,
+    top_p=1.0,
+    min_p=0.0,
+    repetition_penalty=1.0,
+    state_fetcher=None,
+    **options,
+):
+    """
+    Generator of ModelMeasurements, one per generated token.
+
+    Pass an existing state_fetcher to reuse a loaded model, otherwise options
+    go to create_state_fetcher. A state_fetcher serves one session at a
+    time, starting a second one while it streams raises ValueError.
+    """
+    if prompt is None or len(prompt) == 0:
+        raise ValueError("Prompt cannot be empty.")
+
+    owns_fetcher = state_fetcher is None
+    state_fetcher = state_fetcher or create_state_fetcher(model, **options)
+    try:
+        yield from state_fetcher.fetch_next(
+            prompt,
+            temperature=temp,
+            top_k=top_k,
+            top_p=top_p,
+            min_p=min_p,
+            repetition_penalty=repetition_penalty,
+        )
+    finally:
+        # a passed in state_fetcher stays usable, its owner closes it
+        if owns_fetcher:
+            state_fetcher.close()
+
+
+class AsyncMeasurementStream:
+    """
+    Async iterator over a blocking measurements generator.
+
+    Every model step runs on the stream's own worker thread, so the event
+    loop stays free and many sessions can interleave. Each session needs its
+    own StateFetcher, and without one passed in each loads its own model. At most max_buffered
+    steps are produced ahead of the consumer (backpressure). aclose(), or
+    leaving the async with block, cancels production and closes the
+    generator once its current step finishes.
+    """
+
+    def __init__(self, generator, max_buffered=1):
+        self._generator = generator
+        self._queue = asyncio.Queue(maxsize=max(1, max_buffered))
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="mav-stream"
+        )
+        self._task = None
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._produce())
+
+        item = await self._queue.get()
+        if item is _DONE:
+            await self.aclose()
+            raise StopAsyncIteration
+        if isinstance(item, _Failure):
+            await self.aclose()
+            raise item.error
+        return item
+
+    async def _produce(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                item = await loop.run_in_executor(
+                    self._executor, next, self._generator, _DONE
+                )
+                await self._queue.put(item)
+                if item is _DONE:
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._queue.put(_Failure(e))
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        # single worker: runs after any step still in flight
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._generator.close)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+def astream_measurements(model, prompt, max_buffered=1, **options):
+    """
+    Async counterpart of stream_measurements, see AsyncMeasurementStream.
+
+    The model is loaded lazily on the worker thread with the first step.
+    """
+    return AsyncMeasurementStream(
+        stream_measurements(model, prompt, **options), max_buffered=max_buffered
+    )
@@ -0,0 +1,287 @@
+from collections import defaultdict
+from functools import partial
+
+import torch
+
+# module holding the per-block stack of decoder layers, looked up on base_model
+DECODER_LAYER_LISTS = ("h", "layers", "blocks", "layer")
+# projection back to the residual stream, its input is the MLP's intermediate
+# activation (gpt2: c_proj, llama / smollm: down_proj, opt: fc2, neox: dense_4h_to_h)
+MLP_DOWN_PROJECTIONS = ("c_proj", "down_proj", "fc2", "dense_4h_to_h", "fc_out")
+# attention module of a block and its output projection, whose input is the
+# concatenation of all heads (gpt2: attn.c_proj, llama: self_attn.o_proj,
+# opt: self_attn.out_proj, neox: attention.dense)
+ATTENTION_MODULES = ("attn", "self_attn", "attention")
+ATTENTION_OUT_PROJECTIONS = ("c_proj", "o_proj", "out_proj", "dense")
+
+
+def find_decoder_layers(model):
+    base = model.base_model
+    for container in (base, getattr(base, "decoder", None)):
+        if container is None:
+            continue
+        for name in DECODER_LAYER_LISTS:
+            layers = getattr(container, name, None)
+            if isinstance(layers, torch.nn.ModuleList):
+                return layers
+    raise ValueError(f"Can't find decoder layers of {type(model).__name__}")
+
+
+def find_mlp_down_projection(block):
+    mlp = getattr(block, "mlp", None) or getattr(block, "feed_forward", None)
+    if mlp is None:
+        # some blocks (e.g. opt) keep the projections on the block itself
+        mlp = block
+    for name in MLP_DOWN_PROJECTIONS:
+        module = getattr(mlp, name, None)
+        if isinstance(module, torch.nn.Module):
+            return module
+    raise ValueError(f"Can't find MLP down projection of {type(block).__name__}")
+
+
+def find_attention_out_projection(block):
+    for attention_name in ATTENTION_MODULES:
+        attention = getattr(block, attention_name, None)
+        if attention is None:
+            continue
+        for name in ATTENTION_OUT_PROJECTIONS:
+            module = getattr(attention, name, None)
+            if isinstance(module, torch.nn.Module):
+                return module
+    raise ValueError(
+        f"Can't find attention output projection of {type(block).__name__}"
+    )
+
+
+def load_steering_vector(path):
+    """
+    Reads a [d_model] steering vector saved with torch.save, numpy.save or
+    safetensors (first tensor of the file).
+    """
+    if path.endswith(".npy"):
+        import numpy as np
+
+        return torch.from_numpy(np.load(path)).reshape(-1)
+    if path.endswith(".safetensors"):
+        from safetensors import safe_open
+
+        with safe_open(path, framework="pt") as f:
+            return f.get_tensor(next(iter(f.keys()))).reshape(-1)
+    return torch.load(path, map_location="cpu").reshape(-1)
+
+
+def _block_hidden(output):
+    # decoder blocks return their hidden states alone or first in a tuple
+    return output[0] if isinstance(output, tuple) else output
+
+
+def _with_block_hidden(output, hidden):
+    return (hidden,) + tuple(output[1:]) if isinstance(output, tuple) else hidden
+
+
+class MlpNeuronCapture:
+    """
+    Captures the strongest MLP neurons of every layer with forward pre-hooks.
+
+    The hook sees the intermediate activation (d_ff wide) going into the down
+    projection and keeps only the top-k neurons by magnitude at the last
+    position, on the device. collect() moves just (indices, values) off it.
+    """
+
+    def __init__(self, model, top_k=5):
+        self.top_k = top_k
+        self.enabled = True
+        self._captured = {}
+        self._handles = [
+            find_mlp_down_projection(block).register_forward_pre_hook(
+                partial(self._hook, layer_idx)
+            )
+            for layer_idx, block in enumerate(find_decoder_layers(model))
+        ]
+
+    def _hook(self, layer_idx, module, args):
+        if not self.enabled:
+            return
+        with torch.no_grad():
+            activations = args[0][:, -1, :]
+            _, indices = torch.topk(activations.abs(), self.top_k, dim=-1)
+            self._captured[layer_idx] = (indices, torch.gather(activations, -1, indices))
+
+    def collect(self):
+        """
+        Returns:
+            tuple: (neuron ids [layers, batch, k], signed values [layers, batch, k])
+                   or None if nothing was captured
+        """
+        if not self._captured:
+            return None
+        layers = sorted(self._captured)
+        indices = torch.stack([self._captured[i][0] for i in layers]).cpu()
+        values = torch.stack([self._captured[i][1] for i in layers]).float().cpu()
+        self._captured.clear()
+        return indices, values
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+
+class HeadMask:
+    """
+    Per-row head masks in front of every attention output projection.
+
+    masks is a [layers, batch, heads] tensor multiplied into the heads'
+    outputs, so each row of a batch can run with a different set of heads
+    switched off. None leaves the model untouched.
+    """
+
+    def __init__(self, model):
+        self.num_heads = model.config.num_attention_heads
+        self.enabled = True
+        self.masks = None
+        self._handles = [
+            find_attention_out_projection(block).register_forward_pre_hook(
+                partial(self._hook, layer_idx)
+            )
+            for layer_idx, block in enumerate(find_decoder_layers(model))
+        ]
+        self.num_layers = len(self._handles)
+
+    def _hook(self, layer_idx, module, args):
+        if self.masks is None or not self.enabled:
+            return None
+        merged = args[0]
+        batch, seq, width = merged.shape
+        mask = self.masks[layer_idx, :batch].to(merged.dtype)
+        split = merged.reshape(batch, seq, self.num_heads, width // self.num_heads)
+        split = split * mask[:, None, :, None]
+        return (split.reshape(batch, seq, width),) + tuple(args[1:])
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+
+class Intervention:
+    """
+    Steering and ablation hooks that only touch selected batch rows.
+
+    Running the same sequence as one clean and one intervened row of a batch
+    gives both results from a single forward pass.
+
+    - steering adds vector * scale to the output of block steering_layer
+    - ablate_heads zeroes (layer, head) outputs before the attention output
+      projection
+    - ablate_layers skips whole blocks, their output is their input
+    """
+
+    def __init__(
+        self,
+        model,
+        rows=(1,),
+        steering_layer=None,
+        steering_vector=None,
+        steering_scale=1.0,
+        ablate_heads=(),
+        ablate_layers=(),
+    ):
+        self.rows = list(rows)
+        self.enabled = True
+        self.steering_layer = steering_layer
+        self.steering_scale = steering_scale
+        self.ablate_heads = sorted(set(ablate_heads))
+        self.ablate_layers = sorted(set(ablate_layers))
+        self._layer_inputs = {}
+        self._handles = []
+
+        layers = find_decoder_layers(model)
+        if steering_vector is not None:
+            self._handles.append(
+                layers[steering_layer].register_forward_hook(
+                    partial(self._steer, steering_vector * steering_scale)
+                )
+            )
+
+        num_heads = model.config.num_attention_heads
+        heads_by_layer = defaultdict(list)
+        for layer_idx, head in self.ablate_heads:
+            heads_by_layer[layer_idx].append(head)
+        for layer_idx, heads in heads_by_layer.items():
+            self._handles.append(
+                find_attention_out_projection(
+                    layers[layer_idx]
+                ).register_forward_pre_hook(
+                    partial(self._ablate_heads, heads, num_heads)
+                )
+            )
+
+        for layer_idx in self.ablate_layers:
+            self._handles.append(
+                layers[layer_idx].register_forward_pre_hook(
+                    partial(self._remember_input, layer_idx), with_kwargs=True
+                )
+            )
+            self._handles.append(
+                layers[layer_idx].register_forward_hook(
+                    partial(self._skip_layer, layer_idx)
+                )
+            )
+
+    def describe(self):
+        parts = []
+        if self.steering_layer is not None:
+            parts.append(f"steer L{self.steering_layer} x{self.steering_scale:g}")
+        if self.ablate_heads:
+            parts.append(
+                "heads " + ",".join(f"{layer}.{head}" for layer, head in self.ablate_heads)
+            )
+        if self.ablate_layers:
+            parts.append("layers " + ",".join(str(layer) for layer in self.ablate_layers))
+        return " ".join(parts) or "no intervention"
+
+    def _active_rows(self, batch_size):
+        if not self.enabled:
+            return []
+        return [row for row in self.rows if row < batch_size]
+
+    def _steer(self, vector, module, args, output):
+        hidden = _block_hidden(output)
+        rows = self._active_rows(hidden.shape[0])
+        if not rows:
+            return None
+        hidden = hidden.clone()
+        hidden[rows] += vector.to(device=hidden.device, dtype=hidden.dtype)
+        return _with_block_hidden(output, hidden)
+
+    def _ablate_heads(self, heads, num_heads, module, args):
+        merged = args[0]
+        rows = self._active_rows(merged.shape[0])
+        if not rows:
+            return None
+        batch, seq, width = merged.shape
+        split = merged.clone().view(batch, seq, num_heads, width // num_heads)
+        for row in rows:
+            split[row, :, heads, :] = 0
+        return (split.view(batch, seq, width),) + tuple(args[1:])
+
+    def _remember_input(self, layer_idx, module, args, kwargs):
+        hidden = args[0] if args else kwargs["hidden_states"]
+        self._layer_inputs[layer_idx] = hidden
+        return None
+
+    def _skip_layer(self, layer_idx, module, args, output):
+        layer_input = self._layer_inputs.pop(layer_idx, None)
+        hidden = _block_hidden(output)
+        rows = self._active_rows(hidden.shape[0])
+        if layer_input is None or not rows:
+            return None
+        hidden = hidden.clone()
+        hidden[rows] = layer_input[rows].to(hidden.dtype)
+        return _with_block_hidden(output, hidden)
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
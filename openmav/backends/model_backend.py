@@ -1,4 +1,6 @@
 class ModelBackend:
+    load_timings = None  # seconds per load phase, filled by initialize()
+
     def __init__(self, model_name, model_obj=None, tokenizer_obj=None, device="cpu"):
         pass
 
@@ -13,10 +15,66 @@ class ModelBackend:
         top_p=1.0,
         min_p=0.0,
         repetition_penalty=1.0,
+        past_key_values=None,
+        capture=True,
     ):
         raise NotImplementedError("Subclasses must implement generate()")
 
-    def tokenize(self, text):
+    def prefill(self, input_ids, past_key_values=None, output_attentions=False):
+        raise NotImplementedError("Subclasses must implement prefill()")
+
+    def forward(self, input_ids, attention_mask=None):
+        raise NotImplementedError("Subclasses must implement forward()")
+
+    def crop_cache(self, past_key_values, length):
+        raise NotImplementedError("Subclasses must implement crop_cache()")
+
+    def evict_cache(self, past_key_values, num_sinks, num_evicted):
+        raise NotImplementedError("Subclasses must implement evict_cache()")
+
+    def check_cache_eviction(self):
+        raise NotImplementedError("Subclasses must implement check_cache_eviction()")
+
+    def check_shared_vocabulary(self, other):
+        raise NotImplementedError("Subclasses must implement check_shared_vocabulary()")
+
+    def attention_entry_bytes(self):
+        raise NotImplementedError("Subclasses must implement attention_entry_bytes()")
+
+    def position_limit(self):
+        raise NotImplementedError("Subclasses must implement position_limit()")
+
+    def fork_cache(self, past_key_values, num_branches, length=None):
+        raise NotImplementedError("Subclasses must implement fork_cache()")
+
+    def cache_layers(self, past_key_values):
+        raise NotImplementedError("Subclasses must implement cache_layers()")
+
+    def cache_from_layers(self, layers):
+        raise NotImplementedError("Subclasses must implement cache_from_layers()")
+
+    def cache_namespace(self):
+        raise NotImplementedError("Subclasses must implement cache_namespace()")
+
+    def enable_mlp_neuron_capture(self, top_k=5):
+        raise NotImplementedError("Subclasses must implement enable_mlp_neuron_capture()")
+
+    def add_intervention(self, rows=(1,), **kwargs):
+        raise NotImplementedError("Subclasses must implement add_intervention()")
+
+    def head_mask(self):
+        raise NotImplementedError("Subclasses must implement head_mask()")
+
+    def remove_hooks(self):
+        raise NotImplementedError("Subclasses must implement remove_hooks()")
+
+    def residual_vector(self, text, layer):
+        raise NotImplementedError("Subclasses must implement residual_vector()")
+
+    def output_head(self):
+        raise NotImplementedError("Subclasses must implement output_head()")
+
+    def tokenize(self, text, truncation=True):
         raise NotImplementedError("Subclasses must implement tokenize()")
 
     def decode(self, token_ids, **kwargs):
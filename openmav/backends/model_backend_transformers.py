@@ -1,9 +1,59 @@
+import time
+from contextlib import contextmanager
+
 import numpy as np
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import transformers
+from transformers import (AutoModelForCausalLM, AutoTokenizer,
+                          LogitsProcessorList,
+                          RepetitionPenaltyLogitsProcessor,
+                          TemperatureLogitsWarper, TopKLogitsWarper,
+                          TopPLogitsWarper)
 
+from openmav.backends.hooks import HeadMask, Intervention, MlpNeuronCapture
 from openmav.backends.model_backend import ModelBackend
 
+try:
+    from transformers.utils import is_accelerate_available
+except ImportError:  # older transformers
+    def is_accelerate_available():
+        return False
+
+try:
+    from transformers import MinPLogitsWarper
+except ImportError:  # added in transformers 4.39
+    MinPLogitsWarper = None
+
+
+# position encodings evict_cache() can shift: learned absolute positions are
+# added to the input only, so cached keys hold none; rotate_half rotary
+# (Llama, Mistral, Qwen, NeoX, Phi, ...) rotates the kept keys back. Others,
+# e.g. the interleaved rotary of GPT-J / CodeGen, are refused.
+ABSOLUTE_POSITION_MODEL_TYPES = ("gpt2", "gpt_neo", "gpt_bigcode", "opt")
+ROTATE_HALF_MODEL_TYPES = (
+    "llama",
+    "mistral",
+    "mixtral",
+    "qwen2",
+    "qwen2_moe",
+    "qwen3",
+    "qwen3_moe",
+    "gpt_neox",
+    "phi",
+    "phi3",
+    "stablelm",
+    "starcoder2",
+    "olmo",
+    "olmo2",
+    "gemma",
+    "granite",
+)
+
+
+# from 5.0 on from_pretrained always builds on the meta device and
+# ignores low_cpu_mem_usage
+TRANSFORMERS_MAJOR = int(transformers.__version__.split(".")[0])
+
 
 class TransformersBackend(ModelBackend):
     def __init__(
@@ -13,30 +63,71 @@ class TransformersBackend(ModelBackend):
         self.device = device
         self.model_obj = model_obj
         self.tokenizer_obj = tokenizer_obj
+        self.mlp_capture = None
+        self.interventions = []
+        self._head_mask = None
+        self._rotary_inv_freq = False  # looked up on first eviction
+        self.load_timings = {}  # seconds per load phase
 
         torch.manual_seed(seed)
         np.random.seed(seed)
 
         self.initialize()
 
+    def _load_kwargs(self):
+        """
+        from_pretrained arguments for the low-copy load path.
+
+        Needs accelerate (the openmav[fast-load] extra). The model is then
+        built on the meta device and the safetensors shards are memory-mapped
+        and assigned in place (straight onto the target device with a
+        device_map), instead of allocating random weights, reading every
+        shard into RAM and copying again in .to(). Repeated runs then mostly
+        hit the OS page cache. transformers 5 always builds on the meta
+        device, there only the device_map needs accelerate.
+        """
+        if not is_accelerate_available():
+            return {}
+        kwargs = {}
+        if TRANSFORMERS_MAJOR < 5:
+            kwargs["low_cpu_mem_usage"] = True
+        if self.device != "cpu":
+            kwargs["device_map"] = {"": self.device}
+        return kwargs
+
     def initialize(self):
 
         try:
+            self.load_timings = {}
+            start = time.perf_counter()
             if self.model_obj:
                 self.model = self.model_obj.to(self.device)
+                self.load_timings["to_device"] = time.perf_counter() - start
+                if self.model_name is None:
+                    self.model_name = self.model.config.name_or_path or None
             else:
+                load_kwargs = self._load_kwargs()
                 self.model = AutoModelForCausalLM.from_pretrained(
                     self.model_name,
                     return_dict_in_generate=True,
                     output_hidden_states=True,
                     output_attentions=True,
                     attn_implementation="eager",
-                ).to(self.device)
+                    **load_kwargs,
+                )
+                self.load_timings["weights"] = time.perf_counter() - start
+
+                if "device_map" not in load_kwargs:
+                    start = time.perf_counter()
+                    self.model = self.model.to(self.device)
+                    self.load_timings["to_device"] = time.perf_counter() - start
 
+            start = time.perf_counter()
             if self.tokenizer_obj:
                 self.tokenizer = self.tokenizer_obj
             else:
                 self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.load_timings["tokenizer"] = time.perf_counter() - start
 
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = (
@@ -50,6 +141,333 @@ class TransformersBackend(ModelBackend):
             print(f"Error loading model: {e}")
             raise
 
+    def enable_mlp_neuron_capture(self, top_k=5):
+        """
+        Hooks the MLP down projections, generate() then also returns the top-k
+        intermediate neurons of every layer under "mlp_neurons".
+        """
+        if self.mlp_capture is None:
+            self.mlp_capture = MlpNeuronCapture(self.model, top_k=top_k)
+        self.mlp_capture.top_k = top_k
+
+    def add_intervention(self, rows=(1,), **kwargs):
+        """
+        Registers steering / ablation hooks (see hooks.Intervention) acting on
+        the given batch rows of generate(). prefill() always runs clean.
+        """
+        intervention = Intervention(self.model, rows=rows, **kwargs)
+        self.interventions.append(intervention)
+        return intervention
+
+    def head_mask(self):
+        """
+        The backend's HeadMask (see hooks.HeadMask), hooked on first use. Set
+        its masks to run batch rows of generate() with different heads off.
+        """
+        if self._head_mask is None:
+            self._head_mask = HeadMask(self.model)
+        return self._head_mask
+
+    def residual_vector(self, text, layer):
+        """
+        Last-position output of block layer for text, e.g. for contrastive
+        steering vectors.
+        """
+        token_ids = self.tokenize(text).tolist()[0]
+        outputs = self.forward([token_ids])
+        # hidden_states[0] is the embedding output
+        return outputs["hidden_states"][layer + 1][0, -1, :].detach()
+
+    def _hooks(self):
+        hooks = [self.mlp_capture, self._head_mask] + self.interventions
+        return [hook for hook in hooks if hook is not None]
+
+    @contextmanager
+    def _hooks_disabled(self):
+        # each hook gets back the state it had, e.g. an intervention a caller
+        # switched off stays off
+        hooks = self._hooks()
+        previous = [hook.enabled for hook in hooks]
+        for hook in hooks:
+            hook.enabled = False
+        try:
+            yield
+        finally:
+            for hook, enabled in zip(hooks, previous):
+                hook.enabled = enabled
+
+    def remove_hooks(self):
+        """
+        Unregisters every hook the backend put on the model. A caller's
+        model_obj is left as it was passed in.
+        """
+        for hook in self._hooks():
+            hook.remove()
+        self.mlp_capture = None
+        self._head_mask = None
+        self.interventions = []
+
+    def output_head(self):
+        """
+        Final norm and unembedding of the model, as used by the logit lens.
+
+        Returns:
+            tuple: (final_norm module or None, lm head weight [V, d], lm head bias or None)
+        """
+        final_norm = None
+        for name in ("ln_f", "norm", "final_layer_norm", "final_layernorm"):
+            final_norm = getattr(self.model.base_model, name, None)
+            if final_norm is not None:
+                break
+
+        lm_head = self.model.get_output_embeddings()
+        return final_norm, lm_head.weight, getattr(lm_head, "bias", None)
+
+    def cache_namespace(self):
+        """
+        Identity of the weights a KV cache was computed with.
+
+        None for a caller's model_obj: its config still names the checkpoint
+        it started from, while the weights may be finetuned or mid-training.
+        """
+        if self.model_obj is not None:
+            return None
+        config = self.model.config
+        return {
+            "model": getattr(config, "name_or_path", None) or self.model_name,
+            "revision": getattr(config, "_commit_hash", None),
+            "dtype": str(self.model.dtype),
+        }
+
+    @staticmethod
+    def cache_length(past_key_values):
+        """Number of positions already held in the KV cache."""
+        if past_key_values is None:
+            return 0
+        if hasattr(past_key_values, "get_seq_length"):
+            return past_key_values.get_seq_length()
+        return past_key_values[0][0].shape[-2]
+
+    @staticmethod
+    def cache_layers(past_key_values):
+        """Per-layer (key, value) tensors of a KV cache, whatever its class."""
+        if hasattr(past_key_values, "layers"):
+            return [(layer.keys, layer.values) for layer in past_key_values.layers]
+        if hasattr(past_key_values, "key_cache"):
+            return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+        return [tuple(layer[:2]) for layer in past_key_values]
+
+    @staticmethod
+    def cache_from_layers(layers):
+        """Builds a cache the model accepts from per-layer (key, value) tensors."""
+        try:
+            from transformers import DynamicCache
+        except ImportError:  # older transformers only speak tuples
+            return tuple((key, value) for key, value in layers)
+
+        cache = DynamicCache()
+        for layer_idx, (key, value) in enumerate(layers):
+            cache.update(key, value, layer_idx)
+        return cache
+
+    def crop_cache(self, past_key_values, length):
+        """
+        The first length positions of a cache, None for length 0. The slices
+        are views, but the cache built from them copies them, at the latest
+        when the next step appends.
+        """
+        if length == 0:
+            return None
+        return self.cache_from_layers(
+            [
+                (key[..., :length, :], value[..., :length, :])
+                for key, value in self.cache_layers(past_key_values)
+            ]
+        )
+
+    def attention_entry_bytes(self):
+        """
+        Bytes output_attentions returns per query/key pair, summed over
+        layers and heads. None if the config doesn't say.
+        """
+        config = self.model.config
+        num_layers = getattr(config, "num_hidden_layers", None)
+        num_heads = getattr(config, "num_attention_heads", None)
+        if not num_layers or not num_heads:
+            return None
+        element_size = next(self.model.parameters()).element_size()
+        return num_layers * num_heads * element_size
+
+    def position_limit(self):
+        """Largest position the model was trained for, None if unknown."""
+        config = self.model.config
+        for name in ("max_position_embeddings", "n_positions", "n_ctx"):
+            value = getattr(config, name, None)
+            if value:
+                return value
+        return None
+
+    def check_shared_vocabulary(self, other):
+        """
+        Raises ValueError unless this model and other score the same token
+        ids: equal config.vocab_size and, when this model was loaded by name,
+        a tokenizer with the same vocabulary as the one both decode with.
+        """
+        own_size = self.model.config.vocab_size
+        other_size = other.model.config.vocab_size
+        if own_size != other_size:
+            raise ValueError(
+                f"{self.model_name} has {own_size} token ids and "
+                f"{other.model_name} has {other_size}, they need a shared vocabulary."
+            )
+        if len(other.tokenizer) > own_size:
+            raise ValueError(
+                f"The tokenizer has {len(other.tokenizer)} tokens, more than "
+                f"the {own_size} ids {self.model_name} embeds."
+            )
+        if self.model_obj is None and self.model_name is not None:
+            own_tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            if own_tokenizer.get_vocab() != other.tokenizer.get_vocab():
+                raise ValueError(
+                    f"{self.model_name} and {other.model_name} use different "
+                    "tokenizers, they need a shared vocabulary."
+                )
+
+    def check_cache_eviction(self):
+        """
+        Raises ValueError unless evict_cache() can keep this model's
+        positions consistent, see ROTATE_HALF_MODEL_TYPES.
+        """
+        self._rotary_frequencies()
+
+    def _rotary_frequencies(self):
+        # the model's single set of rotary frequencies, None for absolute
+        # positions
+        if self._rotary_inv_freq is not False:
+            return self._rotary_inv_freq
+
+        config = self.model.config
+        model_type = getattr(config, "model_type", None)
+        if model_type in ABSOLUTE_POSITION_MODEL_TYPES:
+            self._rotary_inv_freq = None
+            return None
+        if model_type not in ROTATE_HALF_MODEL_TYPES:
+            raise ValueError(
+                f"Can't evict from the KV cache of {model_type} models, their "
+                "position encoding isn't supported."
+            )
+        rope_scaling = getattr(config, "rope_scaling", None) or {}
+        if rope_scaling.get("rope_type", rope_scaling.get("type")) == "dynamic":
+            raise ValueError(
+                "Dynamic NTK rotary frequencies change with the sequence length, "
+                "cached keys can't be re-rotated."
+            )
+
+        frequencies = [
+            module.inv_freq.detach().float()
+            for module in self.model.modules()
+            if isinstance(getattr(module, "inv_freq", None), torch.Tensor)
+        ]
+        if not frequencies:
+            raise ValueError(f"No rotary frequencies (inv_freq) found in {model_type}.")
+        if any(
+            f.shape != frequencies[0].shape or not torch.equal(f, frequencies[0])
+            for f in frequencies[1:]
+        ):
+            # e.g. local and global attention layers with different bases
+            raise ValueError(
+                f"{model_type} uses several rotary bases, KV cache eviction "
+                "supports a single one."
+            )
+        self._rotary_inv_freq = frequencies[0]
+        return self._rotary_inv_freq
+
+    @staticmethod
+    def _rotate_keys(keys, inv_freq, offset):
+        """
+        Moves rotary-embedded keys by offset positions.
+
+        Rotations compose, so a key rotated for position p becomes one for
+        p + offset without knowing p. Uses the rotate_half layout of Llama /
+        Mistral / NeoX style models; with partial rotary only the leading
+        2 * len(inv_freq) dims are rotated.
+        """
+        rotary_dims = 2 * inv_freq.shape[0]
+        angles = offset * inv_freq.to(keys.device)
+        cos = torch.cat([angles.cos(), angles.cos()])
+        sin = torch.cat([angles.sin(), angles.sin()])
+        rotary = keys[..., :rotary_dims].float()
+        first, second = rotary.chunk(2, dim=-1)
+        rotated = rotary * cos + torch.cat([-second, first], dim=-1) * sin
+        return torch.cat(
+            [rotated.to(keys.dtype), keys[..., rotary_dims:]], dim=-1
+        )
+
+    def evict_cache(self, past_key_values, num_sinks, num_evicted):
+        """
+        Drops num_evicted positions after the first num_sinks from a cache.
+
+        Positions come from the cache length, so the kept recent entries move
+        down by num_evicted. Rotary keys are rotated by the same amount, which
+        keeps every query-key distance inside the window exact. Absolute
+        position models (gpt2) need nothing, their positions are only
+        injected at the input.
+        """
+        inv_freq = self._rotary_frequencies()
+        layers = []
+        for key, value in self.cache_layers(past_key_values):
+            recent_keys = key[..., num_sinks + num_evicted :, :]
+            if inv_freq is not None:
+                recent_keys = self._rotate_keys(recent_keys, inv_freq, -num_evicted)
+            layers.append(
+                (
+                    torch.cat([key[..., :num_sinks, :], recent_keys], dim=-2),
+                    torch.cat(
+                        [value[..., :num_sinks, :], value[..., num_sinks + num_evicted :, :]],
+                        dim=-2,
+                    ),
+                )
+            )
+        return self.cache_from_layers(layers)
+
+    def fork_cache(self, past_key_values, num_branches, length=None):
+        """
+        A num_branches row cache of the first row of past_key_values, cut to
+        its first length positions (all when None).
+
+        The rows go in as stride-0 views, but every row still ends up as a
+        full copy of the prefix: DynamicCache concatenates on the first
+        decode step (on construction with transformers 5). Cutting and
+        forking in one call keeps that to a single copy per row.
+        """
+        def fork(tensor):
+            tensor = tensor[:1, ..., :length, :]
+            return tensor.expand(num_branches, *tensor.shape[1:])
+
+        return self.cache_from_layers(
+            [(fork(key), fork(value)) for key, value in self.cache_layers(past_key_values)]
+        )
+
+    @staticmethod
+    def _logits_processor(temperature, top_k, top_p, min_p, repetition_penalty):
+        # mirrors what model.generate() applies to the scores it returns:
+        # penalties always, warpers only when sampling
+        processors = LogitsProcessorList()
+        if repetition_penalty is not None and repetition_penalty != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+        if temperature > 0:
+            if temperature != 1.0:
+                processors.append(TemperatureLogitsWarper(temperature))
+            if top_k is not None and top_k > 0:
+                processors.append(TopKLogitsWarper(top_k))
+            if top_p is not None and top_p < 1.0:
+                processors.append(TopPLogitsWarper(top_p))
+            if min_p is not None and min_p > 0.0:
+                if MinPLogitsWarper is None:
+                    raise ValueError("min_p sampling needs transformers>=4.39.")
+                processors.append(MinPLogitsWarper(min_p))
+        return processors
+
     def generate(
         self,
         input_ids,
@@ -58,36 +476,116 @@ class TransformersBackend(ModelBackend):
         top_p=1.0,
         min_p=0.0,
         repetition_penalty=1.0,
+        past_key_values=None,
+        capture=True,
     ):
+        """
+        Runs one decode step over the positions not yet in past_key_values.
+
+        Only the uncached suffix of input_ids is fed to the model, so with a
+        cache every step costs a single position. input_ids is either one
+        sequence or a list of equal length sequences decoded as a batch.
+        capture=False is a lean step: no hidden states, attentions or MLP
+        neuron capture, those entries are None.
+        """
+        input_tensor = torch.tensor(input_ids)
+        if input_tensor.dim() == 1:
+            input_tensor = input_tensor.unsqueeze(0)
+        input_tensor = input_tensor.to(self.device)
+        past_length = self.cache_length(past_key_values)
 
+        capture_enabled = self.mlp_capture is not None and self.mlp_capture.enabled
+        if self.mlp_capture is not None:
+            self.mlp_capture.enabled = capture_enabled and capture
+        try:
+            with torch.no_grad():
+                outputs = self.model(
+                    input_tensor[:, past_length:],
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                    output_hidden_states=capture,
+                    output_attentions=capture,
+                    return_dict=True,
+                )
+                processors = self._logits_processor(
+                    temperature, top_k, top_p, min_p, repetition_penalty
+                )
+                scores = processors(input_tensor, outputs.logits[:, -1, :].float())
+        finally:
+            if self.mlp_capture is not None:
+                self.mlp_capture.enabled = capture_enabled
+
+        return {
+            "logits": scores.unsqueeze(1).cpu(),
+            "hidden_states": outputs.hidden_states,
+            "attentions": outputs.attentions,
+            "past_key_values": outputs.past_key_values,
+            "mlp_neurons": (
+                self.mlp_capture.collect() if self.mlp_capture and capture else None
+            ),
+        }
+
+    def prefill(self, input_ids, past_key_values=None, output_attentions=False):
+        """
+        Extends the KV cache with the uncached suffix of input_ids.
+
+        Runs the base model only: no LM head or hidden states are materialized,
+        so peak memory is bounded by the suffix length. With output_attentions
+        the suffix rows of every layer's attention are returned as well, as
+        (past_key_values, attentions).
+        """
         input_tensor = torch.tensor([input_ids]).to(self.device)
-        with torch.no_grad():
-            outputs = self.model.generate(
+        past_length = self.cache_length(past_key_values)
+
+        with self._hooks_disabled(), torch.no_grad():
+            outputs = self.model.base_model(
+                input_tensor[:, past_length:],
+                past_key_values=past_key_values,
+                use_cache=True,
+                output_hidden_states=False,
+                output_attentions=output_attentions,
+                return_dict=True,
+            )
+
+        if output_attentions:
+            return outputs.past_key_values, outputs.attentions
+        return outputs.past_key_values
+
+    def forward(self, input_ids, attention_mask=None):
+        """
+        Teacher-forced pass over whole sequences, no cache and no sampling.
+
+        input_ids is a list of equal length (padded) sequences. Every
+        position's logits, hidden states and attentions are returned as they
+        are, on the device, for the caller to reduce there.
+        """
+        input_tensor = torch.tensor(input_ids)
+        if input_tensor.dim() == 1:
+            input_tensor = input_tensor.unsqueeze(0)
+        input_tensor = input_tensor.to(self.device)
+        if attention_mask is not None:
+            attention_mask = torch.as_tensor(attention_mask).to(self.device)
+
+        with self._hooks_disabled(), torch.no_grad():
+            outputs = self.model(
                 input_tensor,
-                do_sample=temperature > 0,
-                max_new_tokens=1,
-                temperature=temperature,
-                top_k=top_k,
-                top_p=top_p,
-                min_p=min_p,
-                repetition_penalty=repetition_penalty,
-                return_dict_in_generate=True,
-                output_scores=True,
+                attention_mask=attention_mask,
+                use_cache=False,
                 output_hidden_states=True,
                 output_attentions=True,
-                pad_token_id=self.tokenizer.eos_token_id,  # warning TODO: find correct way to handle this
+                return_dict=True,
             )
 
         return {
-            "logits": outputs.scores[-1].unsqueeze(0).cpu(),  # Last step logits
-            "hidden_states": outputs.hidden_states[-1],  # Last step hidden states
-            "attentions": outputs.attentions[-1],  # Last step attentions
+            "logits": outputs.logits,
+            "hidden_states": outputs.hidden_states,
+            "attentions": outputs.attentions,
         }
 
-    def tokenize(self, text):
-        return self.tokenizer(text, padding=True, truncation=True, return_tensors="pt")[
-            "input_ids"
-        ].to(self.device)
+    def tokenize(self, text, truncation=True):
+        return self.tokenizer(
+            text, padding=True, truncation=truncation, return_tensors="pt"
+        )["input_ids"].to(self.device)
 
     def decode(self, token_ids, **kwargs):
         return self.tokenizer.decode(token_ids, **kwargs)
@@ -0,0 +1,100 @@
+import torch
+
+
+class IncrementalRollout:
+    """
+    Attention rollout (Abnar & Zuidema) of every token onto the prompt,
+    extended one row per token instead of recomputing the layer product.
+
+    With A'_l = (mean_heads(A_l) + I) / 2, the rollout row of token t after
+    layer l is R_l[t] = A'_l[t] @ R_{l-1}, which only needs the stored rows
+    of earlier tokens at layer l - 1. Columns are independent in this
+    product, so rows are kept for the prompt columns only: memory is
+    layers x rows x prompt length, capped by memory_bytes. When full, the
+    oldest rows after the first keep_first (attention sinks) are evicted
+    and their attention share is renormalized over the rows still held.
+    """
+
+    def __init__(
+        self,
+        num_layers,
+        num_columns,
+        memory_bytes=64 * 1024**2,
+        keep_first=4,
+        device="cpu",
+    ):
+        self.num_layers = num_layers
+        self.num_columns = num_columns
+        capacity = memory_bytes // max(1, num_layers * num_columns * 4)
+        self.capacity = max(int(capacity), keep_first + 1)
+        self.keep_first = min(keep_first, self.capacity - 1)
+        self.device = device
+        # rows[l, slot] is R_{l+1} of the token at positions[slot]
+        self.rows = torch.zeros(
+            num_layers, self.capacity, num_columns, device=device
+        )
+        self.positions = torch.full((self.capacity,), -1, dtype=torch.long, device=device)
+        self._next_ring_slot = self.keep_first
+        self._filled = 0
+
+    def _base_rows(self, positions):
+        # R_0 = I restricted to the prompt columns
+        rows = torch.zeros(len(positions), self.num_columns, device=self.device)
+        in_prompt = positions < self.num_columns
+        rows[in_prompt, positions[in_prompt]] = 1.0
+        return rows
+
+    def _slots_for(self, count):
+        slots = []
+        for _ in range(count):
+            if self._filled < self.capacity:
+                slots.append(self._filled)
+                self._filled += 1
+                continue
+            slots.append(self._next_ring_slot)
+            self._next_ring_slot += 1
+            if self._next_ring_slot >= self.capacity:
+                self._next_ring_slot = self.keep_first
+        return slots
+
+    def update(self, attentions, start):
+        """
+        Adds the rows of the positions start .. start + n - 1.
+
+        Args:
+            attentions (tuple): Per layer [batch, heads, n, context] attention
+                of the new positions, batch row 0 is used
+            start (int): Position of the first new row
+
+        Returns:
+            torch.Tensor: Top layer rollout of the last new position, [columns]
+        """
+        with torch.no_grad():
+            num_new = attentions[0].shape[-2]
+            new_positions = torch.arange(start, start + num_new, device=self.device)
+            held = (self.positions >= 0).nonzero(as_tuple=True)[0]
+            held_positions = self.positions[held]
+
+            previous_new = self._base_rows(new_positions)
+            previous_held = self._base_rows(held_positions)
+            new_rows = []
+            for layer, attention in enumerate(attentions):
+                mean = attention[0].float().mean(dim=0).to(self.device)  # [n, context]
+                to_held = mean[:, held_positions]
+                to_new = mean[:, new_positions]
+                total = (to_held.sum(-1) + to_new.sum(-1)).clamp_min(1e-9).unsqueeze(-1)
+                rolled = (to_held @ previous_held + to_new @ previous_new) / total
+                current = 0.5 * rolled + 0.5 * previous_new
+                new_rows.append(current)
+                previous_new = current
+                previous_held = self.rows[layer, held]
+
+            # a chunk longer than the ring reuses slots, the last row wins
+            last_row_of_slot = {
+                slot: row for row, slot in enumerate(self._slots_for(num_new))
+            }
+            slots = torch.tensor(list(last_row_of_slot), device=self.device)
+            order = torch.tensor(list(last_row_of_slot.values()), device=self.device)
+            self.rows[:, slots] = torch.stack(new_rows)[:, order]
+            self.positions[slots] = new_positions[order]
+            return new_rows[-1][-1]
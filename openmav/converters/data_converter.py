@@ -44,13 +44,194 @@ class DataConverter:
         Returns:
             numpy.ndarray: Entropy values for each layer
         """
+        # reduce on the attention's device, only one value per layer moves
         return np.array(
-            [
-                DataConverter.compute_entropy(attn[:, :, -1, :].cpu())
+            [DataConverter.compute_entropy(attn[:, :, -1, :]) for attn in attentions]
+        )
+
+    @staticmethod
+    def process_position_statistics(hidden_states, attentions, aggregation="l2"):
+        """
+        Per-layer statistics of every position of a full forward pass.
+
+        Same quantities as process_mlp_activations and process_entropy give
+        for the last position, reduced on the device for all positions at
+        once.
+
+        Args:
+            hidden_states (tuple): Hidden states, each [batch, seq, d]
+            attentions (tuple): Attention matrices, each [batch, heads, seq, seq]
+            aggregation (str): Aggregation method to use
+
+        Returns:
+            tuple: (activations [layers + 1, batch, seq], entropy [layers, batch, seq])
+        """
+        with torch.no_grad():
+            if aggregation == "l2":
+                activations = [torch.norm(layer.float(), p=2, dim=-1) for layer in hidden_states]
+            elif aggregation == "max_abs":
+                activations = [layer.abs().max(dim=-1).values.float() for layer in hidden_states]
+            else:
+                raise ValueError("Invalid aggregation method. Choose from: l2, max_abs.")
+            entropy = [
+                (-torch.sum(attn * torch.log(attn + 1e-9), dim=-1)).mean(dim=1).float()
                 for attn in attentions
             ]
+        return torch.stack(activations).cpu().numpy(), torch.stack(entropy).cpu().numpy()
+
+    @staticmethod
+    def process_position_predictions(logits, top_k=20, dist_n=100):
+        """
+        Next token predictions of every position of a full forward pass.
+
+        One softmax and one top-k over [seq, V] on the device, only the
+        dist_n most likely entries per position are transferred.
+
+        Args:
+            logits (torch.Tensor): Logits of one sequence, [seq, V]
+            top_k (int): Predictions kept per position
+            dist_n (int): Probabilities kept for the output distribution
+
+        Returns:
+            tuple: (top ids [seq, top_k], top probabilities [seq, top_k],
+                    top logits [seq, top_k], sorted probabilities [seq, dist_n])
+        """
+        with torch.no_grad():
+            logits = logits.float()
+            probs = torch.softmax(logits, dim=-1)
+            dist_probs, dist_ids = torch.topk(probs, max(top_k, dist_n), dim=-1)
+            top_ids = dist_ids[:, :top_k]
+            top_logits = torch.gather(logits, -1, top_ids)
+        return (
+            top_ids.cpu(),
+            dist_probs[:, :top_k].cpu(),
+            top_logits.cpu(),
+            dist_probs[:, :dist_n].cpu(),
+        )
+
+    @staticmethod
+    def process_logit_lens(
+        hidden_states, final_norm, unembedding, bias=None, top_k=5, chunk_size=8192
+    ):
+        """
+        Project every layer's last-position hidden state onto the vocabulary.
+
+        All layers go through one [layers, d] x [d, chunk] matmul per vocabulary
+        chunk, keeping only a running top-k and log-sum-exp, so the cost stays
+        close to one extra output layer and no [layers, V] matrix is built.
+
+        Args:
+            hidden_states (tuple): Hidden states from the model, one per layer
+            final_norm (torch.nn.Module): Final norm, skipped when None
+            unembedding (torch.Tensor): LM head weight of shape [V, d]
+            bias (torch.Tensor): Optional LM head bias of shape [V]
+            top_k (int): Tokens kept per layer
+            chunk_size (int): Vocabulary rows multiplied at once
+
+        Returns:
+            tuple: (top ids [layers, top_k], top probabilities [layers, top_k])
+        """
+        with torch.no_grad():
+            last = torch.stack([layer[0, -1, :] for layer in hidden_states])
+            last = last.to(unembedding.dtype)
+            # the model already applied the final norm to its last hidden state
+            if final_norm is not None:
+                last = torch.cat([final_norm(last[:-1]), last[-1:]])
+
+            top_values = top_ids = log_norm = None
+            for start in range(0, unembedding.shape[0], chunk_size):
+                logits = last @ unembedding[start : start + chunk_size].T
+                if bias is not None:
+                    logits = logits + bias[start : start + chunk_size]
+                logits = logits.float()
+
+                chunk_lse = torch.logsumexp(logits, dim=-1)
+                values, ids = torch.topk(logits, min(top_k, logits.shape[-1]), dim=-1)
+                ids = ids + start
+
+                if top_values is None:
+                    top_values, top_ids, log_norm = values, ids, chunk_lse
+                    continue
+
+                log_norm = torch.logaddexp(log_norm, chunk_lse)
+                values = torch.cat([top_values, values], dim=-1)
+                ids = torch.cat([top_ids, ids], dim=-1)
+                top_values, order = torch.topk(values, top_k, dim=-1)
+                top_ids = torch.gather(ids, -1, order)
+
+            top_probs = torch.exp(top_values - log_norm.unsqueeze(-1))
+        return top_ids.cpu(), top_probs.cpu()
+
+    @staticmethod
+    def process_attention_sources(attentions, top_k=3):
+        """
+        Most attended earlier positions of the current token, per layer and head.
+
+        Selection runs on the attention's device, only the top-k positions and
+        weights are transferred.
+
+        Args:
+            attentions (list): Attention matrices from the model
+            top_k (int): Positions kept per head
+
+        Returns:
+            tuple: (head positions [layers, heads, k], head weights [layers, heads, k],
+                    layer positions [layers, k], layer weights [layers, k])
+        """
+        with torch.no_grad():
+            last_rows = torch.stack([attn[0, :, -1, :] for attn in attentions])
+            k = min(top_k, last_rows.shape[-1])
+            head_weights, head_positions = torch.topk(last_rows, k, dim=-1)
+            layer_weights, layer_positions = torch.topk(last_rows.mean(dim=1), k, dim=-1)
+        return (
+            head_positions.cpu(),
+            head_weights.float().cpu(),
+            layer_positions.cpu(),
+            layer_weights.float().cpu(),
+        )
+
+    @staticmethod
+    def process_layer_deltas(base_values, other_values):
+        """
+        Per-layer difference of two models' statistics (other - base).
+
+        Models with different depths are compared over their shared layers.
+
+        Args:
+            base_values (numpy.ndarray): Per-layer values of the base model
+            other_values (numpy.ndarray): Per-layer values of the other model
+
+        Returns:
+            numpy.ndarray: Per-layer deltas
+        """
+        num_layers = min(len(base_values), len(other_values))
+        return np.asarray(other_values[:num_layers]) - np.asarray(
+            base_values[:num_layers]
         )
 
+    @staticmethod
+    def compute_kl_divergence(p_probs, q_probs):
+        """
+        KL(p || q) between two next token distributions over a shared vocabulary.
+
+        Args:
+            p_probs (torch.Tensor): Reference probabilities
+            q_probs (torch.Tensor): Compared probabilities
+
+        Returns:
+            float: KL divergence in nats
+        """
+        if p_probs.shape[-1] != q_probs.shape[-1]:
+            raise ValueError(
+                f"Distributions over {p_probs.shape[-1]} and {q_probs.shape[-1]} "
+                "tokens, KL needs a shared vocabulary."
+            )
+        p_probs = p_probs.float()
+        q_probs = q_probs.float().clamp_min(1e-12)
+        return torch.sum(
+            torch.xlogy(p_probs, p_probs) - p_probs * torch.log(q_probs), dim=-1
+        ).item()
+
     @staticmethod
     def normalize_activations(activations, scale_type="linear", max_bar_length=20):
         """
@@ -0,0 +1,85 @@
+from collections import deque
+
+import numpy as np
+
+
+class IncrementalPCA:
+    """
+    Covariance-free incremental PCA (CCIPCA) updated one vector at a time.
+
+    Keeps only the running mean and num_components direction vectors, so
+    memory and per-update cost are O(num_components * dim) no matter how many
+    vectors have been seen.
+    """
+
+    def __init__(self, num_components=2, amnesia=2.0):
+        self.num_components = num_components
+        self.amnesia = amnesia  # >0 weighs recent vectors higher
+        self.count = 0
+        self.mean = None
+        self.directions = None  # unnormalized, norm tracks the eigenvalue
+
+    def partial_fit(self, x):
+        x = np.asarray(x, dtype=np.float64).reshape(-1)
+        self.count += 1
+        n = self.count
+
+        if self.mean is None:
+            self.mean = x.copy()
+            self.directions = np.zeros((self.num_components, x.shape[0]))
+            return self
+        self.mean += (x - self.mean) / n
+
+        residual = x - self.mean
+        old_weight = max(n - 1 - self.amnesia, 0.0) / n
+        new_weight = 1.0 - old_weight
+        for i in range(min(self.num_components, n - 1)):
+            direction = self.directions[i]
+            norm = np.linalg.norm(direction)
+            if norm < 1e-12:
+                # first vector seen for this component seeds it
+                self.directions[i] = residual
+                break
+            unit = direction / norm
+            self.directions[i] = old_weight * direction + new_weight * residual * (
+                residual @ unit
+            )
+            # deflate so the next component sees the orthogonal remainder
+            unit = self.directions[i] / max(np.linalg.norm(self.directions[i]), 1e-12)
+            residual = residual - (residual @ unit) * unit
+        return self
+
+    @property
+    def components(self):
+        norms = np.linalg.norm(self.directions, axis=1, keepdims=True)
+        return self.directions / np.maximum(norms, 1e-12)
+
+    def transform(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        if self.mean is None:
+            return np.zeros((X.shape[0], self.num_components))
+        return (X - self.mean) @ self.components.T
+
+
+class ResidualTrajectory:
+    """
+    2-D path of a hidden state through a streaming PCA projection.
+
+    The last window raw vectors are kept and re-projected with the current
+    basis, so the shown path stays consistent while memory stays bounded.
+    """
+
+    def __init__(self, window=256, num_components=2):
+        self.pca = IncrementalPCA(num_components=num_components)
+        self.recent = deque(maxlen=window)
+
+    def update(self, x):
+        x = np.asarray(x, dtype=np.float64).reshape(-1)
+        self.pca.partial_fit(x)
+        self.recent.append(x)
+        return self.points()
+
+    def points(self):
+        if not self.recent:
+            return np.zeros((0, self.pca.num_components))
+        return self.pca.transform(np.stack(self.recent))
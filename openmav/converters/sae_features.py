@@ -0,0 +1,161 @@
+import json
+import os
+import struct
+import warnings
+
+import numpy as np
+import torch
+
+# names used by SAELens / dictionary_learning style checkpoints
+SAE_WEIGHT_NAMES = {
+    "W_enc": ("W_enc", "encoder.weight", "W_e"),
+    "b_enc": ("b_enc", "encoder.bias", "b_e"),
+    "b_dec": ("b_dec", "decoder.bias", "b_d"),
+    "threshold": ("threshold",),  # JumpReLU SAEs only
+}
+SAFETENSORS_NUMPY_DTYPES = {
+    "F64": np.float64,
+    "F32": np.float32,
+    "F16": np.float16,
+}
+
+
+def memmap_safetensors(path, names=None):
+    """
+    Tensors of a .safetensors file as read-only views of a memory map.
+
+    Nothing is read until a tensor is used, and pages stay in the OS page
+    cache instead of private RAM. Dtypes numpy can't map (bf16) fall back to
+    safetensors' own loader.
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+
+    tensors = {}
+    for name, info in header.items():
+        if names is not None and name not in names:
+            continue
+        begin, end = info["data_offsets"]
+        dtype = SAFETENSORS_NUMPY_DTYPES.get(info["dtype"])
+        if dtype is None:
+            from safetensors import safe_open
+
+            with safe_open(path, framework="pt") as f:
+                tensors[name] = f.get_tensor(name)
+            continue
+        array = np.memmap(
+            path,
+            dtype=dtype,
+            mode="r",
+            offset=8 + header_size + begin,
+            shape=tuple(info["shape"]),
+        )
+        with warnings.catch_warnings():
+            # the map is read-only and never written through
+            warnings.simplefilter("ignore", UserWarning)
+            tensors[name] = torch.from_numpy(array)
+    return tensors
+
+
+def load_feature_labels(path):
+    """
+    Feature index -> label from a JSON file: {"123": "label"}, a list of
+    labels, or a list of {"index": ..., "description"/"label": ...} records
+    (e.g. a Neuronpedia export).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return {int(index): str(label) for index, label in data.items()}
+    labels = {}
+    for index, entry in enumerate(data):
+        if isinstance(entry, dict):
+            index = int(entry.get("index", entry.get("feature", index)))
+            entry = entry.get("description") or entry.get("label") or ""
+        labels[index] = str(entry)
+    return labels
+
+
+class SparseAutoencoder:
+    """
+    Encoder half of a sparse autoencoder trained on one residual stream layer.
+
+    Features are relu((h - b_dec) @ W_enc + b_enc), gated by the threshold of
+    JumpReLU SAEs. On the CPU the weights stay memory-mapped; on an
+    accelerator they are copied to it once, straight from the map.
+    """
+
+    def __init__(self, W_enc, b_enc, b_dec=None, threshold=None, layer=-1, labels=None):
+        # nn.Linear checkpoints store the encoder as [d_sae, d_model]
+        if W_enc.shape[1] != b_enc.shape[0]:
+            W_enc = W_enc.T
+        self.W_enc = W_enc
+        self.b_enc = b_enc
+        self.b_dec = b_dec
+        self.threshold = threshold
+        self.layer = layer  # index into hidden_states, 0 is the embedding output
+        self.labels = labels or {}
+
+    @property
+    def num_features(self):
+        return self.W_enc.shape[1]
+
+    @classmethod
+    def load(cls, path, layer=-1, device="cpu", labels_path=None):
+        """
+        Args:
+            path (str): .safetensors file, or a SAELens directory holding
+                sae_weights.safetensors
+            layer (int): hidden_states index the SAE was trained on
+            device (str): Where the encoder runs
+            labels_path (str): Optional JSON file of feature labels
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, "sae_weights.safetensors")
+        tensors = memmap_safetensors(path)
+
+        weights = {}
+        for key, aliases in SAE_WEIGHT_NAMES.items():
+            name = next((alias for alias in aliases if alias in tensors), None)
+            if name is None:
+                if key in ("W_enc", "b_enc"):
+                    raise ValueError(
+                        f"SAE checkpoint {path} has no {key} (tried {', '.join(aliases)})."
+                    )
+                weights[key] = None
+                continue
+            tensor = tensors[name]
+            weights[key] = tensor if device == "cpu" else tensor.to(device)
+
+        return cls(
+            layer=layer,
+            labels=load_feature_labels(labels_path) if labels_path else None,
+            **weights,
+        )
+
+    def top_features(self, hidden_states, top_k=8):
+        """
+        Strongest features of the last position, selected on the device.
+
+        Args:
+            hidden_states (tuple): Per-layer [batch, seq, d_model] hidden states
+            top_k (int): Features to return
+
+        Returns:
+            tuple: (feature ids [k], activations [k]) on the CPU
+        """
+        with torch.no_grad():
+            hidden = hidden_states[self.layer][0, -1, :].to(self.W_enc.dtype)
+            if self.b_dec is not None:
+                hidden = hidden - self.b_dec
+            pre = hidden @ self.W_enc + self.b_enc
+            acts = torch.relu(pre)
+            if self.threshold is not None:
+                acts = acts * (pre > self.threshold)
+            values, ids = acts.topk(min(top_k, self.num_features))
+        return ids.cpu(), values.float().cpu()
+
+    def label(self, feature_id):
+        return self.labels.get(feature_id, "")
@@ -0,0 +1,146 @@
+import numpy as np
+
+
+def position_bucket(positions):
+    """
+    Log2 bucket of a token position: 0, 1, 2-3, 4-7, 8-15, ...
+
+    Keeps per-position statistics bounded however long sequences get, while
+    the first positions (where models behave most differently) stay exact.
+    """
+    positions = np.asarray(positions)
+    buckets = np.floor(np.log2(np.maximum(positions, 1))).astype(np.int64) + 1
+    return np.where(positions <= 0, 0, buckets)
+
+
+class RunningMoments:
+    """
+    Welford mean and variance for a fixed array of cells.
+
+    A batch is reduced per cell first and merged with Chan's parallel update,
+    so the cost per batch is a few bincounts and memory is three floats per
+    cell.
+    """
+
+    def __init__(self, num_cells):
+        self.num_cells = num_cells
+        self.count = np.zeros(num_cells, dtype=np.int64)
+        self.mean = np.zeros(num_cells)
+        self.m2 = np.zeros(num_cells)
+
+    def update(self, cells, values):
+        """
+        Args:
+            cells (numpy.ndarray): Flat cell index of every value
+            values (numpy.ndarray): Observed values
+        """
+        cells = np.asarray(cells, dtype=np.int64).ravel()
+        values = np.asarray(values, dtype=np.float64).ravel()
+        n = np.bincount(cells, minlength=self.num_cells)
+        batch_mean = np.bincount(cells, weights=values, minlength=self.num_cells)
+        batch_mean /= np.maximum(n, 1)
+        batch_m2 = np.bincount(
+            cells, weights=(values - batch_mean[cells]) ** 2, minlength=self.num_cells
+        )
+
+        total = self.count + n
+        safe_total = np.maximum(total, 1)
+        delta = batch_mean - self.mean
+        self.mean += delta * n / safe_total
+        self.m2 += batch_m2 + delta**2 * self.count * n / safe_total
+        self.count = total
+
+    @property
+    def variance(self):
+        return self.m2 / np.maximum(self.count - 1, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch (Karnin, Lang, Liberty).
+
+    Level h holds items of weight 2**h. A full level is sorted and every
+    other item (random offset) is promoted, so memory stays around 3k items
+    for any stream length with rank error of roughly 1/k.
+    """
+
+    def __init__(self, k=128, c=2.0 / 3.0, seed=0):
+        self.k = k
+        self.c = c
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return int(np.ceil(self.k * self.c**depth)) + 1
+
+    def _size(self):
+        return sum(len(items) for items in self.levels)
+
+    def _max_size(self):
+        return sum(self._capacity(level) for level in range(len(self.levels)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return
+        self.count += values.size
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self):
+        while self._size() > self._max_size():
+            for level, items in enumerate(self.levels):
+                if len(items) < self._capacity(level):
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # an odd item out stays behind at its own weight
+                keep = items[len(items) - len(items) % 2 :]
+                promoted = items[: len(items) - len(keep)][self._rng.integers(2) :: 2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = keep
+                break
+
+    def quantiles(self, qs):
+        qs = np.asarray(qs, dtype=np.float64)
+        if self.count == 0:
+            return np.full(qs.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(len(level_items), 2.0**level) for level, level_items in enumerate(self.levels)]
+        )
+        order = np.argsort(items)
+        cumulative = np.cumsum(weights[order])
+        ranks = np.searchsorted(cumulative, qs * cumulative[-1], side="left")
+        return items[order][np.minimum(ranks, len(items) - 1)]
+
+
+class CellHistograms:
+    """
+    Fixed-edge histograms for an array of cells, values outside the edges
+    land in the first or last bin.
+    """
+
+    def __init__(self, num_cells, edges):
+        self.num_cells = num_cells
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.num_bins = len(self.edges) - 1
+        self.counts = np.zeros((num_cells, self.num_bins), dtype=np.int64)
+
+    def update(self, cells, values):
+        cells = np.asarray(cells, dtype=np.int64).ravel()
+        bins = np.clip(
+            np.searchsorted(self.edges, np.asarray(values).ravel(), side="right") - 1,
+            0,
+            self.num_bins - 1,
+        )
+        self.counts += np.bincount(
+            cells * self.num_bins + bins, minlength=self.num_cells * self.num_bins
+        ).reshape(self.num_cells, self.num_bins)
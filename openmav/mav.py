@@ -1,11 +1,23 @@
 # @author: attentionmech
 
 import argparse
+import os
+import sys
+import time
 import warnings
 
+from openmav.backends.hooks import load_steering_vector
 from openmav.backends.model_backend_transformers import TransformersBackend
+from openmav.converters.sae_features import SparseAutoencoder
+from openmav.processors.corpus_profiler import (CorpusProfiler,
+                                                ReferenceProfile, read_corpus)
+from openmav.processors.model_worker import ModelWorker
+from openmav.processors.prefix_cache import PrefixKVCache
+from openmav.processors.run_recorder import (QUERY_COLUMNS, find_runs,
+                                             parse_query, query_run)
 from openmav.processors.state_fetcher import StateFetcher
 from openmav.view.main_loop_manager import MainLoopManager
+from openmav.view.panels.panel_creator import DEFAULT_PANELS
 
 warnings.filterwarnings("ignore")
 
@@ -32,15 +44,53 @@ def MAV(
     selected_panels=None,
     num_grid_rows=1,
     max_bar_length=50,
+    branch_width: int = 4,
+    branch_steps: int = 10,
+    plugin_time_budget: float = 0.05,
+    output_backend: str = "rich",  # "cell_diff" rewrites only changed cells
+    prefetch_steps: int = 8,  # steps generated ahead while the interactive view waits
+    history_size: int = 256,  # steps kept for rewinding in interactive mode
     # Execution & Backend Settings
     device: str = "cpu",
     scale: str = "linear",
     backend: str = "transformers",
     seed: int = 42,
+    prefill_chunk_size: int = 512,
+    logit_lens_top_k: int = 3,
+    compare_model: str = None,  # second model decoded in lockstep, shares the tokenizer
+    teacher: str = "base",  # which model samples the shared token stream
+    prefix_cache_dir: str = None,  # on-disk prompt prefix KV cache, off when None
+    prefix_cache_max_mb: int = 2048,
+    record_dir: str = None,  # runs recorded here can be searched with `mav query`
+    capture_every: int = 1,  # full layer capture every Nth token, 0: only on triggers
+    capture_below_top1: float = None,  # also capture when top-1 prob drops below
+    capture_above_entropy: float = None,  # also capture when entropy (nats) exceeds
+    stream_window: int = None,  # recent KV positions kept when streaming, off when None
+    stream_sink_tokens: int = 4,  # first positions always kept as attention sinks
+    trajectory_layers=None,  # layers tracked by the residual_trajectory panel
+    attention_sources_top_k: int = 3,
+    mlp_neurons_top_k: int = 4,
+    attention_rollout_top_k: int = 5,
+    attention_rollout_memory_mb: int = 64,
+    sae_path: str = None,  # sparse autoencoder checkpoint of one layer
+    sae_layer: int = -1,  # hidden_states index the SAE reads, 0 is the embeddings
+    sae_labels: str = None,  # JSON of feature labels
+    sae_top_k: int = 8,
+    reference_profile: str = None,  # report written by `mav profile`
+    analyze: bool = False,  # scrub through the prompt's positions, no generation
+    # Interventions, run as a batch of two next to the clean sequence
+    steering_vector: str = None,  # .pt / .npy / .safetensors file
+    steering_prompts=None,  # (positive, negative) prompts, vector is their difference
+    steering_layer: int = None,  # block whose output is steered, default: middle
+    steering_scale: float = 4.0,
+    ablate_heads=None,  # "layer.head" strings
+    ablate_layers=None,
     # advanced
     model_obj=None,  # Pass model object compatible with backend
     tokenizer_obj=None,  # Pass tokenizer object compatible with backend
     external_panels=None,  # a none empty list of classes
+    measurement_plugins=None,  # MeasurementPlugin classes or instances
+    compare_model_obj=None,  # Pass compare model object compatible with backend
 ):
     if model is None:
         print("model name cannot be empty.")
@@ -61,18 +111,102 @@ def MAV(
     else:
         raise ValueError(f"Unsupported backend: {backend}")
 
+    intervention = None
+    if steering_vector or steering_prompts or ablate_heads or ablate_layers:
+        intervention = _build_intervention(
+            backend,
+            steering_vector=steering_vector,
+            steering_prompts=steering_prompts,
+            steering_layer=steering_layer,
+            steering_scale=steering_scale,
+            ablate_heads=ablate_heads,
+            ablate_layers=ablate_layers,
+        )
+
+    compare_backend = None
+    if compare_model is not None or compare_model_obj is not None:
+        compare_backend = TransformersBackend(
+            model_name=compare_model,
+            device=device,
+            seed=seed,
+            model_obj=compare_model_obj,
+            tokenizer_obj=backend.tokenizer,
+        )
+
     state_fetcher = StateFetcher(
         backend,
         max_new_tokens=max_new_tokens,
         aggregation=aggregation,
         scale=scale,
         max_bar_length=max_bar_length,
+        prefill_chunk_size=prefill_chunk_size,
+        # per-step extras (an extra unembedding, PCA, top-k hooks) only run
+        # when their panel is named in selected_panels
+        logit_lens_top_k=(
+            logit_lens_top_k
+            if selected_panels is not None and "logit_lens" in selected_panels
+            else 0
+        ),
+        compare_backend=compare_backend,
+        teacher=teacher,
+        prefix_cache=(
+            PrefixKVCache(prefix_cache_dir, max_bytes=prefix_cache_max_mb * 1024**2)
+            if prefix_cache_dir
+            else None
+        ),
+        trajectory_layers=(
+            (trajectory_layers or [-1])
+            if selected_panels is not None and "residual_trajectory" in selected_panels
+            else None
+        ),
+        attention_sources_top_k=(
+            attention_sources_top_k
+            if selected_panels is not None and "attention_sources" in selected_panels
+            else 0
+        ),
+        mlp_neurons_top_k=(
+            mlp_neurons_top_k
+            if selected_panels is not None and "mlp_neurons" in selected_panels
+            else 0
+        ),
+        # prefill has to return attentions and skip the prefix cache for it
+        attention_rollout_top_k=(
+            attention_rollout_top_k
+            if selected_panels is not None and "attention_rollout" in selected_panels
+            else 0
+        ),
+        attention_rollout_memory_mb=attention_rollout_memory_mb,
+        sae=(
+            SparseAutoencoder.load(
+                sae_path, layer=sae_layer, device=device, labels_path=sae_labels
+            )
+            if sae_path
+            and selected_panels is not None
+            and "sae_features" in selected_panels
+            else None
+        ),
+        sae_top_k=sae_top_k,
+        reference_profile=(
+            ReferenceProfile.load(reference_profile) if reference_profile else None
+        ),
+        intervention=intervention,
+        measurement_plugins=measurement_plugins,
+        record_dir=record_dir,
+        capture_every=capture_every,
+        capture_below_top1=capture_below_top1,
+        capture_above_entropy=capture_above_entropy,
+        stream_window=stream_window,
+        stream_sink_tokens=stream_sink_tokens,
     )
 
     manager = MainLoopManager(
         # Data & Model
         state_provider=state_fetcher,
-        model_name=model,
+        model_name=(
+            backend.model_name
+            if compare_backend is None
+            else f"{backend.model_name} vs {compare_backend.model_name}"
+        ),
         # Token & Output Control
         max_new_tokens=max_new_tokens,
         limit_chars=limit_chars,
@@ -93,12 +227,381 @@ def MAV(
         # Version
         version=APP_VERSION,
         external_panels=external_panels,
+        branch_width=branch_width,
+        branch_steps=branch_steps,
+        plugin_time_budget=plugin_time_budget,
+        output_backend=output_backend,
+        prefetch_steps=prefetch_steps,
+        history_size=history_size,
     )
 
-    manager.state_loop(prompt)
+    # hooks go on the model itself, a caller's model_obj must not keep them
+    try:
+        if analyze:
+            manager.analysis_loop(prompt)
+        else:
+            manager.state_loop(prompt)
+    finally:
+        state_fetcher.close()
+
+
+def _build_intervention(
+    backend,
+    steering_vector=None,
+    steering_prompts=None,
+    steering_layer=None,
+    steering_scale=4.0,
+    ablate_heads=None,
+    ablate_layers=None,
+):
+    """
+    Hooks batch row 1 of the backend with the requested steering / ablations.
+    """
+    if steering_layer is None:
+        steering_layer = backend.model.config.num_hidden_layers // 2
+
+    vector = None
+    if steering_vector:
+        vector = load_steering_vector(steering_vector)
+    elif steering_prompts:
+        if len(steering_prompts) != 2:
+            raise ValueError("steering_prompts takes a positive and a negative prompt.")
+        positive, negative = steering_prompts
+        vector = backend.residual_vector(
+            positive, steering_layer
+        ) - backend.residual_vector(negative, steering_layer)
+
+    heads = []
+    for spec in ablate_heads or []:
+        layer, _, head = str(spec).partition(".")
+        if not head:
+            raise ValueError(f"Invalid head {spec!r}, expected layer.head.")
+        heads.append((int(layer), int(head)))
+
+    return backend.add_intervention(
+        rows=(1,),
+        steering_layer=steering_layer if vector is not None else None,
+        steering_vector=vector,
+        steering_scale=steering_scale,
+        ablate_heads=heads,
+        ablate_layers=[int(layer) for layer in ablate_layers or []],
+    )
+
+
+def MultiMAV(
+    models,
+    prompt: str,
+    max_new_tokens: int = 200,
+    limit_chars: int = 250,
+    temp: float = 0.0,
+    top_k: int = 50,
+    top_p: float = 1.0,
+    min_p: float = 0.0,
+    repetition_penalty: float = 1.0,
+    aggregation: str = "l2",
+    refresh_rate: float = 0.1,
+    selected_panels=None,
+    max_bar_length=50,
+    device: str = "cpu",
+    scale: str = "linear",
+    seed: int = 42,
+    prefill_chunk_size: int = 512,
+    external_panels=None,
+    output_backend: str = "rich",
+):
+    """
+    Watches several models generate from the same prompt side by side.
+
+    Every model runs in its own worker process with its own backend and
+    streams per-step statistics back through shared memory.
+    """
+    if not models:
+        print("models cannot be empty.")
+        return
+
+    if prompt is None or len(prompt) == 0:
+        print("Prompt cannot be empty.")
+        return
+
+    options = {
+        "device": device,
+        "seed": seed,
+        "max_new_tokens": max_new_tokens,
+        "aggregation": aggregation,
+        "scale": scale,
+        "max_bar_length": max_bar_length,
+        "prefill_chunk_size": prefill_chunk_size,
+        "sampling": {
+            "temperature": temp,
+            "top_k": top_k,
+            "top_p": top_p,
+            "min_p": min_p,
+            "repetition_penalty": repetition_penalty,
+        },
+    }
+    num_threads = max(1, (os.cpu_count() or 1) // len(models))
+    workers = [
+        ModelWorker(model, prompt, options, num_threads=num_threads)
+        for model in models
+    ]
+
+    manager = MainLoopManager(
+        state_provider=None,
+        model_name=", ".join(models),
+        refresh_rate=refresh_rate,
+        limit_chars=limit_chars,
+        max_bar_length=max_bar_length,
+        selected_panels=selected_panels,
+        version=APP_VERSION,
+        external_panels=external_panels,
+        output_backend=output_backend,
+    )
+
+    manager.multi_model_loop(workers)
+
+
+def profile_main(argv=None):
+    """
+    `mav profile`: reference statistics of a model over a local corpus.
+    """
+    parser = argparse.ArgumentParser(
+        prog="mav profile",
+        description="Profile per-layer, per-position statistics over a corpus",
+    )
+    parser.add_argument("--model", type=str, default="gpt2", help="Hugging Face model name")
+    parser.add_argument(
+        "--corpus",
+        type=str,
+        required=True,
+        help="JSONL file (one document per line) or plain text file "
+        "(documents separated by blank lines)",
+    )
+    parser.add_argument(
+        "--text-key", type=str, default="text", help="JSONL field holding the text"
+    )
+    parser.add_argument(
+        "--output", type=str, default="mav_profile.json", help="Report path"
+    )
+    parser.add_argument(
+        "--seq-len", type=int, default=256, help="Tokens per profiled window"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=8, help="Windows per forward pass"
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=None,
+        help="Stop after about this many tokens (default: whole corpus)",
+    )
+    parser.add_argument(
+        "--aggregation", type=str, choices=["l2", "max_abs"], default="l2"
+    )
+    parser.add_argument(
+        "--device", type=str, choices=["cpu", "cuda", "mps"], default="cpu"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    backend = TransformersBackend(
+        model_name=args.model, device=args.device, seed=args.seed
+    )
+    profiler = CorpusProfiler(
+        backend,
+        seq_len=args.seq_len,
+        batch_size=args.batch_size,
+        aggregation=args.aggregation,
+    )
+
+    def on_batch(profiler):
+        print(
+            f"\r{profiler.num_windows} windows | {profiler.num_tokens} tokens | "
+            f"{profiler.tokens_per_sec:.1f} tok/s",
+            end="",
+            flush=True,
+        )
+
+    profiler.profile(
+        read_corpus(args.corpus, text_key=args.text_key),
+        max_tokens=args.max_tokens,
+        on_batch=on_batch,
+    )
+    profiler.save(args.output)
+    print(f"\nprofile written to {args.output}")
+
+
+def ablate_main(argv=None):
+    """
+    `mav ablate`: importance of every attention head for a prompt's next token.
+    """
+    parser = argparse.ArgumentParser(
+        prog="mav ablate",
+        description="Ablate each attention head for the prompt's next-token "
+        "prediction and show the effect as a layer x head heatmap",
+    )
+    parser.add_argument("--model", type=str, default="gpt2", help="Hugging Face model name")
+    parser.add_argument("--prompt", type=str, default="Once upon a time", help="Prompt")
+    parser.add_argument(
+        "--prompt-file",
+        type=str,
+        default=None,
+        help="Read the prompt from a file instead of --prompt",
+    )
+    parser.add_argument(
+        "--metric",
+        type=str,
+        choices=["kl", "logit"],
+        default="kl",
+        help="kl: KL(clean || ablated) of the next-token distribution, "
+        "logit: change of the clean top-1 logit",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=32, help="Ablated heads per forward pass"
+    )
+    parser.add_argument(
+        "--selected-panels",
+        type=str,
+        nargs="+",
+        default=["top_predictions", "head_importance"],
+    )
+    parser.add_argument("--num-grid-rows", type=int, default=1)
+    parser.add_argument("--max-bar-length", type=int, default=35)
+    parser.add_argument("--limit-chars", type=int, default=400)
+    parser.add_argument(
+        "--interactive",
+        action="store_true",
+        default=False,
+        help="Keep the finished heatmap on screen until Enter",
+    )
+    parser.add_argument(
+        "--device", type=str, choices=["cpu", "cuda", "mps"], default="cpu"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    prompt = args.prompt
+    if args.prompt_file:
+        with open(args.prompt_file, "r", encoding="utf-8") as f:
+            prompt = f.read()
+
+    backend = TransformersBackend(
+        model_name=args.model, device=args.device, seed=args.seed
+    )
+    manager = MainLoopManager(
+        state_provider=StateFetcher(
+            backend, max_new_tokens=1, max_bar_length=args.max_bar_length
+        ),
+        model_name=args.model,
+        limit_chars=args.limit_chars,
+        interactive=args.interactive,
+        selected_panels=args.selected_panels,
+        num_grid_rows=args.num_grid_rows,
+        max_bar_length=args.max_bar_length,
+        version=APP_VERSION,
+    )
+    manager.ablation_loop(prompt, metric=args.metric, batch_size=args.batch_size)
+
+
+def query_main(argv=None):
+    """
+    `mav query`: finds steps of recorded runs by their metrics.
+    """
+    parser = argparse.ArgumentParser(
+        prog="mav query",
+        description="Query the steps of runs recorded with --record-dir, "
+        "no model is loaded",
+    )
+    parser.add_argument(
+        "runs", type=str, nargs="+", help="Run directories or directories holding runs"
+    )
+    parser.add_argument(
+        "--where",
+        type=str,
+        required=True,
+        help='Predicates joined by "and", e.g. '
+        '"attention_entropy[10] < 0.5 and top1_prob > 0.9". '
+        f"Columns: {', '.join(QUERY_COLUMNS)}",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=20, help="Matches listed per run (default: 20)"
+    )
+    parser.add_argument(
+        "--view",
+        action="store_true",
+        default=False,
+        help="Open the matching steps in the viewer",
+    )
+    parser.add_argument(
+        "--interactive",
+        action="store_true",
+        default=False,
+        help="Step through the matches with Enter / p / a match number / q",
+    )
+    parser.add_argument("--refresh-rate", type=float, default=0.5)
+    parser.add_argument(
+        "--selected-panels",
+        type=str,
+        nargs="+",
+        default=list(DEFAULT_PANELS),
+    )
+    parser.add_argument("--num-grid-rows", type=int, default=2)
+    parser.add_argument("--max-bar-length", type=int, default=35)
+    parser.add_argument("--limit-chars", type=int, default=400)
+    args = parser.parse_args(argv)
+
+    predicates = parse_query(args.where)
+    results = []
+    for run in find_runs(args.runs):
+        start = time.perf_counter()
+        steps = query_run(run, predicates)
+        seconds = time.perf_counter() - start
+        results.append((run, steps))
+        print(
+            f"{run.name} ({run.meta.get('model')}): {len(steps)}/{run.num_steps} "
+            f"steps match ({seconds * 1000:.1f} ms)"
+        )
+        for step in steps[: args.limit]:
+            measurements = run.measurements(int(step))
+            print(
+                f"  step {int(step) + 1:6d} | {measurements.predicted_char!r:>12} "
+                f"| top1 {float(measurements.top_probs[0]):.2f}"
+            )
+        if len(steps) > args.limit:
+            print(f"  ... {len(steps) - args.limit} more")
+
+    if not args.view:
+        return
+    for run, steps in results:
+        if not len(steps):
+            continue
+        MainLoopManager(
+            state_provider=None,
+            model_name=run.meta.get("model"),
+            refresh_rate=args.refresh_rate,
+            interactive=args.interactive,
+            limit_chars=args.limit_chars,
+            selected_panels=args.selected_panels,
+            num_grid_rows=args.num_grid_rows,
+            max_bar_length=args.max_bar_length,
+            version=APP_VERSION,
+        ).replay_loop(run, steps)
+
+
+# subcommands, plain `mav [flags]` keeps running the visualizer
+COMMANDS = {
+    "profile": profile_main,
+    "ablate": ablate_main,
+    "query": query_main,
+}
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="Model Activation Visualizer")
     parser.add_argument(
         "--model",
@@ -106,12 +609,33 @@ def main():
         default="gpt2",
         help="Hugging Face model name (default: gpt2)",
     )
+    parser.add_argument(
+        "--models",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Several Hugging Face models shown side by side, each in its own process",
+    )
     parser.add_argument(
         "--prompt",
         type=str,
         default="Once upon a timeline ",
         help="Initial prompt for text generation",
     )
+    parser.add_argument(
+        "--prompt-file",
+        type=str,
+        default=None,
+        help="Read the prompt from a file instead of --prompt",
+    )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        default=False,
+        help="Analyze the prompt in one forward pass and scrub through its "
+        "positions instead of generating (with --interactive: Enter/n next, "
+        "p previous, a number jumps, q quits)",
+    )
     parser.add_argument(
         "--max-new-tokens", type=int, default=200, help="Number of tokens to generate"
     )
@@ -132,10 +656,39 @@ def main():
     parser.add_argument(
         "--interactive",
         action="store_true",
-        help="Enable interactive mode (press Enter to continue)",
+        help="Enable interactive mode: space play/pause, n/right step, "
+        "p/left rewind, +/- speed, b branch into the top alternatives, q quit",
         default=False,
     )
 
+    parser.add_argument(
+        "--prefetch-steps",
+        type=int,
+        default=8,
+        help="Steps generated ahead while the interactive view waits (default: 8)",
+    )
+
+    parser.add_argument(
+        "--history-size",
+        type=int,
+        default=256,
+        help="Steps kept for rewinding in interactive mode (default: 256)",
+    )
+
+    parser.add_argument(
+        "--branch-width",
+        type=int,
+        default=4,
+        help="Alternatives followed when branching in interactive mode (default: 4)",
+    )
+
+    parser.add_argument(
+        "--branch-steps",
+        type=int,
+        default=10,
+        help="Tokens generated on every branch in interactive mode (default: 10)",
+    )
+
     parser.add_argument(
         "--device",
         type=str,
@@ -210,6 +763,226 @@ def main():
         help="Random seed for reproducibility (default: 42)",
     )
 
+    parser.add_argument(
+        "--prefill-chunk-size",
+        type=int,
+        default=512,
+        help="Prompt tokens per prefill chunk, 0 prefills in one pass (default: 512)",
+    )
+
+    parser.add_argument(
+        "--logit-lens-top-k",
+        type=int,
+        default=3,
+        help="Tokens shown per layer by the logit_lens panel (default: 3)",
+    )
+
+    parser.add_argument(
+        "--compare-model",
+        type=str,
+        default=None,
+        help="Second Hugging Face model sharing the tokenizer, decoded in lockstep "
+        "and diffed in the model_diff panel",
+    )
+
+    parser.add_argument(
+        "--teacher",
+        type=str,
+        choices=["base", "compare"],
+        default="base",
+        help="Model whose distribution picks the shared token stream (default: base)",
+    )
+
+    parser.add_argument(
+        "--prefix-cache-dir",
+        type=str,
+        default=None,
+        help="Directory of the on-disk prompt prefix KV cache (default: disabled)",
+    )
+
+    parser.add_argument(
+        "--prefix-cache-max-mb",
+        type=int,
+        default=2048,
+        help="Size cap of the prefix KV cache before LRU eviction (default: 2048)",
+    )
+
+    parser.add_argument(
+        "--record-dir",
+        type=str,
+        default=None,
+        help="Record every run's steps to a new directory under this path, "
+        "for `mav query`",
+    )
+
+    parser.add_argument(
+        "--capture-every",
+        type=int,
+        default=1,
+        help="Capture hidden states and attentions every Nth token only, the "
+        "tokens in between decode lean. 0 captures only on the thresholds "
+        "below (default: 1, every token)",
+    )
+
+    parser.add_argument(
+        "--capture-below-top1",
+        type=float,
+        default=None,
+        help="Adaptive capture: also capture a lean token whose top-1 "
+        "probability is below this",
+    )
+
+    parser.add_argument(
+        "--capture-above-entropy",
+        type=float,
+        default=None,
+        help="Adaptive capture: also capture a lean token whose next-token "
+        "entropy (nats) is above this",
+    )
+
+    parser.add_argument(
+        "--stream-window",
+        type=int,
+        default=None,
+        help="Streaming mode: keep only the attention sinks plus this many "
+        "recent positions in the KV cache, so generation runs at constant "
+        "memory past the model's context length (default: off)",
+    )
+
+    parser.add_argument(
+        "--stream-sink-tokens",
+        type=int,
+        default=4,
+        help="First positions kept as attention sinks in streaming mode (default: 4)",
+    )
+
+    parser.add_argument(
+        "--trajectory-layers",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Hidden state layers tracked by the residual_trajectory panel "
+        "(default: last layer)",
+    )
+
+    parser.add_argument(
+        "--attention-sources-top-k",
+        type=int,
+        default=3,
+        help="Attended positions shown per layer by the attention_sources panel "
+        "(default: 3)",
+    )
+
+    parser.add_argument(
+        "--mlp-neurons-top-k",
+        type=int,
+        default=4,
+        help="Strongest MLP neurons shown per layer by the mlp_neurons panel "
+        "(default: 4)",
+    )
+
+    parser.add_argument(
+        "--sae-path",
+        type=str,
+        default=None,
+        help="Sparse autoencoder checkpoint (.safetensors or a SAELens directory) "
+        "for the sae_features panel, memory-mapped",
+    )
+
+    parser.add_argument(
+        "--sae-layer",
+        type=int,
+        default=-1,
+        help="Hidden state index the SAE was trained on, 0 is the embedding "
+        "output (default: -1, the last layer)",
+    )
+
+    parser.add_argument(
+        "--sae-labels",
+        type=str,
+        default=None,
+        help="JSON file of SAE feature labels",
+    )
+
+    parser.add_argument(
+        "--sae-top-k",
+        type=int,
+        default=8,
+        help="Active SAE features shown by the sae_features panel (default: 8)",
+    )
+
+    parser.add_argument(
+        "--attention-rollout-top-k",
+        type=int,
+        default=5,
+        help="Prompt tokens shown by the attention_rollout panel, which only "
+        "runs when selected with --selected-panels (default: 5)",
+    )
+
+    parser.add_argument(
+        "--attention-rollout-memory-mb",
+        type=int,
+        default=64,
+        help="Memory budget of the rollout rows kept per session; past it the "
+        "oldest rows after the first tokens are dropped (default: 64)",
+    )
+
+    parser.add_argument(
+        "--steering-vector",
+        type=str,
+        default=None,
+        help="Steering vector file (.pt, .npy, .safetensors) added to a block's "
+        "output; the steered sequence runs next to the clean one in one batch",
+    )
+
+    parser.add_argument(
+        "--steering-prompts",
+        type=str,
+        nargs=2,
+        default=None,
+        metavar=("POSITIVE", "NEGATIVE"),
+        help="Build the steering vector as the difference of two prompts' "
+        "residuals at --steering-layer",
+    )
+
+    parser.add_argument(
+        "--steering-layer",
+        type=int,
+        default=None,
+        help="Block whose output is steered (default: middle layer)",
+    )
+
+    parser.add_argument(
+        "--steering-scale",
+        type=float,
+        default=4.0,
+        help="Multiplier of the steering vector (default: 4.0)",
+    )
+
+    parser.add_argument(
+        "--ablate-heads",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Attention heads zeroed in the intervened sequence, as layer.head",
+    )
+
+    parser.add_argument(
+        "--ablate-layers",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Blocks skipped in the intervened sequence",
+    )
+
+    parser.add_argument(
+        "--reference-profile",
+        type=str,
+        default=None,
+        help="Report written by `mav profile`, layers outside its p5-p95 band "
+        "are flagged in the activation and entropy panels",
+    )
+
     parser.add_argument(
         "--max-bar-length",
         type=int,
@@ -221,17 +994,28 @@ def main():
         "--selected-panels",
         type=str,
         nargs="+",
-        default=[
-            "generated_text",
-            "top_predictions",
-            "output_distribution",
-            "mlp_activations",
-            "attention_entropy",
-        ],
+        default=list(DEFAULT_PANELS),
         help="List of selected panels. Default: top_predictions, "
         "generated_text, mlp_activations, attention_entropy, output_distribution.",
     )
 
+    parser.add_argument(
+        "--plugin-time-budget",
+        type=float,
+        default=0.05,
+        help="Seconds a frame waits for external plugin panels before showing "
+        "their last render as stale (default: 0.05)",
+    )
+
+    parser.add_argument(
+        "--output-backend",
+        type=str,
+        choices=["rich", "cell_diff"],
+        default="rich",
+        help="Terminal output: rich repaints every frame, cell_diff only rewrites "
+        "changed cells and reports bytes per frame (default: rich)",
+    )
+
     parser.add_argument(
         "--num-grid-rows",
         type=int,
@@ -246,6 +1030,33 @@ def main():
         print(APP_VERSION)
         exit(0)
 
+    if args.prompt_file:
+        with open(args.prompt_file, encoding="utf-8") as f:
+            args.prompt = f.read()
+
+    if args.models:
+        MultiMAV(
+            models=args.models,
+            prompt=args.prompt,
+            max_new_tokens=args.max_new_tokens,
+            limit_chars=args.limit_chars,
+            temp=args.temp,
+            top_k=args.top_k,
+            top_p=args.top_p,
+            min_p=args.min_p,
+            repetition_penalty=args.repetition_penalty,
+            aggregation=args.aggregation,
+            refresh_rate=args.refresh_rate,
+            selected_panels=args.selected_panels,
+            max_bar_length=args.max_bar_length,
+            device=args.device,
+            scale=args.scale,
+            seed=args.seed,
+            prefill_chunk_size=args.prefill_chunk_size,
+            output_backend=args.output_backend,
+        )
+        return
+
     MAV(
         model=args.model,
         prompt=args.prompt,
@@ -265,11 +1076,46 @@ def main():
         selected_panels=args.selected_panels,
         num_grid_rows=args.num_grid_rows,
         max_bar_length=args.max_bar_length,
+        branch_width=args.branch_width,
+        branch_steps=args.branch_steps,
+        prefetch_steps=args.prefetch_steps,
+        history_size=args.history_size,
+        plugin_time_budget=args.plugin_time_budget,
+        output_backend=args.output_backend,
         scale=args.scale,
         # Execution & Backend Settings
         device=args.device,
         backend=args.backend,
         seed=args.seed,
+        prefill_chunk_size=args.prefill_chunk_size,
+        logit_lens_top_k=args.logit_lens_top_k,
+        compare_model=args.compare_model,
+        teacher=args.teacher,
+        prefix_cache_dir=args.prefix_cache_dir,
+        prefix_cache_max_mb=args.prefix_cache_max_mb,
+        record_dir=args.record_dir,
+        capture_every=args.capture_every,
+        capture_below_top1=args.capture_below_top1,
+        capture_above_entropy=args.capture_above_entropy,
+        stream_window=args.stream_window,
+        stream_sink_tokens=args.stream_sink_tokens,
+        trajectory_layers=args.trajectory_layers,
+        attention_sources_top_k=args.attention_sources_top_k,
+        mlp_neurons_top_k=args.mlp_neurons_top_k,
+        attention_rollout_top_k=args.attention_rollout_top_k,
+        attention_rollout_memory_mb=args.attention_rollout_memory_mb,
+        sae_path=args.sae_path,
+        sae_layer=args.sae_layer,
+        sae_labels=args.sae_labels,
+        sae_top_k=args.sae_top_k,
+        reference_profile=args.reference_profile,
+        analyze=args.analyze,
+        steering_vector=args.steering_vector,
+        steering_prompts=args.steering_prompts,
+        steering_layer=args.steering_layer,
+        steering_scale=args.steering_scale,
+        ablate_heads=args.ablate_heads,
+        ablate_layers=args.ablate_layers,
     )
 
 
@@ -0,0 +1,261 @@
+import json
+import time
+
+import numpy as np
+
+from openmav.converters.data_converter import DataConverter
+from openmav.converters.streaming_sketches import (CellHistograms, KLLSketch,
+                                                   RunningMoments,
+                                                   position_bucket)
+
+PROFILE_VERSION = 1
+PROFILE_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def read_corpus(path, text_key="text"):
+    """
+    Streams documents from a local corpus without loading it.
+
+    .jsonl files yield the text_key field of every line, any other file is
+    read as plain text with documents separated by blank lines.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    text = json.loads(line).get(text_key)
+                    if text:
+                        yield text
+            return
+
+        paragraph = []
+        for line in f:
+            if line.strip():
+                paragraph.append(line)
+            elif paragraph:
+                yield "".join(paragraph)
+                paragraph = []
+        if paragraph:
+            yield "".join(paragraph)
+
+
+class _MetricProfile:
+    """Moments, quantile sketches and optional histograms over (layer, bucket) cells."""
+
+    def __init__(self, num_layers, num_buckets, histogram_edges=None, sketch_k=128):
+        num_cells = num_layers * num_buckets
+        self.shape = (num_layers, num_buckets)
+        self.moments = RunningMoments(num_cells)
+        self.sketches = [KLLSketch(k=sketch_k, seed=cell) for cell in range(num_cells)]
+        self.histograms = (
+            CellHistograms(num_cells, histogram_edges)
+            if histogram_edges is not None
+            else None
+        )
+
+    def update(self, values, buckets, mask):
+        """values [layers, batch, seq], buckets [seq], mask [batch, seq]"""
+        num_layers, num_buckets = self.shape
+        cells = (
+            np.arange(num_layers)[:, None, None] * num_buckets + buckets[None, None, :]
+        )
+        cells = np.broadcast_to(cells, values.shape)
+        valid = np.broadcast_to(mask[None].astype(bool), values.shape)
+        cells, values = cells[valid], values[valid]
+
+        self.moments.update(cells, values)
+        if self.histograms is not None:
+            self.histograms.update(cells, values)
+        order = np.argsort(cells, kind="stable")
+        cells, values = cells[order], values[order]
+        bounds = np.searchsorted(cells, np.arange(len(self.sketches) + 1))
+        for cell, sketch in enumerate(self.sketches):
+            sketch.update(values[bounds[cell] : bounds[cell + 1]])
+
+    def report(self, decimals=4):
+        def table(array):
+            return np.round(array.reshape(*self.shape, *array.shape[1:]), decimals).tolist()
+
+        report = {
+            "count": self.moments.count.reshape(self.shape).tolist(),
+            "mean": table(self.moments.mean),
+            "std": table(self.moments.std),
+            "quantiles": table(
+                np.stack([sketch.quantiles(PROFILE_QUANTILES) for sketch in self.sketches])
+            ),
+        }
+        if self.histograms is not None:
+            report["histogram"] = {
+                "edges": np.round(self.histograms.edges, decimals).tolist(),
+                "counts": self.histograms.counts.reshape(
+                    *self.shape, self.histograms.num_bins
+                ).tolist(),
+            }
+        return report
+
+
+class CorpusProfiler:
+    """
+    Reference statistics of a model's internals over a corpus.
+
+    Documents are cut into windows of seq_len tokens and run batch_size at a
+    time through one teacher-forced forward pass each. Every position's
+    per-layer activation and attention entropy goes into streaming sketches
+    keyed by (layer, log2 position bucket), so memory doesn't depend on the
+    corpus size.
+    """
+
+    def __init__(
+        self,
+        backend,
+        seq_len=256,
+        batch_size=8,
+        aggregation="l2",
+        entropy_bins=32,
+        sketch_k=128,
+    ):
+        self.backend = backend
+        self.seq_len = seq_len
+        self.batch_size = batch_size
+        self.aggregation = aggregation
+        self.entropy_bins = entropy_bins
+        self.sketch_k = sketch_k
+        self.data_converter = DataConverter()
+        self.num_buckets = int(position_bucket(seq_len - 1)) + 1
+        self.metrics = None
+        self.num_tokens = 0
+        self.num_windows = 0
+        self.seconds = 0.0
+
+    def _windows(self, texts):
+        for text in texts:
+            ids = self.backend.tokenize(text).tolist()[0]
+            for start in range(0, len(ids), self.seq_len):
+                window = ids[start : start + self.seq_len]
+                if len(window) > 1:
+                    yield window
+
+    def _run_batch(self, windows):
+        length = max(len(window) for window in windows)
+        pad_id = self.backend.tokenizer.pad_token_id or 0
+        input_ids = [window + [pad_id] * (length - len(window)) for window in windows]
+        mask = np.array([[1] * len(w) + [0] * (length - len(w)) for w in windows])
+
+        outputs = self.backend.forward(input_ids, attention_mask=mask)
+        activations, entropy = self.data_converter.process_position_statistics(
+            outputs["hidden_states"], outputs["attentions"], self.aggregation
+        )
+
+        if self.metrics is None:
+            self.metrics = {
+                "mlp_activations": _MetricProfile(
+                    activations.shape[0], self.num_buckets, sketch_k=self.sketch_k
+                ),
+                # attention entropy is bounded by log(context length)
+                "attention_entropy": _MetricProfile(
+                    entropy.shape[0],
+                    self.num_buckets,
+                    histogram_edges=np.linspace(
+                        0.0, np.log(self.seq_len), self.entropy_bins + 1
+                    ),
+                    sketch_k=self.sketch_k,
+                ),
+            }
+
+        buckets = position_bucket(np.arange(length))
+        self.metrics["mlp_activations"].update(activations, buckets, mask)
+        self.metrics["attention_entropy"].update(entropy, buckets, mask)
+        self.num_tokens += int(mask.sum())
+        self.num_windows += len(windows)
+
+    def profile(self, texts, max_tokens=None, on_batch=None):
+        """
+        Accumulates statistics over texts, an iterable of documents.
+
+        Args:
+            texts (iterable): Documents, e.g. from read_corpus
+            max_tokens (int): Stop after about this many tokens, None for all
+            on_batch (callable): Optional, called with the profiler after every batch
+
+        Returns:
+            CorpusProfiler: self
+        """
+        batch = []
+        for window in self._windows(texts):
+            batch.append(window)
+            if len(batch) < self.batch_size:
+                continue
+            self._timed_batch(batch, on_batch)
+            batch = []
+            if max_tokens is not None and self.num_tokens >= max_tokens:
+                return self
+        if batch:
+            self._timed_batch(batch, on_batch)
+        return self
+
+    def _timed_batch(self, batch, on_batch):
+        start = time.perf_counter()
+        self._run_batch(batch)
+        self.seconds += time.perf_counter() - start
+        if on_batch is not None:
+            on_batch(self)
+
+    @property
+    def tokens_per_sec(self):
+        return self.num_tokens / self.seconds if self.seconds > 0 else 0.0
+
+    def report(self):
+        if self.metrics is None:
+            raise ValueError("Nothing profiled, the corpus has no usable text.")
+        return {
+            "version": PROFILE_VERSION,
+            "model": self.backend.model_name,
+            "aggregation": self.aggregation,
+            "seq_len": self.seq_len,
+            "num_tokens": self.num_tokens,
+            "num_windows": self.num_windows,
+            "quantiles": list(PROFILE_QUANTILES),
+            "metrics": {name: metric.report() for name, metric in self.metrics.items()},
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, separators=(",", ":"))
+
+
+class ReferenceProfile:
+    """
+    A saved corpus profile, used as reference bands by the live panels.
+    """
+
+    def __init__(self, report):
+        if report.get("version") != PROFILE_VERSION:
+            raise ValueError(f"Unsupported profile version: {report.get('version')}")
+        self.model = report["model"]
+        self.aggregation = report["aggregation"]
+        self.seq_len = report["seq_len"]
+        self.quantile_levels = np.asarray(report["quantiles"])
+        self.quantiles = {
+            name: np.asarray(metric["quantiles"], dtype=float)
+            for name, metric in report["metrics"].items()
+        }
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def band(self, metric, position, low=0.05, high=0.95):
+        """
+        Per-layer (low, high) quantiles at a token position.
+
+        Positions past the profiled window use its last bucket.
+
+        Returns:
+            numpy.ndarray: [2, layers]
+        """
+        table = self.quantiles[metric]
+        bucket = min(int(position_bucket(position)), table.shape[1] - 1)
+        columns = [int(np.argmin(np.abs(self.quantile_levels - q))) for q in (low, high)]
+        return table[:, bucket, columns].T
@@ -0,0 +1,112 @@
+import numpy as np
+import torch
+
+ABLATION_METRICS = ("kl", "logit")
+
+
+def head_ablation_scan(
+    backend,
+    state_processor,
+    prompt_ids,
+    past_key_values,
+    metric="kl",
+    batch_size=32,
+):
+    """
+    Measures how much every attention head matters for the next token.
+
+    Each (layer, head) variant is one batch row with that head masked out
+    (see hooks.HeadMask), batch_size variants go through a single decode
+    step. All rows share the clean prefix KV cache of prompt_ids[:-1], so a
+    head is ablated for the last position only, which is the one predicting
+    the next token.
+
+    Args:
+        backend (ModelBackend): Backend with head_mask() support
+        state_processor (StateProcessor): Builds the unablated step's measurements
+        prompt_ids (list): Prompt token ids
+        past_key_values: Clean cache of prompt_ids[:-1], None for one token
+        metric (str): "kl" for KL(clean || ablated) of the next-token
+            distribution, "logit" for the change of the clean top-1 logit
+        batch_size (int): Rows per forward pass, the first batch also carries
+            the clean row
+
+    Yields:
+        ModelMeasurements: The clean step with head_importance [layers, heads]
+        filled in so far, NaN where not measured yet
+    """
+    if metric not in ABLATION_METRICS:
+        raise ValueError(f"Invalid metric. Choose from: {', '.join(ABLATION_METRICS)}.")
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+
+    head_mask = backend.head_mask()
+    num_layers, num_heads = head_mask.num_layers, head_mask.num_heads
+    variants = [(layer, head) for layer in range(num_layers) for head in range(num_heads)]
+    importance = np.full((num_layers, num_heads), np.nan, dtype=np.float32)
+
+    measurements = None
+    clean_log_probs = None
+    clean_top_id = None
+    index = 0
+    try:
+        while index < len(variants):
+            # the clean row rides along in the first batch
+            rows = [None] if clean_log_probs is None else []
+            rows += variants[index : index + batch_size - len(rows)]
+            masks = torch.ones(num_layers, len(rows), num_heads, device=backend.device)
+            for row, variant in enumerate(rows):
+                if variant is not None:
+                    masks[variant[0], row, variant[1]] = 0
+            head_mask.masks = masks
+
+            cache = (
+                backend.fork_cache(past_key_values, len(rows))
+                if past_key_values is not None
+                else None
+            )
+            outputs = backend.generate(
+                [prompt_ids] * len(rows),
+                temperature=0.0,
+                top_k=0,
+                top_p=1.0,
+                min_p=0.0,
+                repetition_penalty=1.0,
+                past_key_values=cache,
+            )
+            logits = outputs["logits"][:, -1, :].float()
+            log_probs = torch.log_softmax(logits, dim=-1)
+
+            if clean_log_probs is None:
+                clean_log_probs = log_probs[0]
+                clean_probs = clean_log_probs.exp()
+                top_probs, top_ids = torch.topk(clean_probs, 20)
+                clean_top_id = int(top_ids[0])
+                clean_top_logit = logits[0, clean_top_id]
+                measurements = state_processor.next(
+                    prompt_ids + [clean_top_id],
+                    clean_top_id,
+                    tuple(layer[:1] for layer in outputs["hidden_states"]),
+                    tuple(layer[:1] for layer in outputs["attentions"]),
+                    outputs["logits"][:1],
+                    clean_probs,
+                    top_ids,
+                    top_probs,
+                    backend,
+                    stateful=False,
+                )
+                measurements.head_importance_metric = metric
+                logits, log_probs, rows = logits[1:], log_probs[1:], rows[1:]
+
+            if metric == "kl":
+                scores = (clean_probs * (clean_log_probs - log_probs)).sum(dim=-1)
+            else:
+                scores = logits[:, clean_top_id] - clean_top_logit
+            for (layer, head), score in zip(rows, scores.tolist()):
+                importance[layer, head] = score
+            index += len(rows)
+
+            measurements.head_importance = importance.copy()
+            yield measurements
+    finally:
+        head_mask.masks = None
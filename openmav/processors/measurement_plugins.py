@@ -0,0 +1,95 @@
+import torch
+
+# tensors of a decode step a measurement plugin can ask for, all batched:
+# hidden_states / attentions are per-layer tuples of [batch, ...] device
+# tensors, logits are the step's processed scores [batch, 1, vocab],
+# next_token_probs [batch, vocab], mlp_neurons (ids, values) [layers, batch, k]
+CAPTURE_INPUTS = (
+    "hidden_states",
+    "attentions",
+    "logits",
+    "next_token_probs",
+    "mlp_neurons",
+)
+
+
+class MeasurementPlugin:
+    """
+    A custom metric computed from the raw capture of a decode step.
+
+    Subclasses list the tensors they need in inputs and implement reduce(),
+    which gets them as keyword arguments while they are still on the device,
+    with every sequence of the step in the batch dimension. It returns a dict
+    of small tensors whose first dimension is the batch; each sequence's row
+    is moved to the CPU and attached as measurements.plugin_outputs[name].
+    """
+
+    name = None  # key under plugin_outputs, defaults to the class name
+    inputs = ()
+
+    def reduce(self, **captured):
+        raise NotImplementedError("Subclasses must implement reduce()")
+
+
+class MeasurementRegistry:
+    """
+    Runs the registered MeasurementPlugins once per decode step.
+    """
+
+    def __init__(self, plugins=None):
+        self.plugins = {}
+        for plugin in plugins or []:
+            self.register(plugin)
+
+    def __bool__(self):
+        return bool(self.plugins)
+
+    def register(self, plugin):
+        """
+        Adds a MeasurementPlugin class or instance.
+        """
+        if isinstance(plugin, type):
+            plugin = plugin()
+        unknown = set(plugin.inputs) - set(CAPTURE_INPUTS)
+        if unknown:
+            raise ValueError(
+                f"{type(plugin).__name__} asks for unknown inputs {sorted(unknown)}, "
+                f"choose from: {', '.join(CAPTURE_INPUTS)}."
+            )
+        name = plugin.name or type(plugin).__name__
+        if name in self.plugins:
+            raise ValueError(f"A measurement plugin named {name} is already registered.")
+        self.plugins[name] = plugin
+        return plugin
+
+    def reduce(self, **captured):
+        """
+        Runs every plugin on one step's batched capture.
+
+        Returns:
+            dict: plugin name -> its batched outputs, still on the device
+        """
+        if not self.plugins:
+            return None
+        with torch.no_grad():
+            return {
+                name: plugin.reduce(
+                    **{key: captured.get(key) for key in plugin.inputs}
+                )
+                for name, plugin in self.plugins.items()
+            }
+
+    @staticmethod
+    def row(reduced, row):
+        """
+        One sequence's plugin outputs, moved to the CPU.
+        """
+        if reduced is None:
+            return None
+        return {
+            name: {
+                key: value[row].cpu() if isinstance(value, torch.Tensor) else value[row]
+                for key, value in outputs.items()
+            }
+            for name, outputs in reduced.items()
+        }
@@ -0,0 +1,287 @@
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+from openmav.api.measurements import ModelMeasurements
+
+HEADER_FIELDS = 8  # int64: written, done, failed, stop, then spare
+HEADER_BYTES = HEADER_FIELDS * 8
+ERROR_BYTES = 1024
+
+WRITTEN, DONE, FAILED, STOP = range(4)
+
+
+def step_record_dtype(max_layers=128, top_n=20, dist_n=100, text_bytes=4096):
+    """
+    Fixed layout of one step in the shared-memory ring buffer.
+    """
+    return np.dtype(
+        [
+            ("seq", np.int64),
+            ("num_layers", np.int32),
+            ("num_entropy", np.int32),
+            ("vocab_size", np.int64),
+            ("decode_tokens_per_sec", np.float32),
+            ("captured", np.bool_),
+            ("captured_step", np.int64),  # -1 when unknown
+            ("mlp", np.float32, (max_layers,)),
+            ("mlp_normalized", np.float32, (max_layers,)),
+            ("entropy", np.float32, (max_layers,)),
+            ("entropy_normalized", np.float32, (max_layers,)),
+            ("top_ids", np.int64, (top_n,)),
+            ("top_probs", np.float32, (top_n,)),
+            ("top_logits", np.float32, (top_n,)),
+            ("dist_probs", np.float32, (dist_n,)),
+            ("text_len", np.int32),
+            ("text", np.uint8, (text_bytes,)),
+            ("predicted_len", np.int32),
+            ("predicted", np.uint8, (64,)),
+            ("labels_len", np.int32),
+            ("labels", np.uint8, (top_n * 48,)),
+        ]
+    )
+
+
+def _put_bytes(record, field, length_field, text, keep_tail=False):
+    data = text.encode("utf-8", errors="replace")
+    capacity = record[field].shape[0]
+    if len(data) > capacity:
+        data = data[-capacity:] if keep_tail else data[:capacity]
+    record[field][: len(data)] = np.frombuffer(data, dtype=np.uint8)
+    record[length_field] = len(data)
+
+
+def _get_bytes(record, field, length_field):
+    return bytes(record[field][: record[length_field]]).decode("utf-8", errors="ignore")
+
+
+def fill_step_record(record, measurements: ModelMeasurements):
+    """
+    Writes the displayed parts of measurements into one step record.
+    """
+    max_layers = record["mlp"].shape[0]
+    mlp = np.asarray(measurements.mlp_activations, dtype=np.float32).reshape(-1)
+    entropy = np.asarray(
+        measurements.attention_entropy_values, dtype=np.float32
+    ).reshape(-1)
+    num_layers = min(len(mlp), max_layers)
+    num_entropy = min(len(entropy), max_layers)
+    record["num_layers"] = num_layers
+    record["num_entropy"] = num_entropy
+    record["mlp"][:num_layers] = mlp[:num_layers]
+    record["mlp_normalized"][:num_layers] = np.asarray(
+        measurements.mlp_normalized, dtype=np.float32
+    ).reshape(-1)[:num_layers]
+    record["entropy"][:num_entropy] = entropy[:num_entropy]
+    record["entropy_normalized"][:num_entropy] = np.asarray(
+        measurements.attention_entropy_values_normalized, dtype=np.float32
+    ).reshape(-1)[:num_entropy]
+
+    top_n = record["top_ids"].shape[0]
+    top_ids = measurements.top_ids[:top_n]
+    record["top_ids"][: len(top_ids)] = top_ids.numpy()
+    record["top_probs"][: len(top_ids)] = measurements.top_probs[:top_n].numpy()
+    record["top_logits"][: len(top_ids)] = (
+        measurements.logits[0, -1, top_ids].float().numpy()
+    )
+    record["vocab_size"] = measurements.logits.shape[-1]
+
+    dist_n = record["dist_probs"].shape[0]
+    dist = torch.topk(measurements.next_token_probs, dist_n).values
+    record["dist_probs"][:] = dist.float().cpu().numpy()[::-1]
+    record["decode_tokens_per_sec"] = measurements.decode_tokens_per_sec
+    record["captured"] = measurements.captured
+    record["captured_step"] = (
+        -1 if measurements.captured_step is None else measurements.captured_step
+    )
+
+    _put_bytes(record, "text", "text_len", measurements.generated_text, keep_tail=True)
+    _put_bytes(record, "predicted", "predicted_len", measurements.predicted_char)
+    _put_bytes(
+        record, "labels", "labels_len", "\x00".join(measurements.decoded_tokens)
+    )
+
+
+def measurements_from_record(record) -> ModelMeasurements:
+    """
+    ModelMeasurements rebuilt from a step record, enough for the panels.
+    """
+    num_layers = int(record["num_layers"])
+    num_entropy = int(record["num_entropy"])
+    top_ids = torch.from_numpy(record["top_ids"].copy())
+    # only the top logits travel, enough for the panels that index them
+    logits = torch.zeros(1, 1, int(record["vocab_size"]))
+    logits[0, 0, top_ids] = torch.from_numpy(record["top_logits"].copy())
+
+    return ModelMeasurements(
+        mlp_activations=record["mlp"][:num_layers].astype(float),
+        mlp_normalized=record["mlp_normalized"][:num_layers].astype(float),
+        attention_entropy_values=record["entropy"][:num_entropy].astype(float),
+        attention_entropy_values_normalized=record["entropy_normalized"][
+            :num_entropy
+        ].astype(float),
+        generated_text=_get_bytes(record, "text", "text_len"),
+        predicted_char=_get_bytes(record, "predicted", "predicted_len"),
+        next_token_probs=torch.from_numpy(record["dist_probs"].copy()),
+        top_ids=top_ids,
+        top_probs=torch.from_numpy(record["top_probs"].copy()),
+        logits=logits,
+        decoded_tokens=_get_bytes(record, "labels", "labels_len").split("\x00"),
+        decode_tokens_per_sec=float(record["decode_tokens_per_sec"]),
+        captured=bool(record["captured"]),
+        captured_step=(
+            int(record["captured_step"]) if record["captured_step"] >= 0 else None
+        ),
+    )
+
+
+class StepRingBuffer:
+    """
+    Single producer ring of per-step statistics in shared memory.
+
+    The worker writes fixed-size numpy records in place, no pickling is
+    involved. A writer sets a slot's sequence number to -1 while filling it.
+    A reader checks the sequence number before and after copying the slot
+    and retries when it changed in between, seqlock style.
+    """
+
+    def __init__(self, name=None, num_slots=8, record_dtype=None, create=False):
+        self.record_dtype = record_dtype or step_record_dtype()
+        self.num_slots = num_slots
+        size = HEADER_BYTES + ERROR_BYTES + num_slots * self.record_dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        self.error = np.ndarray(
+            (ERROR_BYTES,), dtype=np.uint8, buffer=self.shm.buf, offset=HEADER_BYTES
+        )
+        self.records = np.ndarray(
+            (num_slots,),
+            dtype=self.record_dtype,
+            buffer=self.shm.buf,
+            offset=HEADER_BYTES + ERROR_BYTES,
+        )
+        if create:
+            self.header[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, measurements: ModelMeasurements):
+        seq = int(self.header[WRITTEN])
+        record = self.records[seq % self.num_slots]
+        record["seq"] = -1
+
+        fill_step_record(record, measurements)
+        record["seq"] = seq
+        self.header[WRITTEN] = seq + 1
+
+    def latest(self, retries=3):
+        """
+        Newest complete step as ModelMeasurements, None before the first one
+        or when every read raced with the writer.
+        """
+        for _ in range(retries):
+            written = int(self.header[WRITTEN])
+            if written == 0:
+                return None
+            seq = written - 1
+            slot = seq % self.num_slots
+            if int(self.records[slot]["seq"]) != seq:
+                continue
+            record = self.records[slot : slot + 1].copy()[0]
+            # the writer bumps seq to -1 before touching the slot
+            if int(self.records[slot]["seq"]) == seq and record["seq"] == seq:
+                return measurements_from_record(record)
+        return None
+
+    def set_error(self, message):
+        data = message.encode("utf-8", errors="replace")[:ERROR_BYTES]
+        self.error[: len(data)] = np.frombuffer(data, dtype=np.uint8)
+        self.header[FAILED] = len(data)
+
+    def get_error(self):
+        length = int(self.header[FAILED])
+        if length == 0:
+            return None
+        return bytes(self.error[:length]).decode("utf-8", errors="ignore")
+
+    def close(self, unlink=False):
+        # numpy views keep the buffer exported, drop them before closing
+        del self.header, self.error, self.records
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _worker_main(shm_name, num_slots, model_name, prompt, options, num_threads):
+    from openmav.backends.model_backend_transformers import TransformersBackend
+    from openmav.processors.state_fetcher import StateFetcher
+
+    torch.set_num_threads(num_threads)
+    ring = StepRingBuffer(name=shm_name, num_slots=num_slots)
+    try:
+        backend = TransformersBackend(
+            model_name=model_name, device=options["device"], seed=options["seed"]
+        )
+        state_fetcher = StateFetcher(
+            backend,
+            max_new_tokens=options["max_new_tokens"],
+            aggregation=options["aggregation"],
+            scale=options["scale"],
+            max_bar_length=options["max_bar_length"],
+            prefill_chunk_size=options["prefill_chunk_size"],
+        )
+        for measurements in state_fetcher.fetch_next(prompt, **options["sampling"]):
+            ring.write(measurements)
+            if ring.header[STOP]:
+                break
+    except Exception as e:
+        ring.set_error(f"{type(e).__name__}: {e}")
+    finally:
+        ring.header[DONE] = 1
+        ring.close()
+
+
+class ModelWorker:
+    """
+    Runs one model in its own process and streams its steps back through a
+    StepRingBuffer.
+    """
+
+    def __init__(self, model_name, prompt, options, num_threads=None, num_slots=8):
+        self.model_name = model_name
+        self.ring = StepRingBuffer(num_slots=num_slots, create=True)
+        num_threads = num_threads or max(1, (os.cpu_count() or 1) // 2)
+
+        # spawn: a forked child would inherit the parent's torch thread pools
+        context = mp.get_context("spawn")
+        self.process = context.Process(
+            target=_worker_main,
+            args=(self.ring.name, num_slots, model_name, prompt, options, num_threads),
+            daemon=True,
+        )
+
+    def start(self):
+        self.process.start()
+
+    def latest(self):
+        return self.ring.latest()
+
+    @property
+    def done(self):
+        return bool(self.ring.header[DONE]) or self.process.exitcode is not None
+
+    @property
+    def error(self):
+        return self.ring.get_error()
+
+    def close(self):
+        self.ring.header[STOP] = 1
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close(unlink=True)
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import time
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class PrefixKVCache:
+    """
+    Content addressed on-disk store of prompt prefix KV states.
+
+    Every stored prompt is one safetensors file keyed by a hash of the model
+    namespace (name, revision, dtype) and its token ids. Hashes of the prompt
+    at every block_size boundary point back at that file, so a later prompt
+    sharing only a leading system prompt still restores the longest shared
+    block-aligned prefix. A block hash lists every file holding it, so it
+    stays a hit until the last of them is evicted. Files are evicted least recently used first once
+    the store grows past max_bytes. Every index update re-reads index.json
+    under an exclusive lock on index.lock, so processes sharing cache_dir
+    merge their entries instead of overwriting each other's.
+    """
+
+    INDEX_FILE = "index.json"
+    LOCK_FILE = "index.lock"
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024**3, block_size=64):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, self.INDEX_FILE)
+
+    def _entry_path(self, entry_key):
+        return os.path.join(self.cache_dir, f"{entry_key}.safetensors")
+
+    def _load_index(self):
+        try:
+            with open(self._index_path()) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("entries", {})
+        index.setdefault("prefixes", {})
+        for key, targets in index["prefixes"].items():
+            if isinstance(targets, str):  # single target per prefix before
+                index["prefixes"][key] = [targets]
+        return index
+
+    @contextmanager
+    def _locked(self):
+        """Holds the cross-process lock and refreshes self.index from disk."""
+        with open(os.path.join(self.cache_dir, self.LOCK_FILE), "a+") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            else:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                self.index = self._load_index()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                else:
+                    lock.seek(0)
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _save_index(self):
+        tmp_path = f"{self._index_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _prefix_keys(self, namespace, token_ids):
+        """
+        Rolling hashes of token_ids at every block boundary and at full length.
+
+        Returns:
+            list: (length, key) pairs, shortest first
+        """
+        digest = hashlib.sha256(json.dumps(namespace, sort_keys=True).encode())
+        lengths = list(range(self.block_size, len(token_ids), self.block_size))
+        lengths.append(len(token_ids))
+
+        keys = []
+        previous = 0
+        for length in lengths:
+            digest.update(array("q", token_ids[previous:length]).tobytes())
+            keys.append((length, digest.hexdigest()))
+            previous = length
+        return keys
+
+    def lookup(self, namespace, token_ids, device="cpu"):
+        """
+        Finds the longest cached prefix of token_ids.
+
+        Returns:
+            tuple: (prefix length, list of per-layer (key, value) tensors or None)
+        """
+        if not token_ids:
+            return 0, None
+
+        # held while reading so no other process evicts the file mid-read
+        with self._locked():
+            entries = self.index["entries"]
+            for length, key in reversed(self._prefix_keys(namespace, token_ids)):
+                candidates = [key] + self.index["prefixes"].get(key, [])
+                candidates = [
+                    entry_key
+                    for entry_key in candidates
+                    if entry_key in entries
+                    and os.path.exists(self._entry_path(entry_key))
+                ]
+                if not candidates:
+                    continue
+                entry_key = max(candidates, key=lambda k: entries[k]["last_used"])
+
+                layers = self._read(entry_key, length, device)
+                entries[entry_key]["last_used"] = time.time()
+                self._save_index()
+                return length, layers
+
+        return 0, None
+
+    def _read(self, entry_key, length, device):
+        from safetensors import safe_open
+
+        # only the first length positions of every tensor are read from disk
+        def read_prefix(f, name):
+            tensor = f.get_slice(name)
+            rank = len(tensor.get_shape())
+            return tensor[(slice(None),) * (rank - 2) + (slice(0, length), slice(None))]
+
+        with safe_open(
+            self._entry_path(entry_key), framework="pt", device=str(device)
+        ) as f:
+            num_layers = len(f.keys()) // 2
+            return [
+                (read_prefix(f, f"key.{i}"), read_prefix(f, f"value.{i}"))
+                for i in range(num_layers)
+            ]
+
+    def store(self, namespace, token_ids, layers):
+        """
+        Saves the KV state of token_ids unless it is already cached.
+
+        Args:
+            namespace (dict): Model identity, see TransformersBackend.cache_namespace
+            token_ids (list): Token ids the KV state covers
+            layers (list): Per-layer (key, value) tensors
+        """
+        from safetensors.torch import save_file
+
+        prefix_keys = self._prefix_keys(namespace, token_ids)
+        entry_key = prefix_keys[-1][1]
+        with self._locked():
+            if entry_key in self.index["entries"]:
+                return
+
+        # written outside the lock, then published with the index update
+        tensors = {}
+        for i, (key, value) in enumerate(layers):
+            tensors[f"key.{i}"] = key.detach().to("cpu").contiguous()
+            tensors[f"value.{i}"] = value.detach().to("cpu").contiguous()
+        tmp_path = f"{self._entry_path(entry_key)}.{os.getpid()}.tmp"
+        save_file(tensors, tmp_path, metadata={"length": str(len(token_ids))})
+
+        with self._locked():
+            if entry_key in self.index["entries"]:  # stored by another process
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, self._entry_path(entry_key))
+
+            self.index["entries"][entry_key] = {
+                "length": len(token_ids),
+                "bytes": os.path.getsize(self._entry_path(entry_key)),
+                "last_used": time.time(),
+            }
+            for _, key in prefix_keys[:-1]:
+                targets = self.index["prefixes"].setdefault(key, [])
+                if entry_key not in targets:
+                    targets.append(entry_key)
+
+            self._evict(keep=entry_key)
+            self._save_index()
+
+    def _evict(self, keep=None):
+        entries = self.index["entries"]
+        total_bytes = sum(entry["bytes"] for entry in entries.values())
+
+        for entry_key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total_bytes <= self.max_bytes:
+                break
+            if entry_key == keep:
+                continue
+
+            total_bytes -= entries.pop(entry_key)["bytes"]
+            try:
+                os.remove(self._entry_path(entry_key))
+            except OSError:
+                pass
+            # the prefixes stay hits through the other files holding them
+            prefixes = {}
+            for key, targets in self.index["prefixes"].items():
+                targets = [target for target in targets if target != entry_key]
+                if targets:
+                    prefixes[key] = targets
+            self.index["prefixes"] = prefixes
@@ -0,0 +1,389 @@
+import json
+import operator
+import os
+import re
+import time
+import warnings
+
+import numpy as np
+import torch
+
+from openmav.processors.model_worker import (fill_step_record,
+                                             measurements_from_record,
+                                             step_record_dtype)
+
+RUN_VERSION = 2  # 2: steps.bin records carry captured / captured_step
+ZONE_BLOCK = 1024  # steps per zone map block
+# per-step metrics kept as memory-mapped float32 columns, the per-layer ones
+# are [steps, layers] and queried as name[layer]
+QUERY_COLUMNS = ("top1_prob", "entropy", "mlp_activations", "attention_entropy")
+# measured on captured steps only, NaN on lean ones so no predicate matches
+LAYER_COLUMNS = ("mlp_activations", "attention_entropy")
+QUERY_OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+}
+PREDICATE_PATTERN = re.compile(
+    r"^\s*(?P<column>\w+)\s*(?:\[\s*(?P<index>-?\d+)\s*\])?\s*"
+    r"(?P<op><=|>=|==|<|>)\s*(?P<value>[-+0-9.eE]+)\s*$"
+)
+# using the sorted view only pays off for selective predicates, otherwise
+# the zone-map scan over the columns is cheaper than gathering rows
+SORTED_VIEW_MAX_FRACTION = 0.125
+
+
+class RunRecorder:
+    """
+    Appends every step of a run to a directory of memory-mappable files.
+
+    Query columns (QUERY_COLUMNS) are raw float32 files, one row per step,
+    so a reader maps each one as a [steps, width] array. steps.bin holds
+    the displayed parts of every step as fixed-size records, from which the
+    viewer rebuilds ModelMeasurements without the model.
+    """
+
+    def __init__(self, directory, model_name=None, prompt=None, text_bytes=1024):
+        self.directory = directory
+        self.model_name = model_name
+        self.prompt = prompt
+        self.text_bytes = text_bytes
+        self.num_steps = 0
+        self._files = None
+        self._record = None
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def create(cls, root, **kwargs):
+        """A new run directory under root, named by its start time."""
+        name = time.strftime("run-%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        path = os.path.join(root, name)
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(root, f"{name}-{suffix}")
+            suffix += 1
+        return cls(path, **kwargs)
+
+    def _open(self, columns):
+        widths = {name: len(values) for name, values in columns.items()}
+        record_dtype = step_record_dtype(
+            max_layers=max(widths["mlp_activations"], widths["attention_entropy"]),
+            text_bytes=self.text_bytes,
+        )
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(
+                {
+                    "version": RUN_VERSION,
+                    "model": self.model_name,
+                    "prompt": self.prompt,
+                    "created": time.time(),
+                    "columns": widths,
+                    "record": {
+                        "max_layers": record_dtype["mlp"].shape[0],
+                        "text_bytes": self.text_bytes,
+                    },
+                },
+                f,
+            )
+        self._files = {
+            name: open(os.path.join(self.directory, f"{name}.f32"), "ab")
+            for name in columns
+        }
+        self._files["steps"] = open(os.path.join(self.directory, "steps.bin"), "ab")
+        self._record = np.zeros(1, dtype=record_dtype)
+
+    def append(self, measurements):
+        probs = measurements.next_token_probs.float()
+        columns = {
+            "top1_prob": np.array([float(measurements.top_probs[0])]),
+            "entropy": np.array(
+                [float(-(probs * torch.log(probs.clamp_min(1e-12))).sum())]
+            ),
+            "mlp_activations": np.asarray(measurements.mlp_activations).reshape(-1),
+            "attention_entropy": np.asarray(
+                measurements.attention_entropy_values
+            ).reshape(-1),
+        }
+        if not measurements.captured:
+            # lean steps carry the layers of their last captured step
+            for name in LAYER_COLUMNS:
+                columns[name] = np.full(columns[name].shape, np.nan)
+        if self._files is None:
+            self._open(columns)
+        for name, values in columns.items():
+            self._files[name].write(np.asarray(values, dtype=np.float32).tobytes())
+
+        self._record[:] = 0
+        fill_step_record(self._record[0], measurements)
+        self._record["seq"] = self.num_steps
+        self._files["steps"].write(self._record.tobytes())
+        # every file holds whole steps, so readers can map a live run
+        for f in self._files.values():
+            f.flush()
+        self.num_steps += 1
+
+    def close(self):
+        for f in (self._files or {}).values():
+            f.close()
+        self._files = None
+
+
+class RecordedRun:
+    """
+    Read-only view of a RunRecorder directory, columns are memory-mapped.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != RUN_VERSION:
+            raise ValueError(
+                f"{directory} was recorded in run format {self.meta.get('version')}, "
+                f"this version reads {RUN_VERSION}."
+            )
+        record = self.meta["record"]
+        self.record_dtype = step_record_dtype(
+            max_layers=record["max_layers"], text_bytes=record["text_bytes"]
+        )
+        # a step counts once every file has it, the recorder may be mid-step
+        sizes = [
+            os.path.getsize(self._path(name)) // (4 * width)
+            for name, width in self.meta["columns"].items()
+        ]
+        sizes.append(os.path.getsize(self._path("steps")) // self.record_dtype.itemsize)
+        self.num_steps = min(sizes)
+
+    def _path(self, name):
+        return os.path.join(
+            self.directory, "steps.bin" if name == "steps" else f"{name}.f32"
+        )
+
+    @property
+    def name(self):
+        return os.path.basename(os.path.normpath(self.directory))
+
+    def column(self, name):
+        """[steps, width] float32 memmap of a query column."""
+        width = self.meta["columns"][name]
+        if self.num_steps == 0:
+            return np.zeros((0, width), dtype=np.float32)
+        return np.memmap(
+            self._path(name), dtype=np.float32, mode="r", shape=(self.num_steps, width)
+        )
+
+    def measurements(self, step):
+        """The recorded step as ModelMeasurements, for the viewer."""
+        record = np.memmap(
+            self._path("steps"),
+            dtype=self.record_dtype,
+            mode="r",
+            offset=step * self.record_dtype.itemsize,
+            shape=(1,),
+        )
+        measurements = measurements_from_record(record[0])
+        measurements.step = step
+        return measurements
+
+
+class RunIndex:
+    """
+    Zone maps and sorted views over the query columns of a RecordedRun.
+
+    Kept in <run>/index as .npy files that are memory-mapped on use. Zone
+    maps hold the min / max of every ZONE_BLOCK steps and only the blocks
+    the run grew into are recomputed; sorted views (values and their step
+    order per sub-column) are rebuilt when the run has new steps.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.directory = os.path.join(run.directory, "index")
+        os.makedirs(self.directory, exist_ok=True)
+        self._state_path = os.path.join(self.directory, "state.json")
+
+    def _path(self, column, kind):
+        return os.path.join(self.directory, f"{column}.{kind}.npy")
+
+    def _indexed_steps(self):
+        if not os.path.exists(self._state_path):
+            return 0
+        with open(self._state_path) as f:
+            return json.load(f)["indexed_steps"]
+
+    def update(self):
+        """Brings the index up to the run's current length."""
+        indexed = self._indexed_steps()
+        num_steps = self.run.num_steps
+        if indexed == num_steps:
+            return
+
+        for name in self.run.meta["columns"]:
+            values = self.run.column(name)
+
+            # zone maps: keep full blocks, recompute from the first partial one
+            zone_path = self._path(name, "zones")
+            first_block = indexed // ZONE_BLOCK
+            zones = np.load(zone_path)[:first_block] if os.path.exists(zone_path) else None
+            num_blocks = (num_steps + ZONE_BLOCK - 1) // ZONE_BLOCK
+            # NaN (lean steps) is skipped, an all-NaN zone stays NaN and
+            # never matches
+            blocks = [
+                values[block * ZONE_BLOCK : (block + 1) * ZONE_BLOCK]
+                for block in range(first_block, num_blocks)
+            ]
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                new_zones = np.stack(
+                    [np.stack([np.nanmin(b, 0), np.nanmax(b, 0)]) for b in blocks]
+                )  # [blocks, 2, width]
+            if zones is not None and len(zones):
+                new_zones = np.concatenate([zones, new_zones])
+            np.save(zone_path, new_zones)
+
+            # sorted views, one row per sub-column
+            order = np.argsort(values, axis=0, kind="stable").T.astype(np.int64)
+            np.save(self._path(name, "order"), order)
+            np.save(
+                self._path(name, "sorted"),
+                np.take_along_axis(np.asarray(values), order.T, axis=0).T,
+            )
+
+        with open(self._state_path, "w") as f:
+            json.dump({"indexed_steps": num_steps, "zone_block": ZONE_BLOCK}, f)
+
+    def zones(self, column):
+        return np.load(self._path(column, "zones"), mmap_mode="r")
+
+    def sorted_view(self, column, index):
+        """(sorted values, their steps) of one sub-column."""
+        return (
+            np.load(self._path(column, "sorted"), mmap_mode="r")[index],
+            np.load(self._path(column, "order"), mmap_mode="r")[index],
+        )
+
+
+def parse_query(text):
+    """
+    Parses "attention_entropy[10] < 0.5 and top1_prob > 0.9" into
+    (column, index, operator, value) predicates, all of which must hold.
+    """
+    predicates = []
+    for clause in re.split(r"\s+and\s+|\s*&&?\s*|\s*,\s*", text.strip()):
+        if not clause:
+            continue
+        match = PREDICATE_PATTERN.match(clause)
+        if match is None:
+            raise ValueError(
+                f"Can't parse predicate {clause!r}, expected e.g. top1_prob > 0.9"
+            )
+        column = match["column"]
+        if column not in QUERY_COLUMNS:
+            raise ValueError(
+                f"Unknown column {column}, choose from: {', '.join(QUERY_COLUMNS)}."
+            )
+        predicates.append(
+            (
+                column,
+                int(match["index"]) if match["index"] is not None else 0,
+                match["op"],
+                float(match["value"]),
+            )
+        )
+    if not predicates:
+        raise ValueError("Empty query.")
+    return predicates
+
+
+def _sorted_range(sorted_values, op, value):
+    """
+    Slice of an ascending array holding the values that satisfy op value.
+    NaNs sort last and never satisfy it.
+    """
+    num_values = np.searchsorted(sorted_values, np.nan, side="left")
+    if op == "<":
+        return 0, np.searchsorted(sorted_values, value, side="left")
+    if op == "<=":
+        return 0, np.searchsorted(sorted_values, value, side="right")
+    if op == ">":
+        return np.searchsorted(sorted_values, value, side="right"), num_values
+    if op == ">=":
+        return np.searchsorted(sorted_values, value, side="left"), num_values
+    return (
+        np.searchsorted(sorted_values, value, side="left"),
+        np.searchsorted(sorted_values, value, side="right"),
+    )
+
+
+def _zone_may_match(low, high, op, value):
+    if op in ("<", "<="):
+        return QUERY_OPERATORS[op](low, value)
+    if op in (">", ">="):
+        return QUERY_OPERATORS[op](high, value)
+    return (low <= value) & (value <= high)
+
+
+def query_run(run, predicates):
+    """
+    Steps of run matching every predicate, in step order.
+
+    The most selective predicate is located in its sorted view; when it
+    leaves few candidates only those rows are checked against the rest,
+    otherwise the columns are scanned in the blocks the zone maps allow.
+    """
+    if run.num_steps == 0:
+        return np.zeros(0, dtype=np.int64)
+    index = RunIndex(run)
+    index.update()
+    widths = run.meta["columns"]
+    for column, sub, _, _ in predicates:
+        if not -widths[column] <= sub < widths[column]:
+            raise ValueError(f"{column} of {run.name} has {widths[column]} entries, not {sub}.")
+    predicates = [
+        (column, sub % widths[column], op, value)
+        for column, sub, op, value in predicates
+    ]
+
+    ranges = []
+    for column, sub, op, value in predicates:
+        sorted_values, order = index.sorted_view(column, sub)
+        start, end = _sorted_range(sorted_values, op, value)
+        ranges.append((end - start, start, end, order))
+    count, start, end, order = min(ranges, key=lambda entry: entry[0])
+
+    if count <= SORTED_VIEW_MAX_FRACTION * run.num_steps:
+        steps = np.sort(np.asarray(order[start:end]))
+    else:
+        blocks = np.ones((run.num_steps + ZONE_BLOCK - 1) // ZONE_BLOCK, dtype=bool)
+        for column, sub, op, value in predicates:
+            zones = index.zones(column)
+            blocks &= _zone_may_match(zones[:, 0, sub], zones[:, 1, sub], op, value)
+        steps = np.concatenate(
+            [
+                np.arange(block * ZONE_BLOCK, min((block + 1) * ZONE_BLOCK, run.num_steps))
+                for block in np.flatnonzero(blocks)
+            ]
+            or [np.zeros(0, dtype=np.int64)]
+        )
+
+    for column, sub, op, value in predicates:
+        if not len(steps):
+            break
+        values = run.column(column)[steps, sub]
+        steps = steps[QUERY_OPERATORS[op](values, value)]
+    return steps
+
+
+def find_runs(paths):
+    """RecordedRuns at paths, which are run directories or roots holding them."""
+    runs = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, "meta.json")):
+            runs.append(RecordedRun(path))
+            continue
+        for name in sorted(os.listdir(path)):
+            if os.path.exists(os.path.join(path, name, "meta.json")):
+                runs.append(RecordedRun(os.path.join(path, name)))
+    return runs
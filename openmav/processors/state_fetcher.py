@@ -1,6 +1,15 @@
+import threading
+import time
+
 import torch
 
+from openmav.api.measurements import PrefillChunk, PrefillStats
+from openmav.converters.attention_rollout import IncrementalRollout
+from openmav.processors.head_ablation import head_ablation_scan
+from openmav.processors.measurement_plugins import MeasurementRegistry
+from openmav.processors.run_recorder import RunRecorder
 from openmav.processors.state_processor import StateProcessor
+from openmav.processors.text_analyzer import analyze_text
 
 # TOOD: move params to config
 
@@ -17,14 +26,354 @@ class StateFetcher:
         aggregation="l2",
         scale="linear",
         max_bar_length=20,
+        prefill_chunk_size=512,
+        logit_lens_top_k=0,
+        compare_backend=None,
+        teacher="base",
+        prefix_cache=None,
+        trajectory_layers=None,
+        attention_sources_top_k=0,
+        mlp_neurons_top_k=0,
+        reference_profile=None,
+        intervention=None,
+        attention_rollout_top_k=0,
+        attention_rollout_memory_mb=64,
+        sae=None,
+        sae_top_k=8,
+        measurement_plugins=None,
+        record_dir=None,
+        capture_every=1,
+        capture_below_top1=None,
+        capture_above_entropy=None,
+        stream_window=None,
+        stream_sink_tokens=4,
     ):
+        if teacher not in ("base", "compare"):
+            raise ValueError("Invalid teacher. Choose from: base, compare.")
+        if teacher == "compare" and compare_backend is None:
+            raise ValueError("teacher='compare' needs a compare_backend.")
+        if intervention is not None and compare_backend is not None:
+            raise ValueError("Use either an intervention or a compare_backend.")
+        if compare_backend is not None:
+            # KL and teacher="compare" index both models by the same token ids
+            compare_backend.check_shared_vocabulary(backend)
+        if stream_window is not None:
+            if attention_rollout_top_k > 0:
+                raise ValueError(
+                    "Attention rollout needs every position, it can't be streamed."
+                )
+            if stream_window < 1 or stream_sink_tokens < 0:
+                raise ValueError("stream_window must be positive, sinks non-negative.")
+            for limited in (backend, compare_backend):
+                if limited is None:
+                    continue
+                # refuse position encodings eviction would silently corrupt
+                limited.check_cache_eviction()
+                limit = limited.position_limit()
+                if limit is not None and stream_sink_tokens + stream_window >= limit:
+                    raise ValueError(
+                        f"{limited.model_name} has {limit} positions, sinks plus "
+                        "stream_window must stay below that."
+                    )
+
         self.max_new_tokens = max_new_tokens
+        self.prefill_chunk_size = prefill_chunk_size
         self.state_processor = StateProcessor(
-            backend, aggregation=aggregation, scale=scale, max_bar_length=max_bar_length
+            backend,
+            aggregation=aggregation,
+            scale=scale,
+            max_bar_length=max_bar_length,
+            logit_lens_top_k=logit_lens_top_k,
+            trajectory_layers=trajectory_layers,
+            attention_sources_top_k=attention_sources_top_k,
+            reference_profile=reference_profile,
+            attention_rollout_top_k=attention_rollout_top_k,
+            sae=sae,
+            sae_top_k=sae_top_k,
         )
         self.backend = backend
+        if mlp_neurons_top_k > 0:
+            backend.enable_mlp_neuron_capture(top_k=mlp_neurons_top_k)
+        # second model decoded in lockstep on the same token stream
+        self.compare_backend = compare_backend
+        self.teacher = teacher
+        # backend Intervention hooking batch row 1, row 0 stays clean
+        self.intervention = intervention
+        # optional PrefixKVCache shared across runs
+        self.prefix_cache = prefix_cache
+        # every fetch_next session is recorded to a new run directory here
+        self.record_dir = record_dir
+        # steps in between capture points decode lean, without layer internals
+        self.capture_every = capture_every
+        self.capture_below_top1 = capture_below_top1
+        self.capture_above_entropy = capture_above_entropy
+        # with a stream_window the cache keeps the first stream_sink_tokens
+        # (attention sinks) plus the most recent positions, the rest is evicted
+        self.stream_window = stream_window
+        self.stream_sink_tokens = stream_sink_tokens
+        # MeasurementPlugins reduced on the device inside every decode step
+        self.measurement_registry = MeasurementRegistry(measurement_plugins)
+        self.attention_rollout_top_k = attention_rollout_top_k
+        self.attention_rollout_memory_mb = attention_rollout_memory_mb
+
+        # state of the running fetch_next session, branches fork from it
+        self.generated_ids = None
+        self.prompt_length = 0
+        self.past_key_values = None
+        self.last_top_ids = None
+        self.last_step = None
+        self.sampling_params = {}
+        self.rollout = None
+        self.evicted = 0
+        self._session_lock = threading.Lock()
+
+    def close(self):
+        """
+        Removes the hooks put on the models (MLP neuron capture, interventions,
+        head mask), so a caller's model_obj runs unhooked afterwards.
+        """
+        self.backend.remove_hooks()
+        if self.compare_backend is not None:
+            self.compare_backend.remove_hooks()
+        self.intervention = None
+
+    @staticmethod
+    def _batch_row(captured, row):
+        """Row of a [layers, batch, ...] tensor tuple, e.g. backend hook captures."""
+        if captured is None:
+            return None
+        return tuple(tensor[:, row] for tensor in captured)
+
+    def prefill(
+        self,
+        prompt_ids,
+        on_prefill_chunk=None,
+        backend=None,
+        on_prefill_attentions=None,
+        attention_memory_bytes=None,
+    ):
+        """
+        Builds the KV cache for prompt_ids in chunks of prefill_chunk_size.
+
+        With a prefix_cache the longest cached prefix is restored from disk and
+        only the remainder is computed, the full prefix is stored afterwards.
+
+        Args:
+            prompt_ids (list): Token ids to cache (the prompt minus its last token)
+            on_prefill_chunk (callable): Optional, called with each PrefillChunk
+            backend (ModelBackend): Backend to prefill, defaults to the main one
+            on_prefill_attentions (callable): Optional, called with each chunk's
+                per-layer attentions and its start position. Every position has
+                to be computed then, so the prefix cache is not read.
+            attention_memory_bytes (int): Optional, with on_prefill_attentions
+                chunks are shortened so the attentions of every layer and head
+                one chunk returns stay within this many bytes.
+
+        Returns:
+            tuple: (past_key_values, PrefillStats)
+        """
+        backend = backend or self.backend
+        total = len(prompt_ids)
+        chunk_size = self.prefill_chunk_size if self.prefill_chunk_size > 0 else total
+        stats = PrefillStats(num_tokens=total, chunk_size=chunk_size)
+        past_key_values = None
+
+        if total == 0:
+            return past_key_values, stats
+
+        # backends whose weights can't be identified have no namespace
+        namespace = backend.cache_namespace() if self.prefix_cache is not None else None
+        if namespace is not None and on_prefill_attentions is None:
+            cached, layers = self.prefix_cache.lookup(
+                namespace, prompt_ids, device=backend.device
+            )
+            if layers is not None:
+                past_key_values = backend.cache_from_layers(layers)
+                stats.cached_tokens = cached
+
+        remaining = total - stats.cached_tokens
+        entry_bytes = None
+        if on_prefill_attentions is not None and attention_memory_bytes is not None:
+            entry_bytes = backend.attention_entry_bytes()
+        bounds = []
+        start = stats.cached_tokens
+        while start < total:
+            size = chunk_size
+            if entry_bytes is not None:
+                # rows x context x layers x heads, context bounded by the end
+                context = min(total, start + chunk_size)
+                size = max(1, min(size, attention_memory_bytes // (entry_bytes * context)))
+            bounds.append((start, min(start + size, total)))
+            start = bounds[-1][1]
+        if bounds:
+            stats.chunk_size = max(end - start for start, end in bounds)
+
+        num_chunks = len(bounds)
+        for index, (start, end) in enumerate(bounds):
+            chunk_start = time.perf_counter()
+            if on_prefill_attentions is None:
+                past_key_values = backend.prefill(
+                    prompt_ids[:end], past_key_values=past_key_values
+                )
+            else:
+                past_key_values, attentions = backend.prefill(
+                    prompt_ids[:end],
+                    past_key_values=past_key_values,
+                    output_attentions=True,
+                )
+                on_prefill_attentions(attentions, start)
+            chunk = PrefillChunk(
+                index=index,
+                num_chunks=num_chunks,
+                start=start,
+                end=end,
+                total_tokens=total,
+                seconds=time.perf_counter() - chunk_start,
+            )
+            stats.chunks.append(chunk)
+            stats.seconds += chunk.seconds
+            if on_prefill_chunk is not None:
+                on_prefill_chunk(chunk)
+
+        if namespace is not None and remaining > 0:
+            self.prefix_cache.store(
+                namespace,
+                prompt_ids,
+                backend.cache_layers(past_key_values),
+            )
+
+        return past_key_values, stats
+
+    def analyze(self, text):
+        """
+        Measures every position of an existing text in one forward pass.
+
+        Returns:
+            TextAnalysis: Per-position ModelMeasurements via measurements(position)
+        """
+        return analyze_text(self.backend, self.state_processor, text)
+
+    def ablate_heads(self, prompt, metric="kl", batch_size=32):
+        """
+        Scores every attention head by how much masking it changes the
+        prompt's next-token distribution, batch_size heads per forward pass.
+
+        Yields:
+            ModelMeasurements: The unablated step, head_importance filling in
+        """
+        prompt_ids = self.backend.tokenize(prompt).tolist()[0]
+        past_key_values, _ = self.prefill(prompt_ids[:-1])
+        yield from head_ablation_scan(
+            self.backend,
+            self.state_processor,
+            prompt_ids,
+            past_key_values,
+            metric=metric,
+            batch_size=batch_size,
+        )
+
+    def _capture_scheduled(self, step):
+        if step == 0 or self.capture_every == 1:
+            return True
+        return self.capture_every > 0 and step % self.capture_every == 0
+
+    def _capture_triggered(self, scores):
+        """
+        Whether a lean step's prediction is uncertain enough to capture it.
+        """
+        if self.capture_below_top1 is None and self.capture_above_entropy is None:
+            return False
+        probs = torch.softmax(scores.float(), dim=-1)
+        if self.capture_below_top1 is not None and probs.max() < self.capture_below_top1:
+            return True
+        if self.capture_above_entropy is not None:
+            entropy = -(probs * torch.log(probs.clamp_min(1e-12))).sum()
+            return bool(entropy > self.capture_above_entropy)
+        return False
+
+    def _reduce_plugins(self, outputs, next_token_probs):
+        return self.measurement_registry.reduce(
+            hidden_states=outputs["hidden_states"],
+            attentions=outputs["attentions"],
+            logits=outputs["logits"],
+            next_token_probs=next_token_probs,
+            mlp_neurons=outputs.get("mlp_neurons"),
+        )
+
+    def _update_rollout(self, attentions, start):
+        """
+        Extends the session's attention rollout by the rows from start on.
+
+        Returns:
+            torch.Tensor: Rollout of the last of those positions onto the prompt
+        """
+        if self.rollout is None:
+            self.rollout = IncrementalRollout(
+                num_layers=len(attentions),
+                num_columns=self.prompt_length,
+                memory_bytes=self.attention_rollout_memory_mb * 1024**2,
+                device=attentions[0].device,
+            )
+        return self.rollout.update(attentions, start)
+
+    def _evict(self, sequences, caches):
+        """
+        Keeps the caches within sinks + stream_window positions.
 
-    def fetch_next(
+        Every cache holds all but the last id of its sequences, the evicted
+        ids are removed from the sequences in place so that stays true. A
+        window // 8 slack evicts in bursts instead of copying every step.
+        """
+        num_sinks = self.stream_sink_tokens
+        cached = len(sequences[0]) - 1
+        if self.stream_window is None or cached <= num_sinks + self.stream_window:
+            return [cache for _, cache in caches]
+        num_evicted = cached - num_sinks - self.stream_window + self.stream_window // 8
+        for ids in sequences:
+            del ids[num_sinks : num_sinks + num_evicted]
+        self.evicted += num_evicted
+        return [
+            backend.evict_cache(cache, num_sinks, num_evicted)
+            if cache is not None
+            else None
+            for backend, cache in caches
+        ]
+
+    def fetch_next(self, prompt, **options):
+        """
+        Generates tokens and yields processed data.
+
+        options are the sampling parameters and on_prefill_chunk. With a
+        record_dir, every step is also appended to a new RunRecorder run.
+
+        A fetcher holds the state of one session (ids, KV cache, hooks'
+        captures), a second concurrent fetch_next on it raises ValueError.
+        """
+        if not self._session_lock.acquire(blocking=False):
+            raise ValueError(
+                "This StateFetcher is already streaming, use one per concurrent session."
+            )
+        try:
+            yield from self._record(prompt, self._generate(prompt, **options))
+        finally:
+            self._session_lock.release()
+
+    def _record(self, prompt, steps):
+        if self.record_dir is None:
+            yield from steps
+            return
+
+        recorder = RunRecorder.create(
+            self.record_dir, model_name=self.backend.model_name, prompt=prompt
+        )
+        try:
+            for measurements in steps:
+                recorder.append(measurements)
+                yield measurements
+        finally:
+            recorder.close()
+
+    def _generate(
         self,
         prompt,
         temperature=1.0,
@@ -32,41 +381,292 @@ class StateFetcher:
         top_p=1.0,
         min_p=0.0,
         repetition_penalty=1.0,
+        on_prefill_chunk=None,
     ):
-        """
-        Generates tokens and yields processed data.
-        """
         inputs = self.backend.tokenize(prompt)
         generated_ids = inputs.tolist()[0]
+        self.generated_ids = generated_ids
+        self.prompt_length = len(generated_ids)
+        self.sampling_params = dict(
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            min_p=min_p,
+            repetition_penalty=repetition_penalty,
+        )
+
+        # rollout rows of the prompt come from its prefill chunks, then one
+        # row per decoded token
+        self.rollout = None
+        self.evicted = 0
+        rollout_enabled = self.attention_rollout_top_k > 0
 
-        for _ in range(self.max_new_tokens):
+        # everything but the last prompt token goes through the cheap prefill,
+        # the last one is fed by the first decode step with full capture
+        past_key_values, prefill_stats = self.prefill(
+            generated_ids[:-1],
+            on_prefill_chunk=on_prefill_chunk,
+            on_prefill_attentions=self._update_rollout if rollout_enabled else None,
+            attention_memory_bytes=self.attention_rollout_memory_mb * 1024**2,
+        )
+        compare_past_key_values = None
+        if self.compare_backend is not None:
+            compare_past_key_values, _ = self.prefill(
+                generated_ids[:-1], backend=self.compare_backend
+            )
+        # with an intervention, a clean and an intervened copy of the
+        # sequence decode as one batch of two over the shared prompt cache
+        intervened_ids = None
+        if self.intervention is not None:
+            intervened_ids = list(generated_ids)
+            if past_key_values is not None:
+                past_key_values = self.backend.fork_cache(past_key_values, 2)
+        decode_seconds = 0.0
+        last_captured = None
+
+        for step in range(self.max_new_tokens):
+            step_start = time.perf_counter()
+            if self.stream_window is not None:
+                past_key_values, compare_past_key_values = self._evict(
+                    [ids for ids in (generated_ids, intervened_ids) if ids is not None],
+                    [
+                        (self.backend, past_key_values),
+                        (self.compare_backend, compare_past_key_values),
+                    ],
+                )
+            step_ids = (
+                generated_ids if intervened_ids is None else [generated_ids, intervened_ids]
+            )
+            capture = self._capture_scheduled(step)
             outputs = self.backend.generate(
-                generated_ids,
-                temperature=temperature,
-                top_k=top_k,
-                top_p=top_p,
-                min_p=min_p,
-                repetition_penalty=repetition_penalty,
+                step_ids,
+                past_key_values=past_key_values,
+                capture=capture,
+                **self.sampling_params,
             )
+            if not capture and self._capture_triggered(outputs["logits"][0, -1]):
+                # redo the position with full capture from the cache before it,
+                # a triggered step costs a lean plus a full decode
+                capture = True
+                outputs = self.backend.generate(
+                    step_ids,
+                    past_key_values=self.backend.crop_cache(
+                        outputs["past_key_values"], len(generated_ids) - 1
+                    ),
+                    capture=True,
+                    **self.sampling_params,
+                )
             logits = outputs["logits"]
             hidden_states = outputs["hidden_states"]
             attentions = outputs["attentions"]
+            past_key_values = outputs["past_key_values"]
+            rollout = None
+            if rollout_enabled and capture:
+                # lean positions get no row, their share is renormalized away
+                rollout = self._update_rollout(attentions, len(generated_ids) - 1)
 
-            next_token_probs = torch.softmax(logits[:, -1, :], dim=-1).squeeze()
+            batch_probs = torch.softmax(logits[:, -1, :], dim=-1)
+            plugin_outputs = self._reduce_plugins(outputs, batch_probs) if capture else None
+            next_token_probs = batch_probs[0]
             top_probs, top_ids = torch.topk(next_token_probs, 20)
-            next_token_id = torch.multinomial(next_token_probs, num_samples=1).item()
+            teacher_probs = next_token_probs
+
+            if self.compare_backend is not None:
+                # separate weights and KV cache, so a second forward pass
+                # rather than another row of the base model's batch
+                compare_outputs = self.compare_backend.generate(
+                    generated_ids,
+                    past_key_values=compare_past_key_values,
+                    capture=capture,
+                    **self.sampling_params,
+                )
+                compare_past_key_values = compare_outputs["past_key_values"]
+                compare_probs = torch.softmax(
+                    compare_outputs["logits"][:, -1, :], dim=-1
+                ).squeeze()
+                if self.teacher == "compare":
+                    teacher_probs = compare_probs
+
+            # both models are teacher-forced with the same sampled token
+            next_token_id = torch.multinomial(teacher_probs, num_samples=1).item()
             generated_ids.append(next_token_id)
+            if intervened_ids is not None:
+                intervened_ids.append(
+                    torch.multinomial(batch_probs[1], num_samples=1).item()
+                )
+            decode_seconds += time.perf_counter() - step_start
+            self.past_key_values = past_key_values
+            self.last_top_ids = top_ids
+            self.last_step = step
+
+            decode_tokens_per_sec = (
+                (step + 1) / decode_seconds if decode_seconds > 0 else 0.0
+            )
+            if not capture:
+                lean = self.state_processor.next_lean(
+                    last_captured,
+                    generated_ids,
+                    next_token_id,
+                    logits[:1],
+                    next_token_probs,
+                    top_ids,
+                    top_probs,
+                    self.backend,
+                    step=step,
+                    decode_tokens_per_sec=decode_tokens_per_sec,
+                )
+                lean.evicted_tokens = self.evicted
+                yield lean
+                continue
 
             measurement_data = self.state_processor.next(
                 generated_ids,
                 next_token_id,
-                hidden_states,
-                attentions,
-                logits,
+                tuple(layer[:1] for layer in hidden_states),
+                tuple(layer[:1] for layer in attentions),
+                logits[:1],
                 next_token_probs,
                 top_ids,
                 top_probs,
                 self.backend,
+                prefill_stats=prefill_stats,
+                decode_tokens_per_sec=decode_tokens_per_sec,
+                mlp_neurons=self._batch_row(outputs.get("mlp_neurons"), 0),
+                rollout=rollout,
+                plugin_outputs=MeasurementRegistry.row(plugin_outputs, 0),
             )
+            measurement_data.load_timings = self.backend.load_timings
+            measurement_data.step = step
+            measurement_data.captured_step = step
+            measurement_data.evicted_tokens = self.evicted
+            last_captured = measurement_data
+
+            if self.compare_backend is not None:
+                compare_top_probs, compare_top_ids = torch.topk(compare_probs, 20)
+                measurement_data.comparison = self.state_processor.compare(
+                    measurement_data,
+                    self.compare_backend.model_name,
+                    compare_outputs["hidden_states"],
+                    compare_outputs["attentions"],
+                    compare_probs,
+                    compare_top_ids,
+                    compare_top_probs,
+                )
+
+            if intervened_ids is not None:
+                intervened_top_probs, intervened_top_ids = torch.topk(batch_probs[1], 20)
+                measurement_data.comparison = self.state_processor.compare(
+                    measurement_data,
+                    self.intervention.describe(),
+                    tuple(layer[1:2] for layer in hidden_states),
+                    tuple(layer[1:2] for layer in attentions),
+                    batch_probs[1],
+                    intervened_top_ids,
+                    intervened_top_probs,
+                )
+                measurement_data.comparison.generated_text = self.backend.decode(
+                    intervened_ids,
+                    skip_special_tokens=True,
+                    clean_up_tokenization_spaces=True,
+                )
 
             yield measurement_data  # Yield processed data for visualization
+
+    def branch(self, num_branches=4, num_steps=10, step=None, top_ids=None):
+        """
+        Forks the top alternatives of a fetched step and continues them.
+
+        All branches start from the prefix KV cache and advance together as
+        one batched decode step, so exploring k alternatives costs about one
+        decode per step instead of k reruns of the whole sequence. Each
+        branch holds its own copy of the prefix cache.
+
+        Args:
+            num_branches (int): How many of the top predicted tokens to follow
+            num_steps (int): Tokens to generate on every branch
+            step (int): Step to branch from (ModelMeasurements.step), the last
+                fetched one when None or equal to it. Earlier steps reuse a
+                prefix of the cache.
+            top_ids (torch.Tensor): That step's top predictions, needed with step
+
+        Yields:
+            list: One ModelMeasurements per branch for every step
+        """
+        if self.past_key_values is None or self.last_top_ids is None:
+            raise ValueError("Nothing to branch from, fetch at least one token first.")
+        num_candidates = len(self.last_top_ids if top_ids is None else top_ids)
+        if not 1 <= num_branches <= num_candidates:
+            raise ValueError(f"num_branches must be between 1 and {num_candidates}.")
+
+        # the cache holds everything before the token sampled at the step,
+        # each branch replaces that token with one of the alternatives
+        if step == self.last_step:
+            step = None  # also valid after an eviction shifted the ids
+        if step is None:
+            prefix = self.generated_ids[:-1]
+            top_ids = self.last_top_ids
+        else:
+            if top_ids is None:
+                raise ValueError("Branching from an earlier step needs its top_ids.")
+            if self.evicted:
+                raise ValueError(
+                    "Earlier steps were evicted from the stream, branch from the last one."
+                )
+            prefix = self.generated_ids[: self.prompt_length + step]
+        branch_ids = [
+            prefix + [token_id] for token_id in top_ids[:num_branches].tolist()
+        ]
+        # cut and forked in one go, one prefix copy per branch; the running
+        # session's cache stays intact
+        past_key_values = self.backend.fork_cache(
+            self.past_key_values, len(branch_ids), length=len(prefix)
+        )
+
+        # branches follow the clean sequence, keep the intervention off them
+        intervention_enabled = self.intervention is not None and self.intervention.enabled
+        if self.intervention is not None:
+            self.intervention.enabled = False
+        try:
+            yield from self._decode_branches(branch_ids, past_key_values, num_steps)
+        finally:
+            if self.intervention is not None:
+                self.intervention.enabled = intervention_enabled
+
+    def _decode_branches(self, branch_ids, past_key_values, num_steps):
+        for _ in range(num_steps):
+            outputs = self.backend.generate(
+                branch_ids,
+                past_key_values=past_key_values,
+                **self.sampling_params,
+            )
+            logits = outputs["logits"]
+            hidden_states = outputs["hidden_states"]
+            attentions = outputs["attentions"]
+            past_key_values = outputs["past_key_values"]
+
+            next_token_probs = torch.softmax(logits[:, -1, :], dim=-1)
+            plugin_outputs = self._reduce_plugins(outputs, next_token_probs)
+            top_probs, top_ids = torch.topk(next_token_probs, 20, dim=-1)
+            next_token_ids = torch.multinomial(next_token_probs, num_samples=1)
+
+            step_measurements = []
+            for i, next_token_id in enumerate(next_token_ids[:, 0].tolist()):
+                branch_ids[i].append(next_token_id)
+                step_measurements.append(
+                    self.state_processor.next(
+                        branch_ids[i],
+                        next_token_id,
+                        tuple(layer[i : i + 1] for layer in hidden_states),
+                        tuple(layer[i : i + 1] for layer in attentions),
+                        logits[i : i + 1],
+                        next_token_probs[i],
+                        top_ids[i],
+                        top_probs[i],
+                        self.backend,
+                        stateful=False,
+                        mlp_neurons=self._batch_row(outputs.get("mlp_neurons"), i),
+                        plugin_outputs=MeasurementRegistry.row(plugin_outputs, i),
+                    )
+                )
+
+            yield step_measurements
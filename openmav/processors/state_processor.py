@@ -1,14 +1,85 @@
-from openmav.api.measurements import ModelMeasurements
+import dataclasses
+
+from openmav.api.measurements import ComparisonMeasurements, ModelMeasurements
 from openmav.converters.data_converter import DataConverter
+from openmav.converters.incremental_pca import ResidualTrajectory
 
 
 class StateProcessor:
-    def __init__(self, backend, aggregation="l2", scale="linear", max_bar_length=20):
+    def __init__(
+        self,
+        backend,
+        aggregation="l2",
+        scale="linear",
+        max_bar_length=20,
+        logit_lens_top_k=0,
+        trajectory_layers=None,
+        trajectory_window=256,
+        attention_sources_top_k=0,
+        reference_profile=None,
+        attention_rollout_top_k=0,
+        sae=None,
+        sae_top_k=8,
+    ):
         self.data_converter = DataConverter()
         self.backend = backend
         self.aggregation = aggregation
         self.scale = scale
         self.max_bar_length = max_bar_length
+        self.logit_lens_top_k = logit_lens_top_k
+        self.attention_sources_top_k = attention_sources_top_k
+        self.attention_rollout_top_k = attention_rollout_top_k
+        # optional SparseAutoencoder read off the captured hidden states
+        self.sae = sae
+        self.sae_top_k = sae_top_k
+        # optional ReferenceProfile, its bands flag unusual layers
+        self.reference_profile = reference_profile
+        if reference_profile is not None and reference_profile.aggregation != aggregation:
+            raise ValueError(
+                f"Reference profile was built with aggregation "
+                f"{reference_profile.aggregation}, not {aggregation}."
+            )
+        self._output_head = None
+        self._token_labels = {}
+        self.trajectories = {
+            layer: ResidualTrajectory(window=trajectory_window)
+            for layer in (trajectory_layers or [])
+        }
+
+    def token_label(self, token_id):
+        """
+        Short display string of a vocabulary entry, decoded once and cached.
+        """
+        label = self._token_labels.get(token_id)
+        if label is None:
+            label = (
+                self.backend.decode(
+                    [token_id], clean_up_tokenization_spaces=True
+                ).strip()[
+                    :10
+                ]  # TODO: this should happen in view layer
+                or " "
+            )
+            self._token_labels[token_id] = label
+        return label
+
+    def _logit_lens(self, hidden_states):
+        if self._output_head is None:
+            self._output_head = self.backend.output_head()
+        final_norm, unembedding, bias = self._output_head
+
+        lens_ids, lens_probs = self.data_converter.process_logit_lens(
+            hidden_states,
+            final_norm,
+            unembedding,
+            bias=bias,
+            top_k=self.logit_lens_top_k,
+        )
+        lens_tokens = [
+            [self.token_label(token_id) for token_id in layer_ids]
+            for layer_ids in lens_ids.tolist()
+        ]
+        return lens_ids, lens_probs, lens_tokens
 
     def next(
         self,
@@ -21,7 +92,22 @@ class StateProcessor:
         top_ids,
         top_probs,
         backend,
+        prefill_stats=None,
+        decode_tokens_per_sec=0.0,
+        stateful=True,
+        mlp_neurons=None,
+        rollout=None,
+        plugin_outputs=None,
     ):
+        """
+        Turns one step's raw outputs into ModelMeasurements.
+
+        stateful=False leaves the streaming state (e.g. trajectories) untouched,
+        for side steps such as branches. mlp_neurons is the backend's
+        (ids, values) capture for this sequence, shaped [layers, k]. rollout is
+        the attention rollout of the predicting position onto the prompt.
+        plugin_outputs are this sequence's MeasurementPlugin results.
+        """
         mlp_activations = self.data_converter.process_mlp_activations(
             hidden_states, self.aggregation
         )
@@ -43,17 +129,51 @@ class StateProcessor:
             [next_token_id], clean_up_tokenization_spaces=True
         )
 
-        decoded_tokens = [
-            (
-                self.backend.decode(
-                    [token_id], clean_up_tokenization_spaces=True
-                ).strip()[
-                    :10
-                ]  # TODO: this should happen in view layer
-                or " "
+        decoded_tokens = [self.token_label(token_id) for token_id in top_ids.tolist()]
+
+        lens_ids = lens_probs = lens_tokens = None
+        if self.logit_lens_top_k > 0:
+            lens_ids, lens_probs, lens_tokens = self._logit_lens(hidden_states)
+
+        sources = {}
+        if self.attention_sources_top_k > 0:
+            sources = self._attention_sources(attentions, generated_ids[:-1])
+
+        rollout_sources = {}
+        if rollout is not None and self.attention_rollout_top_k > 0:
+            rollout_sources = self._attention_rollout(rollout, generated_ids)
+
+        sae_features = {}
+        if self.sae is not None and self.sae_top_k > 0:
+            feature_ids, feature_values = self.sae.top_features(
+                hidden_states, top_k=self.sae_top_k
+            )
+            sae_features = {
+                "sae_feature_ids": feature_ids,
+                "sae_feature_values": feature_values,
+                "sae_feature_labels": [
+                    self.sae.label(feature_id) for feature_id in feature_ids.tolist()
+                ],
+            }
+
+        trajectories = None
+        if self.trajectories:
+            trajectories = {
+                layer: (
+                    trajectory.update(
+                        hidden_states[layer][0, -1, :].float().cpu().numpy()
+                    )
+                    if stateful
+                    else trajectory.points()
+                )
+                for layer, trajectory in self.trajectories.items()
+            }
+
+        bands = {}
+        if self.reference_profile is not None:
+            bands = self._reference_bands(
+                len(generated_ids) - 2, len(mlp_activations), len(entropy_values)
             )
-            for token_id in top_ids.tolist()
-        ]
 
         return self._convert_to_model_measurements(
             {
@@ -68,9 +188,168 @@ class StateProcessor:
                 "top_probs": top_probs,
                 "logits": logits,
                 "decoded_tokens": decoded_tokens,
+                "prefill_stats": prefill_stats,
+                "decode_tokens_per_sec": decode_tokens_per_sec,
+                "logit_lens_ids": lens_ids,
+                "logit_lens_probs": lens_probs,
+                "logit_lens_tokens": lens_tokens,
+                "residual_trajectories": trajectories,
+                "mlp_neuron_ids": mlp_neurons[0] if mlp_neurons else None,
+                "mlp_neuron_values": mlp_neurons[1] if mlp_neurons else None,
+                **sources,
+                **rollout_sources,
+                **sae_features,
+                "plugin_outputs": plugin_outputs,
+                **bands,
             }
         )
 
+    def next_lean(
+        self,
+        previous,
+        generated_ids,
+        next_token_id,
+        logits,
+        next_token_probs,
+        top_ids,
+        top_probs,
+        backend,
+        step=None,
+        decode_tokens_per_sec=0.0,
+    ):
+        """
+        Measurements of a step decoded without hidden states or attentions.
+
+        Text and predictions are this step's, the per-layer fields are those
+        of previous, the last captured step (see captured_step).
+        """
+        return dataclasses.replace(
+            previous,
+            generated_text=backend.decode(
+                generated_ids[:-1],
+                skip_special_tokens=True,
+                clean_up_tokenization_spaces=True,
+            ),
+            predicted_char=backend.decode(
+                [next_token_id], clean_up_tokenization_spaces=True
+            ),
+            next_token_probs=next_token_probs,
+            top_ids=top_ids,
+            top_probs=top_probs,
+            logits=logits,
+            decoded_tokens=[self.token_label(token_id) for token_id in top_ids.tolist()],
+            step=step,
+            decode_tokens_per_sec=decode_tokens_per_sec,
+            plugin_outputs=None,
+            captured=False,
+        )
+
+    def _reference_bands(self, position, num_mlp_layers, num_entropy_layers):
+        """
+        Profiled (p5, p95) bands at position, for the layers the profile covers.
+        """
+        mlp_band = self.reference_profile.band("mlp_activations", position)
+        entropy_band = self.reference_profile.band("attention_entropy", position)
+        return {
+            "mlp_reference_band": (
+                mlp_band if mlp_band.shape[1] == num_mlp_layers else None
+            ),
+            "entropy_reference_band": (
+                entropy_band if entropy_band.shape[1] == num_entropy_layers else None
+            ),
+        }
+
+    def _attention_sources(self, attentions, context_ids):
+        """
+        Top attended positions with labels looked up from context_ids, the ids
+        the attention row spans.
+        """
+        (
+            head_positions,
+            head_weights,
+            layer_positions,
+            layer_weights,
+        ) = self.data_converter.process_attention_sources(
+            attentions, top_k=self.attention_sources_top_k
+        )
+
+        def label(position):
+            if position < len(context_ids):
+                return self.token_label(context_ids[position])
+            return "?"
+
+        return {
+            "attention_source_positions": head_positions,
+            "attention_source_weights": head_weights,
+            "attention_source_tokens": [
+                [[label(p) for p in head] for head in layer]
+                for layer in head_positions.tolist()
+            ],
+            "attention_layer_source_positions": layer_positions,
+            "attention_layer_source_weights": layer_weights,
+            "attention_layer_source_tokens": [
+                [label(p) for p in layer] for layer in layer_positions.tolist()
+            ],
+        }
+
+    def _attention_rollout(self, rollout, generated_ids):
+        """
+        Prompt tokens carrying the most rollout weight, labelled from the
+        prompt ids the rollout columns span.
+        """
+        top_k = min(self.attention_rollout_top_k, rollout.shape[-1])
+        weights, positions = rollout.topk(top_k)
+        positions = positions.cpu()
+        return {
+            "attention_rollout_positions": positions,
+            "attention_rollout_weights": weights.cpu(),
+            "attention_rollout_tokens": [
+                self.token_label(generated_ids[position])
+                for position in positions.tolist()
+            ],
+            "attention_rollout_prompt_share": float(rollout.sum()),
+        }
+
+    def compare(
+        self,
+        measurements,
+        model_name,
+        hidden_states,
+        attentions,
+        next_token_probs,
+        top_ids,
+        top_probs,
+    ):
+        """
+        Measures a second model on the same step and diffs it against measurements.
+
+        Text is not decoded again, the step's tokens are shared with the base
+        model and labels come from the vocabulary cache.
+        """
+        mlp_activations = self.data_converter.process_mlp_activations(
+            hidden_states, self.aggregation
+        )
+        entropy_values = self.data_converter.process_entropy(attentions)
+
+        return ComparisonMeasurements(
+            model_name=model_name,
+            mlp_activations=mlp_activations,
+            attention_entropy_values=entropy_values,
+            mlp_delta=self.data_converter.process_layer_deltas(
+                measurements.mlp_activations, mlp_activations
+            ),
+            attention_entropy_delta=self.data_converter.process_layer_deltas(
+                measurements.attention_entropy_values, entropy_values
+            ),
+            kl_divergence=self.data_converter.compute_kl_divergence(
+                measurements.next_token_probs, next_token_probs
+            ),
+            top_ids=top_ids,
+            top_probs=top_probs,
+            decoded_tokens=[self.token_label(token_id) for token_id in top_ids.tolist()],
+            top1_agrees=int(top_ids[0]) == int(measurements.top_ids[0]),
+        )
+
     def _convert_to_model_measurements(self, data_dict) -> ModelMeasurements:
         return ModelMeasurements(
             mlp_activations=data_dict["mlp_activations"],
@@ -84,4 +363,36 @@ class StateProcessor:
             top_probs=data_dict["top_probs"],
             logits=data_dict["logits"],
             decoded_tokens=data_dict["decoded_tokens"],
+            prefill_stats=data_dict["prefill_stats"],
+            decode_tokens_per_sec=data_dict["decode_tokens_per_sec"],
+            logit_lens_ids=data_dict["logit_lens_ids"],
+            logit_lens_probs=data_dict["logit_lens_probs"],
+            logit_lens_tokens=data_dict["logit_lens_tokens"],
+            residual_trajectories=data_dict["residual_trajectories"],
+            mlp_neuron_ids=data_dict["mlp_neuron_ids"],
+            mlp_neuron_values=data_dict["mlp_neuron_values"],
+            attention_source_positions=data_dict.get("attention_source_positions"),
+            attention_source_weights=data_dict.get("attention_source_weights"),
+            attention_source_tokens=data_dict.get("attention_source_tokens"),
+            attention_layer_source_positions=data_dict.get(
+                "attention_layer_source_positions"
+            ),
+            attention_layer_source_weights=data_dict.get(
+                "attention_layer_source_weights"
+            ),
+            attention_layer_source_tokens=data_dict.get(
+                "attention_layer_source_tokens"
+            ),
+            mlp_reference_band=data_dict.get("mlp_reference_band"),
+            entropy_reference_band=data_dict.get("entropy_reference_band"),
+            attention_rollout_positions=data_dict.get("attention_rollout_positions"),
+            attention_rollout_weights=data_dict.get("attention_rollout_weights"),
+            attention_rollout_tokens=data_dict.get("attention_rollout_tokens"),
+            attention_rollout_prompt_share=data_dict.get(
+                "attention_rollout_prompt_share"
+            ),
+            sae_feature_ids=data_dict.get("sae_feature_ids"),
+            sae_feature_values=data_dict.get("sae_feature_values"),
+            sae_feature_labels=data_dict.get("sae_feature_labels"),
+            plugin_outputs=data_dict.get("plugin_outputs"),
         )
@@ -0,0 +1,158 @@
+import time
+
+import torch
+
+from openmav.api.measurements import ModelMeasurements
+
+
+class TextAnalysis:
+    """
+    Measurements of every position of an existing text.
+
+    Built from one teacher-forced forward pass, all positions are reduced
+    together and only compact per-position arrays are kept. ModelMeasurements
+    for a position are assembled on demand, so scrubbing through a long text
+    costs no model calls.
+    """
+
+    def __init__(
+        self,
+        state_processor,
+        token_ids,
+        activations,
+        entropy,
+        top_ids,
+        top_probs,
+        top_logits,
+        dist_probs,
+        vocab_size,
+        seconds=0.0,
+        dropped_tokens=0,
+    ):
+        self.state_processor = state_processor
+        self.token_ids = token_ids
+        self.activations = activations  # [layers + 1, seq]
+        self.entropy = entropy  # [layers, seq]
+        self.top_ids = top_ids  # [seq, k]
+        self.top_probs = top_probs
+        self.top_logits = top_logits
+        self.dist_probs = dist_probs  # [seq, dist_n], descending
+        self.vocab_size = vocab_size
+        self.seconds = seconds
+        # tokens past the model's position limit, not analyzed
+        self.dropped_tokens = dropped_tokens
+
+    def __len__(self):
+        return len(self.token_ids)
+
+    @property
+    def tokens_per_sec(self):
+        return len(self) / self.seconds if self.seconds > 0 else 0.0
+
+    def measurements(self, position) -> ModelMeasurements:
+        """
+        The measurements of position, as if generation had just reached it.
+
+        predicted_char is the token that actually follows in the text, the
+        model's own ranking is in top_ids. The last position shows its top-1.
+        """
+        processor = self.state_processor
+        converter = processor.data_converter
+        backend = processor.backend
+        position = max(0, min(position, len(self) - 1))
+
+        mlp_activations = self.activations[:, position : position + 1]
+        entropy_values = self.entropy[:, position : position + 1]
+        top_ids = self.top_ids[position]
+
+        if position + 1 < len(self):
+            next_token_id = self.token_ids[position + 1]
+        else:
+            next_token_id = int(top_ids[0])
+
+        # only the top logits are kept, enough for the panels that index them
+        logits = torch.zeros(1, 1, self.vocab_size)
+        logits[0, 0, top_ids] = self.top_logits[position]
+
+        bands = {}
+        if processor.reference_profile is not None:
+            bands = processor._reference_bands(
+                position, len(mlp_activations), len(entropy_values)
+            )
+
+        return ModelMeasurements(
+            mlp_activations=mlp_activations,
+            mlp_normalized=converter.normalize_activations(
+                mlp_activations,
+                scale_type=processor.scale,
+                max_bar_length=processor.max_bar_length,
+            ),
+            attention_entropy_values=entropy_values,
+            attention_entropy_values_normalized=converter.normalize_entropy(
+                entropy_values,
+                scale_type=processor.scale,
+                max_bar_length=processor.max_bar_length,
+            ),
+            generated_text=backend.decode(
+                self.token_ids[: position + 1],
+                skip_special_tokens=True,
+                clean_up_tokenization_spaces=True,
+            ),
+            predicted_char=backend.decode(
+                [next_token_id], clean_up_tokenization_spaces=True
+            ),
+            next_token_probs=self.dist_probs[position],
+            top_ids=top_ids,
+            top_probs=self.top_probs[position],
+            logits=logits,
+            decoded_tokens=[processor.token_label(t) for t in top_ids.tolist()],
+            **bands,
+        )
+
+
+def analyze_text(backend, state_processor, text, top_k=20, dist_n=100):
+    """
+    Runs text through the model once and returns its TextAnalysis.
+
+    Text longer than the model's position limit is cut to it, the number of
+    tokens left out is kept in TextAnalysis.dropped_tokens.
+
+    Args:
+        backend (ModelBackend): Backend to run
+        state_processor (StateProcessor): Supplies aggregation, scaling and labels
+        text (str): Text to analyze
+        top_k (int): Predictions kept per position
+        dist_n (int): Probabilities kept per position for the output distribution
+    """
+    token_ids = backend.tokenize(text, truncation=False).tolist()[0]
+    dropped_tokens = 0
+    limit = backend.position_limit()
+    if limit is not None and len(token_ids) > limit:
+        dropped_tokens = len(token_ids) - limit
+        token_ids = token_ids[:limit]
+    converter = state_processor.data_converter
+
+    start = time.perf_counter()
+    outputs = backend.forward([token_ids])
+    activations, entropy = converter.process_position_statistics(
+        outputs["hidden_states"], outputs["attentions"], state_processor.aggregation
+    )
+    top_ids, top_probs, top_logits, dist_probs = converter.process_position_predictions(
+        outputs["logits"][0], top_k=top_k, dist_n=dist_n
+    )
+    vocab_size = outputs["logits"].shape[-1]
+    seconds = time.perf_counter() - start
+
+    return TextAnalysis(
+        state_processor,
+        token_ids,
+        activations[:, 0, :],
+        entropy[:, 0, :],
+        top_ids,
+        top_probs,
+        top_logits,
+        dist_probs,
+        vocab_size,
+        seconds=seconds,
+        dropped_tokens=dropped_tokens,
+    )
@@ -0,0 +1,163 @@
+import sys
+from dataclasses import dataclass
+
+from rich.color import ColorSystem
+from rich.segment import Segment
+
+CSI = "\x1b["
+RESET = CSI + "0m"
+ENTER_SCREEN = CSI + "?1049h" + CSI + "?25l" + CSI + "2J"
+LEAVE_SCREEN = RESET + CSI + "?25h" + CSI + "?1049l"
+
+COLOR_SYSTEMS = {
+    "standard": ColorSystem.STANDARD,
+    "256": ColorSystem.EIGHT_BIT,
+    "truecolor": ColorSystem.TRUECOLOR,
+    "windows": ColorSystem.WINDOWS,
+}
+
+
+@dataclass
+class FrameStats:
+    frames: int = 0
+    bytes_written: int = 0
+    full_frame_bytes: int = 0  # what repainting every cell would have cost
+    last_frame_bytes: int = 0
+    changed_cells: int = 0
+
+    @property
+    def bytes_per_frame(self):
+        return self.bytes_written / self.frames if self.frames else 0.0
+
+    @property
+    def full_bytes_per_frame(self):
+        return self.full_frame_bytes / self.frames if self.frames else 0.0
+
+
+class CellDiffWriter:
+    """
+    Terminal output that only rewrites the cells that changed.
+
+    Every frame is rendered by rich into a grid of (character, style) cells
+    and compared with the previous grid. Each run of changed cells costs one
+    cursor move plus its characters, with an SGR sequence only where the
+    style changes. Drop-in for the start / update / stop part of rich Live.
+    """
+
+    def __init__(self, console, file=None):
+        self.console = console
+        self.file = file or sys.stdout
+        self.stats = FrameStats()
+        self._grid = None
+        self._size = None
+        self._sgr = {}
+        self._started = False
+
+    def start(self):
+        self._write(ENTER_SCREEN)
+        self._grid = None
+        self._started = True
+
+    def stop(self):
+        if not self._started:
+            return
+        self._write(LEAVE_SCREEN)
+        self._started = False
+
+    def summary(self):
+        return (
+            f"cell diff output: {self.stats.frames} frames, "
+            f"{self.stats.bytes_per_frame:.0f} B/frame "
+            f"(full repaint {self.stats.full_bytes_per_frame:.0f} B/frame)"
+        )
+
+    def _write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    def _style_codes(self, style):
+        # one SGR sequence per distinct style, rich renders it around a marker
+        codes = self._sgr.get(style)
+        if codes is None:
+            color_system = COLOR_SYSTEMS.get(self.console.color_system)
+            if style is None or color_system is None:
+                codes = ""
+            else:
+                codes = style.render("\0", color_system=color_system).split("\0")[0]
+            self._sgr[style] = codes
+        return codes
+
+    def _render_grid(self, renderable, width, height):
+        options = self.console.options.update_dimensions(width, height)
+        lines = self.console.render_lines(renderable, options, pad=True)
+        grid = []
+        for line in lines[:height]:
+            row = []
+            for text, style, control in Segment.simplify(line):
+                if control:
+                    continue
+                for char in text:
+                    char_width = Segment(char).cell_length
+                    if char_width == 0:
+                        continue
+                    row.append((char, style))
+                    # the right half of a wide character is drawn by its left half
+                    row.extend([("", style)] * (char_width - 1))
+            grid.append(row[:width] + [(" ", None)] * (width - len(row)))
+        grid.extend([[(" ", None)] * width for _ in range(height - len(grid))])
+        return grid
+
+    def _encode_run(self, pieces, row, col, cells, current_style):
+        pieces.append(f"{CSI}{row + 1};{col + 1}H")
+        for char, style in cells:
+            if char == "":
+                continue
+            if style != current_style:
+                pieces.append(RESET + self._style_codes(style))
+                current_style = style
+            pieces.append(char)
+        return current_style
+
+    def update(self, renderable, refresh=True):
+        width, height = self.console.size
+        grid = self._render_grid(renderable, width, height)
+
+        previous = self._grid
+        if previous is None or self._size != (width, height):
+            previous = None
+
+        pieces = [] if previous is not None else [RESET + CSI + "2J"]
+        full = []
+        current_style = None
+        full_style = None
+        changed = 0
+        for y, row in enumerate(grid):
+            full_style = self._encode_run(full, y, 0, row, full_style)
+            old_row = previous[y] if previous is not None else None
+            x = 0
+            while x < width:
+                if old_row is not None and row[x] == old_row[x]:
+                    x += 1
+                    continue
+                start = x
+                while x < width and (old_row is None or row[x] != old_row[x]):
+                    x += 1
+                # start a run on the left half of a wide character
+                while start > 0 and row[start][0] == "":
+                    start -= 1
+                changed += x - start
+                current_style = self._encode_run(
+                    pieces, y, start, row[start:x], current_style
+                )
+
+        frame = "".join(pieces) + RESET
+        self._write(frame)
+        self._grid = grid
+        self._size = (width, height)
+
+        frame_bytes = len(frame.encode("utf-8"))
+        self.stats.frames += 1
+        self.stats.bytes_written += frame_bytes
+        self.stats.last_frame_bytes = frame_bytes
+        self.stats.full_frame_bytes += len("".join(full).encode("utf-8"))
+        self.stats.changed_cells += changed
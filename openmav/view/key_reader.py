@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import select
+    import termios
+    import tty
+
+# escape sequences of the keys the viewer binds, read after ESC
+ARROW_KEYS = {"[C": "right", "[D": "left", "[A": "up", "[B": "down"}
+WINDOWS_ARROW_KEYS = {"M": "right", "K": "left", "H": "up", "P": "down"}
+
+
+class KeyReader:
+    """
+    Single key presses without Enter and without blocking.
+
+    Puts a POSIX terminal in cbreak mode for the duration of the with block
+    (msvcrt needs no setup). read_key(timeout) returns a character, an arrow
+    name ("left", "right", "up", "down") or None when nothing was pressed.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdin
+        self._saved = None
+
+    @staticmethod
+    def available(stream=None):
+        stream = stream or sys.stdin
+        return stream.isatty()
+
+    def __enter__(self):
+        if os.name != "nt":
+            fd = self.stream.fileno()
+            self._saved = termios.tcgetattr(fd)
+            tty.setcbreak(fd)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._saved is not None:
+            termios.tcsetattr(self.stream.fileno(), termios.TCSADRAIN, self._saved)
+            self._saved = None
+
+    def read_key(self, timeout=0.0):
+        if os.name == "nt":
+            return self._read_key_windows(timeout)
+        if not self._ready(timeout):
+            return None
+        char = os.read(self.stream.fileno(), 1).decode(errors="ignore")
+        if char == "\x1b" and self._ready(0.01):
+            sequence = os.read(self.stream.fileno(), 2).decode(errors="ignore")
+            return ARROW_KEYS.get(sequence, "escape")
+        return char
+
+    def _ready(self, timeout):
+        readable, _, _ = select.select([self.stream], [], [], max(0.0, timeout))
+        return bool(readable)
+
+    def _read_key_windows(self, timeout):
+        deadline = time.perf_counter() + max(0.0, timeout)
+        while not msvcrt.kbhit():
+            if time.perf_counter() >= deadline:
+                return None
+            time.sleep(0.01)
+        char = msvcrt.getwch()
+        if char in ("\x00", "\xe0"):
+            return WINDOWS_ARROW_KEYS.get(msvcrt.getwch(), "escape")
+        return char
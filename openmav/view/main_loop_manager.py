@@ -1,4 +1,5 @@
 import time
+from collections import deque
 
 import numpy as np
 from rich.align import Align
@@ -8,6 +9,8 @@ from rich.live import Live
 from rich.panel import Panel
 from rich.text import Text
 
+from openmav.view.cell_diff_writer import CellDiffWriter
+from openmav.view.key_reader import KeyReader
 from openmav.view.panels.panel_creator import PanelCreator
 
 
@@ -36,10 +39,21 @@ class MainLoopManager:
         selected_panels=None,
         version=None,
         external_panels=None,
+        branch_width=4,
+        branch_steps=10,
+        plugin_time_budget=0.05,
+        output_backend="rich",
+        prefetch_steps=8,
+        history_size=256,
     ):
         self.console = Console()
         self.state_provider = state_provider
-        self.live = Live(auto_refresh=False)
+        if output_backend == "rich":
+            self.live = Live(auto_refresh=False)
+        elif output_backend == "cell_diff":
+            self.live = CellDiffWriter(self.console)
+        else:
+            raise ValueError("Invalid output backend. Choose from: rich, cell_diff.")
         self.refresh_rate = refresh_rate
         self.interactive = interactive
         self.limit_chars = limit_chars
@@ -56,11 +70,16 @@ class MainLoopManager:
         self.selected_panels = selected_panels
         self.version = version
         self.model_name = model_name
+        self.branch_width = branch_width
+        self.branch_steps = branch_steps
+        self.prefetch_steps = prefetch_steps
+        self.history_size = history_size
         self.panel_creator = PanelCreator(
             max_bar_length=max_bar_length,
             limit_chars=limit_chars,
             selected_panels=selected_panels,
             external_panels=external_panels,
+            plugin_time_budget=plugin_time_budget,
         )
 
     def state_loop(self, prompt):
@@ -71,29 +90,402 @@ class MainLoopManager:
         self.live.start()
 
         try:
-            for data in self.state_provider.fetch_next(
+            steps = self.state_provider.fetch_next(
                 prompt,
                 temperature=self.temperature,
                 top_k=self.top_k,
                 top_p=self.top_p,
                 min_p=self.min_p,
                 repetition_penalty=self.repetition_penalty,
-            ):
+                on_prefill_chunk=self._render_prefill,
+            )
+            if self.interactive and KeyReader.available():
+                self._key_control_loop(steps)
+                return
+
+            for data in steps:
                 self._render_visualization(data)
 
                 if self.interactive:
+                    # no terminal to read keys from, fall back to line input
                     user_input = self.console.input("")
                     if user_input.lower() == "q":
                         break
+                    if user_input.lower().startswith("b"):
+                        self._explore_branches(user_input)
                 else:
                     if self.refresh_rate > 0:
                         time.sleep(self.refresh_rate)
 
         finally:
-            self.live.stop()
-            self.console.show_cursor(True)
+            self.panel_creator.close()
+            self._stop_live()
+
+    def _key_control_loop(self, steps):
+        """
+        Interactive viewer driven by single key presses.
+
+        space play / pause, right or n step, left or p rewind, up or + faster,
+        down or - slower, b branch from the shown step, q quit.
+
+        Shown steps are kept in a bounded history for rewinding. Whenever the
+        view waits, up to prefetch_steps further steps are generated ahead,
+        so stepping forward is instant.
+        """
+        frames = deque()  # history plus prefetched steps, oldest first
+        cursor = 0  # index of the shown frame
+        playing = False
+        exhausted = False
+        refresh_rate = max(self.refresh_rate, 0.02)
+
+        def fetch_one():
+            nonlocal cursor, exhausted
+            try:
+                frames.append(next(steps))
+            except StopIteration:
+                exhausted = True
+                return
+            if len(frames) > self.history_size + self.prefetch_steps and cursor > 0:
+                frames.popleft()
+                cursor -= 1
+
+        def render():
+            ahead = len(frames) - 1 - cursor
+            state = "playing" if playing else "paused"
+            self._render_visualization(
+                frames[cursor],
+                subtitle=f"{state} | step {frames[cursor].step} | "
+                f"{ahead} ahead | {refresh_rate:.2f}s | "
+                "space n/p +/- b q",
+            )
+
+        fetch_one()
+        if not frames:
+            return
+        render()
+
+        with KeyReader() as keys:
+            while True:
+                ahead = len(frames) - 1 - cursor
+                prefetch = not exhausted and ahead < self.prefetch_steps
+                key = keys.read_key(timeout=0.0 if prefetch and not playing else refresh_rate)
+
+                if key is None:
+                    if playing:
+                        if ahead == 0 and not exhausted:
+                            fetch_one()
+                        if cursor + 1 < len(frames):
+                            cursor += 1
+                        else:
+                            playing = False
+                        render()
+                    elif prefetch:
+                        fetch_one()
+                        render()
+                    continue
+
+                if key == "q":
+                    break
+                if key == " ":
+                    playing = not playing
+                elif key in ("right", "n"):
+                    if cursor + 1 == len(frames) and not exhausted:
+                        fetch_one()
+                    cursor = min(cursor + 1, len(frames) - 1)
+                elif key in ("left", "p"):
+                    cursor = max(cursor - 1, 0)
+                elif key in ("up", "+"):
+                    refresh_rate = max(refresh_rate / 1.5, 0.02)
+                elif key in ("down", "-"):
+                    refresh_rate = min(refresh_rate * 1.5, 5.0)
+                elif key == "b":
+                    playing = False
+                    self._show_branches(
+                        self.branch_width, self.branch_steps, frames[cursor]
+                    )
+                    while keys.read_key(timeout=0.1) is None:
+                        pass
+                render()
+
+    def analysis_loop(self, text):
+        """
+        Scrubs through the positions of an analyzed text.
 
-    def _render_visualization(self, data):
+        Interactive commands: Enter or "n" next, "p" previous, a number jumps
+        to that position, "q" quits. Otherwise positions play in order.
+        """
+        analysis = self.state_provider.analyze(text)
+        truncated = ""
+        if analysis.dropped_tokens:
+            truncated = (
+                f" | [bold red]{analysis.dropped_tokens} tokens past the "
+                "position limit not analyzed[/]"
+            )
+        self.console.show_cursor(False)
+        self.live.start()
+
+        try:
+            position = 0
+            while True:
+                self._render_visualization(
+                    analysis.measurements(position),
+                    subtitle=f"position {position + 1}/{len(analysis)} "
+                    f"| {analysis.tokens_per_sec:.0f} tok/s{truncated}",
+                )
+
+                if not self.interactive:
+                    if position + 1 >= len(analysis):
+                        break
+                    position += 1
+                    if self.refresh_rate > 0:
+                        time.sleep(self.refresh_rate)
+                    continue
+
+                command = self.console.input("").strip().lower()
+                if command == "q":
+                    break
+                if command == "p":
+                    position -= 1
+                elif command.isdigit():
+                    position = int(command) - 1
+                else:
+                    position += 1
+                position = max(0, min(position, len(analysis) - 1))
+
+        finally:
+            self.panel_creator.close()
+            self._stop_live()
+
+    def replay_loop(self, run, steps):
+        """
+        Shows recorded steps of a RecordedRun, e.g. the matches of a query.
+
+        Interactive commands: Enter or "n" next, "p" previous, a number jumps
+        to that match, "q" quits. Otherwise the steps play in order.
+        """
+        self.console.show_cursor(False)
+        self.live.start()
+
+        try:
+            index = 0
+            while len(steps):
+                step = int(steps[index])
+                self._render_visualization(
+                    run.measurements(step),
+                    subtitle=f"{run.name} | match {index + 1}/{len(steps)} "
+                    f"| step {step + 1}/{run.num_steps}",
+                )
+
+                if not self.interactive:
+                    if index + 1 >= len(steps):
+                        break
+                    index += 1
+                    if self.refresh_rate > 0:
+                        time.sleep(self.refresh_rate)
+                    continue
+
+                command = self.console.input("").strip().lower()
+                if command == "q":
+                    break
+                if command == "p":
+                    index -= 1
+                elif command.isdigit():
+                    index = int(command) - 1
+                else:
+                    index += 1
+                index = max(0, min(index, len(steps) - 1))
+
+        finally:
+            self.panel_creator.close()
+            self._stop_live()
+
+    def ablation_loop(self, prompt, metric="kl", batch_size=32):
+        """
+        Shows the head ablation heatmap filling in, batch by batch. The final
+        view stays until Enter in interactive mode.
+        """
+        self.console.show_cursor(False)
+        self.live.start()
+
+        try:
+            start = time.perf_counter()
+            for data in self.state_provider.ablate_heads(
+                prompt, metric=metric, batch_size=batch_size
+            ):
+                measured = int((~np.isnan(data.head_importance)).sum())
+                elapsed = time.perf_counter() - start
+                self._render_visualization(
+                    data,
+                    subtitle=f"head ablation {measured}/{data.head_importance.size} "
+                    f"| {measured / elapsed if elapsed > 0 else 0.0:.0f} heads/s",
+                )
+            if self.interactive:
+                self.console.input("")
+
+        finally:
+            self.panel_creator.close()
+            self._stop_live()
+
+    def _stop_live(self):
+        self.live.stop()
+        self.console.show_cursor(True)
+        if isinstance(self.live, CellDiffWriter):
+            self.console.print(self.live.summary())
+
+    def _explore_branches(self, command):
+        """
+        Follows the top alternatives of the current step side by side.
+
+        command is "b [num_branches] [num_steps]", the view stays until the
+        next input.
+        """
+        args = command.split()[1:]
+        try:
+            num_branches = int(args[0]) if len(args) > 0 else self.branch_width
+            num_steps = int(args[1]) if len(args) > 1 else self.branch_steps
+        except ValueError:
+            return
+
+        self._show_branches(num_branches, num_steps)
+        self.console.input("")
+
+    def _show_branches(self, num_branches, num_steps, measurements=None):
+        """
+        Renders the branches of measurements' step, of the last step when None.
+        A step that can't be branched from shows why instead.
+        """
+        step = measurements.step if measurements is not None else None
+        try:
+            for step_measurements in self.state_provider.branch(
+                num_branches=num_branches,
+                num_steps=num_steps,
+                step=step,
+                top_ids=measurements.top_ids if step is not None else None,
+            ):
+                self._render_branches(step_measurements)
+                if self.refresh_rate > 0:
+                    time.sleep(self.refresh_rate)
+        except ValueError as e:
+            self._render_columns(
+                [None],
+                headers=[f"[red]{e}[/]"],
+                subtitle=f"[bold red]can't branch:[/] {e}",
+            )
+
+    def _render_branches(self, step_measurements):
+        """
+        Renders one column of panels per branch.
+        """
+        self._render_columns(
+            step_measurements, subtitle=f"branches: {len(step_measurements)}"
+        )
+
+    def _render_columns(self, measurements_list, headers=None, subtitle=""):
+        """
+        Renders measurements side by side, one column of panels each.
+
+        A column whose measurements are None shows its header (e.g. a loading
+        or error message) instead of panels.
+        """
+        layout = Layout()
+
+        title_bar = Layout(
+            Panel(
+                Align.center(
+                    f"| OpenMAV v{self.version} | model: {self.model_name} "
+                    f"| {subtitle} |"
+                ),
+                border_style="white",
+            ),
+            size=3,
+        )
+        columns = [Layout() for _ in measurements_list]
+        body = Layout()
+        body.split_row(*columns)
+        layout.split_column(title_bar, body)
+
+        headers = headers or [None] * len(measurements_list)
+        for slot, (column, measurements, header) in enumerate(
+            zip(columns, measurements_list, headers)
+        ):
+            if measurements is None:
+                column.update(Panel(Align.center(header or ""), border_style="dim"))
+                continue
+
+            rows = [
+                Layout(panel)
+                for panel in self.panel_creator.get_panels(measurements, slot=slot)
+            ]
+            if header:
+                rows.insert(
+                    0, Layout(Panel(Align.center(header), border_style="white"), size=3)
+                )
+            column.split_column(*rows)
+
+        self.live.update(layout, refresh=True)
+
+    def multi_model_loop(self, workers):
+        """
+        Renders a grid with one column per ModelWorker until all of them finish.
+        """
+        self.console.show_cursor(False)
+        self.live.start()
+
+        try:
+            for worker in workers:
+                worker.start()
+
+            while True:
+                measurements_list = []
+                headers = []
+                for worker in workers:
+                    error = worker.error
+                    measurements = None if error else worker.latest()
+                    measurements_list.append(measurements)
+                    if error:
+                        headers.append(f"[bold red]{worker.model_name}: {error}[/]")
+                    elif measurements is None:
+                        headers.append(f"[dim]{worker.model_name}: loading...[/]")
+                    else:
+                        headers.append(
+                            f"[bold white]{worker.model_name}[/] "
+                            f"[bold yellow]{measurements.decode_tokens_per_sec:.1f}[/] tok/s"
+                        )
+
+                self._render_columns(
+                    measurements_list, headers=headers, subtitle=f"models: {len(workers)}"
+                )
+                if all(worker.done for worker in workers):
+                    break
+                time.sleep(max(self.refresh_rate, 0.01))
+
+        finally:
+            for worker in workers:
+                worker.close()
+            self.panel_creator.close()
+            self._stop_live()
+
+    def _render_prefill(self, chunk):
+        """
+        Shows prefill progress while the prompt is pushed through in chunks.
+        """
+        done = int(self.max_bar_length * chunk.end / max(1, chunk.total_tokens))
+        bar = "█" * done
+        self.live.update(
+            Panel(
+                Align.center(
+                    f"[bold white]Prefill[/] [bold cyan]{bar.ljust(self.max_bar_length)}[/] "
+                    f"chunk {chunk.index + 1}/{chunk.num_chunks} | "
+                    f"{chunk.end}/{chunk.total_tokens} tok | "
+                    f"[bold yellow]{chunk.tokens_per_sec:.1f}[/] tok/s"
+                ),
+                title=f"OpenMAV v{self.version} | model: {self.model_name}",
+                border_style="white",
+            ),
+            refresh=True,
+        )
+
+    def _render_visualization(self, data, subtitle=""):
         """
         Handles UI updates based on provided data.
         """
@@ -106,11 +498,19 @@ class MainLoopManager:
             len(panels) + num_rows - 1
         ) // num_rows  # Best effort even distribution
 
+        title = f"| OpenMAV v{self.version} | model: {self.model_name}"
+        if subtitle:
+            title += f" | {subtitle}"
+        if isinstance(self.live, CellDiffWriter) and self.live.stats.frames:
+            title += f" | {self.live.stats.last_frame_bytes} B/frame"
+        slow_plugins = self.panel_creator.slow_plugins()
+        if slow_plugins:
+            title += " | slow plugins: " + ", ".join(
+                f"{name} ({misses} missed)" for name, misses in slow_plugins.items()
+            )
+
         title_bar = Layout(
-            Panel(
-                Align.center(f"| OpenMAV v{self.version} | model: {self.model_name}"),
-                border_style="white",
-            ),
+            Panel(Align.center(title), border_style="white"),
             size=3,
         )
         rows = [Layout() for _ in range(num_rows)]
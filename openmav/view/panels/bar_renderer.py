@@ -0,0 +1,86 @@
+from functools import lru_cache
+
+import numpy as np
+from rich.text import Span, Text
+
+# partial blocks, index is the number of filled eighths
+EIGHTH_BLOCKS = ["", "▏", "▎", "▍", "▌", "▋", "▊", "▉"]
+
+
+@lru_cache(maxsize=16)
+def bar_glyph_table(max_bar_length):
+    """
+    Every bar of up to max_bar_length cells at eighth-cell resolution.
+
+    Entry n is n/8 cells of blocks padded with spaces to max_bar_length, so a
+    bar is a single lookup per value.
+    """
+    table = []
+    for eighths in range(max_bar_length * 8 + 1):
+        full, partial = divmod(eighths, 8)
+        table.append(("█" * full + EIGHTH_BLOCKS[partial]).ljust(max_bar_length))
+    return np.array(table, dtype=object)
+
+
+@lru_cache(maxsize=16)
+def layer_labels(num_layers, start=0, prefix="Layer"):
+    return [f"{prefix} {i:2d}" for i in range(start, start + num_layers)]
+
+
+def bar_strings(bar_values, max_bar_length):
+    """
+    Bars for a whole array of lengths given in (fractional) cells.
+    """
+    eighths = np.rint(np.abs(np.asarray(bar_values, dtype=float)) * 8)
+    eighths = np.clip(np.nan_to_num(eighths), 0, max_bar_length * 8).astype(int)
+    return bar_glyph_table(max_bar_length)[eighths]
+
+
+def render_bar_rows(
+    labels,
+    bar_values,
+    value_labels,
+    max_bar_length,
+    bar_styles="yellow",
+    label_style="bold white",
+    value_style="bold yellow",
+    separator=" | : ",
+    bar_open="",
+    bar_close="",
+):
+    """
+    Renders "label | : bar value" rows straight into a rich Text.
+
+    Styles are attached as spans over one joined string, so nothing goes
+    through markup parsing.
+
+    Args:
+        labels (list): Row labels
+        bar_values (numpy.ndarray): Bar lengths in cells
+        value_labels (list): Preformatted values shown after each bar
+        max_bar_length (int): Width of the bar column
+        bar_styles (str or list): One style for all bars or one per row
+
+    Returns:
+        rich.text.Text: The rendered rows
+    """
+    bars = bar_strings(bar_values, max_bar_length)
+    if isinstance(bar_styles, str):
+        bar_styles = [bar_styles] * len(bars)
+
+    pieces = []
+    spans = []
+    offset = 0
+    for label, bar, bar_style, value in zip(labels, bars, bar_styles, value_labels):
+        label_end = offset + len(label)
+        bar_start = label_end + len(separator) + len(bar_open)
+        value_start = bar_start + len(bar) + len(bar_close) + 1
+        value_end = value_start + len(value)
+
+        pieces.append(f"{label}{separator}{bar_open}{bar}{bar_close} {value}\n")
+        spans.append(Span(offset, label_end, label_style))
+        spans.append(Span(bar_start, bar_start + len(bar), bar_style))
+        spans.append(Span(value_start, value_end, value_style))
+        offset = value_end + 1
+
+    return Text("".join(pieces), spans=spans)
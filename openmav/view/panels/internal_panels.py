@@ -1,11 +1,26 @@
 import numpy as np
-import torch
+from rich.markup import escape
 from rich.text import Text
 
 from openmav.api.measurements import ModelMeasurements
+from openmav.view.panels.bar_renderer import (bar_strings, layer_labels,
+                                              render_bar_rows)
 from openmav.view.panels.panel_base import PanelBase
 
 
+def reference_flags(values, band):
+    """
+    -1 / 0 / +1 per layer for below, inside or above a profiled band.
+    """
+    if band is None:
+        return np.zeros(len(values), dtype=int)
+    low, high = np.asarray(band, dtype=float)
+    return np.where(values < low, -1, np.where(values > high, 1, 0))
+
+
+REFERENCE_MARKERS = np.array(["", " ▲", " ▼"])  # indexed by flag: 0, +1, -1
+
+
 class TopPredictionsPanel(PanelBase):
     def __init__(
         self,
@@ -50,28 +65,16 @@ class MlpActivationsPanel(PanelBase):
         self.measurements = measurements
 
     def get_panel_content(self):
-        activations_str = ""
-        for i, (mlp_act, raw_mlp) in enumerate(
-            zip(self.measurements.mlp_normalized, self.measurements.mlp_activations)
-        ):
-            mlp_act_scalar = (
-                mlp_act.item()
-                if isinstance(mlp_act, (torch.Tensor, np.ndarray))
-                else float(mlp_act)
-            )
-            raw_mlp_scalar = (
-                raw_mlp.item()
-                if isinstance(raw_mlp, (torch.Tensor, np.ndarray))
-                else float(raw_mlp)
-            )
-            mlp_bar = "█" * int(abs(mlp_act_scalar))
-            mlp_color = "yellow" if raw_mlp_scalar >= 0 else "magenta"
-
-            activations_str += (
-                f"[bold white]Layer {i:2d}[/] | "
-                f"[bold yellow]:[/] [{mlp_color}]{mlp_bar.ljust(self.max_bar_length)}[/] [bold yellow]{raw_mlp_scalar:+.1f}[/]\n"
-            )
-        return activations_str
+        raw = np.asarray(self.measurements.mlp_activations, dtype=float).reshape(-1)
+        flags = reference_flags(raw, self.measurements.mlp_reference_band)
+        styles = np.where(raw >= 0, "yellow", "magenta")
+        return render_bar_rows(
+            layer_labels(len(raw)),
+            np.asarray(self.measurements.mlp_normalized, dtype=float).reshape(-1),
+            np.char.add(np.char.mod("%+.1f", raw), REFERENCE_MARKERS[flags]),
+            self.max_bar_length,
+            bar_styles=np.where(flags != 0, "bold red", styles).tolist(),
+        )
 
 
 class AttentionEntropyPanel(PanelBase):
@@ -90,18 +93,22 @@ class AttentionEntropyPanel(PanelBase):
         self.measurements = measurements
 
     def get_panel_content(self):
-        entropy_str = ""
-        for i, (entropy_val, entropy_norm) in enumerate(
-            zip(
-                self.measurements.attention_entropy_values,
-                self.measurements.attention_entropy_values_normalized,
-            )
-        ):
-            entropy_val = float(entropy_val)
-            entropy_norm = int(abs(float(entropy_norm)))
-            entropy_bar = "█" * entropy_norm
-            entropy_str += f"[bold white]Layer {i + 1:2d}[/] | [bold yellow]:[/] [{entropy_bar.ljust(self.max_bar_length)}] {entropy_val:.1f}\n"
-        return entropy_str
+        values = np.asarray(
+            self.measurements.attention_entropy_values, dtype=float
+        ).reshape(-1)
+        flags = reference_flags(values, self.measurements.entropy_reference_band)
+        return render_bar_rows(
+            layer_labels(len(values), start=1),
+            np.asarray(
+                self.measurements.attention_entropy_values_normalized, dtype=float
+            ).reshape(-1),
+            np.char.add(np.char.mod("%.1f", values), REFERENCE_MARKERS[flags]),
+            self.max_bar_length,
+            bar_styles=np.where(flags != 0, "bold red", "default").tolist(),
+            value_style="default",
+            bar_open="[",
+            bar_close="]",
+        )
 
 
 class OutputDistributionPanel(PanelBase):
@@ -170,3 +177,424 @@ class GeneratedTextPanel(PanelBase):
         )
         text.append(self.measurements.predicted_char, style="bold on green")
         return text
+
+
+class ThroughputPanel(PanelBase):
+    def __init__(
+        self,
+        measurements: ModelMeasurements,
+        max_bar_length: int = 20,
+        limit_chars: int = 50,
+        max_chunks: int = 8,
+    ):
+        super().__init__(
+            title="Throughput",
+            border_style="white",
+            max_bar_length=max_bar_length,
+            limit_chars=limit_chars,
+        )
+        self.measurements = measurements
+        self.max_chunks = max_chunks
+
+    def get_panel_content(self):
+        stats = self.measurements.prefill_stats
+        lines = [
+            f"[bold white]Decode [/] | [bold yellow]{self.measurements.decode_tokens_per_sec:8.1f}[/] tok/s"
+        ]
+        if not self.measurements.captured:
+            lines.append(
+                f"[bold white]Capture[/] | [dim]lean step, layers from step "
+                f"{self.measurements.captured_step + 1}[/]"
+            )
+        if self.measurements.evicted_tokens:
+            lines.append(
+                f"[bold white]Stream [/] | [bold yellow]{self.measurements.evicted_tokens:8d}[/] "
+                "tokens evicted"
+            )
+        timings = self.measurements.load_timings
+        if timings:
+            lines.insert(
+                0,
+                f"[bold white]Load   [/] | [bold yellow]{sum(timings.values()):8.2f}[/] s "
+                "("
+                + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items())
+                + ")",
+            )
+        if stats is None:
+            return "\n".join(lines)
+
+        lines.insert(
+            0,
+            f"[bold white]Prefill[/] | [bold yellow]{stats.tokens_per_sec:8.1f}[/] tok/s "
+            f"({stats.num_tokens} tok, {stats.cached_tokens} cached, "
+            f"{len(stats.chunks)} x {stats.chunk_size})",
+        )
+        for chunk in stats.chunks[-self.max_chunks :]:
+            lines.append(
+                f"[bold white]chunk {chunk.index + 1:3d}[/] | "
+                f"{chunk.start:>6d}-{chunk.end:<6d} [bold cyan]{chunk.tokens_per_sec:8.1f}[/] tok/s"
+            )
+        return "\n".join(lines)
+
+
+class LogitLensPanel(PanelBase):
+    def __init__(
+        self,
+        measurements: ModelMeasurements,
+        max_bar_length: int = 20,
+        limit_chars: int = 50,
+    ):
+        super().__init__(
+            title="Logit Lens",
+            border_style="bright_blue",
+            max_bar_length=max_bar_length,
+            limit_chars=limit_chars,
+        )
+        self.measurements = measurements
+
+    def get_panel_content(self):
+        if self.measurements.logit_lens_tokens is None:
+            return "[dim]logit lens not captured (--logit-lens-top-k 0)[/]"
+
+        lens_str = ""
+        for i, (tokens, probs) in enumerate(
+            zip(
+                self.measurements.logit_lens_tokens,
+                self.measurements.logit_lens_probs.tolist(),
+            )
+        ):
+            entries = " ".join(
+                f"[bold magenta]{token:<10}[/] [bold yellow]{prob:>5.1%}[/]"
+                for token, prob in zip(tokens, probs)
+            )
+            lens_str += f"[bold white]Layer {i:2d}[/] | {entries}\n"
+        return lens_str
+
+
+class ModelDiffPanel(PanelBase):
+    def __init__(
+        self,
+        measurements: ModelMeasurements,
+        max_bar_length: int = 20,
+        limit_chars: int = 50,
+        warn_ratio: float = 0.1,
+        alert_ratio: float = 0.25,
+    ):
+        super().__init__(
+            title="Model Diff",
+            border_style="red",
+            max_bar_length=max_bar_length,
+            limit_chars=limit_chars,
+        )
+        self.measurements = measurements
+        self.warn_ratio = warn_ratio
+        self.alert_ratio = alert_ratio
+
+    def _divergence_color(self, delta, base):
+        ratio = abs(delta) / (abs(base) + 1e-9)
+        if ratio >= self.alert_ratio:
+            return "bold red"
+        if ratio >= self.warn_ratio:
+            return "yellow"
+        return "green"
+
+    def get_panel_content(self):
+        comparison = self.measurements.comparison
+        if comparison is None:
+            return "[dim]no compare model (--compare-model)[/]"
+
+        agree_color = "green" if comparison.top1_agrees else "bold red"
+        diff_str = (
+            f"[bold white]vs {comparison.model_name}[/] | "
+            f"KL [bold yellow]{comparison.kl_divergence:.3f}[/] | "
+            f"top-1 [{agree_color}]{comparison.decoded_tokens[0]}[/] "
+            f"({comparison.top_probs[0].item():.1%})\n"
+        )
+        if comparison.generated_text is not None:
+            # intervened row: its prompt positions share the clean prefill
+            diff_str += (
+                "[dim]prompt KV is clean, the intervention acts on generated "
+                "tokens only[/]\n"
+                f"[dim]{escape(comparison.generated_text[-self.limit_chars:])}[/]\n"
+            )
+
+        mlp_delta = np.asarray(comparison.mlp_delta, dtype=float).reshape(-1)
+        entropy_delta = np.asarray(
+            comparison.attention_entropy_delta, dtype=float
+        ).reshape(-1)
+        base_mlp = np.asarray(self.measurements.mlp_activations, dtype=float).reshape(-1)
+        max_delta = max(np.abs(mlp_delta).max(initial=0.0), 1e-9)
+        bars = bar_strings(
+            np.abs(mlp_delta) / max_delta * self.max_bar_length, self.max_bar_length
+        )
+
+        for i, (delta, bar) in enumerate(zip(mlp_delta, bars)):
+            color = self._divergence_color(delta, base_mlp[i])
+            entropy_part = ""
+            # entropy has no entry for the embedding layer
+            if 0 < i <= len(entropy_delta):
+                entropy_part = f" ΔH {entropy_delta[i - 1]:+.2f}"
+            diff_str += (
+                f"[bold white]Layer {i:2d}[/] | [{color}]{bar}[/] "
+                f"[{color}]{delta:+.1f}[/]{entropy_part}\n"
+            )
+        return diff_str
+
+
+class ResidualTrajectoryPanel(PanelBase):
+    LAYER_COLORS = ["cyan", "magenta", "yellow", "green", "red", "blue"]
+
+    def __init__(
+        self,
+        measurements: ModelMeasurements,
+        max_bar_length: int = 20,
+        limit_chars: int = 50,
+        height: int = 12,
+    ):
+        super().__init__(
+            title="Residual Trajectory",
+            border_style="bright_cyan",
+            max_bar_length=max_bar_length,
+            limit_chars=limit_chars,
+        )
+        self.measurements = measurements
+        self.height = height
+
+    def get_panel_content(self):
+        trajectories = self.measurements.residual_trajectories
+        if not trajectories:
+            return "[dim]no trajectory layers (--trajectory-layers)[/]"
+
+        width = max(self.max_bar_length, 10)
+        all_points = np.concatenate(
+            [points for points in trajectories.values() if len(points)] or [np.zeros((1, 2))]
+        )
+        low = all_points.min(axis=0)
+        span = np.maximum(all_points.max(axis=0) - low, 1e-9)
+
+        grid = [[(" ", None)] * width for _ in range(self.height)]
+        legend = []
+        for n, (layer, points) in enumerate(trajectories.items()):
+            color = self.LAYER_COLORS[n % len(self.LAYER_COLORS)]
+            legend.append(f"[{color}]● layer {layer}[/]")
+            if not len(points):
+                continue
+            cols = ((points[:, 0] - low[0]) / span[0] * (width - 1)).astype(int)
+            rows = ((1 - (points[:, 1] - low[1]) / span[1]) * (self.height - 1)).astype(int)
+            for row, col in zip(rows[:-1], cols[:-1]):
+                grid[row][col] = ("·", color)
+            grid[rows[-1]][cols[-1]] = ("●", f"bold {color}")
+
+        lines = [
+            "".join(f"[{style}]{char}[/]" if style else char for char, style in row)
+            for row in grid
+        ]
+        return "\n".join(lines + [" ".join(legend)])
+
+
+class AttentionSourcesPanel(PanelBase):
+    def __init__(
+        self,
+        measurements: ModelMeasurements,
+        max_bar_length: int = 20,
+        limit_chars: int = 50,
+    ):
+        super().__init__(
+            title="Attention Sources",
+            border_style="bright_magenta",
+            max_bar_length=max_bar_length,
+            limit_chars=limit_chars,
+        )
+        self.measurements = measurements
+
+    def get_panel_content(self):
+        m = self.measurements
+        if m.attention_layer_source_tokens is None:
+            return "[dim]attention sources not captured (--attention-sources-top-k 0)[/]"
+
+        # most focused head per layer: highest top-1 weight
+        head_top1 = m.attention_source_weights[:, :, 0]
+        focused_heads = head_top1.argmax(dim=-1).tolist()
+
+        sources_str = ""
+        for i, (tokens, weights) in enumerate(
+            zip(m.attention_layer_source_tokens, m.attention_layer_source_weights.tolist())
+        ):
+            entries = " ".join(
+                f"[bold magenta]{token}[/] [bold yellow]{weight:.2f}[/]"
+                for token, weight in zip(tokens, weights)
+            )
+            head = focused_heads[i]
+            sources_str += (
+                f"[bold white]Layer {i + 1:2d}[/] | {entries} | "
+                f"[cyan]h{head:<2d}→ {m.attention_source_tokens[i][head][0]} "
+                f"{head_top1[i, head].item():.2f}[/]\n"
+            )
+        return sources_str
+
+
+class MlpNeuronsPanel(PanelBase):
+    def __init__(
+        self,
+        measurements: ModelMeasurements,
+        max_bar_length: int = 20,
+        limit_chars: int = 50,
+    ):
+        super().__init__(
+            title="MLP Neurons",
+            border_style="bright_yellow",
+            max_bar_length=max_bar_length,
+            limit_chars=limit_chars,
+        )
+        self.measurements = measurements
+
+    def get_panel_content(self):
+        if self.measurements.mlp_neuron_ids is None:
+            return "[dim]MLP neurons not captured (--mlp-neurons-top-k 0)[/]"
+
+        neurons_str = ""
+        for i, (ids, values) in enumerate(
+            zip(
+                self.measurements.mlp_neuron_ids.tolist(),
+                self.measurements.mlp_neuron_values.tolist(),
+            )
+        ):
+            entries = " ".join(
+                f"[bold white]n{neuron:<5d}[/][{'yellow' if value >= 0 else 'magenta'}]{value:+6.2f}[/]"
+                for neuron, value in zip(ids, values)
+            )
+            neurons_str += f"[bold white]Layer {i:2d}[/] | {entries}\n"
+        return neurons_str
+
+
+class AttentionRolloutPanel(PanelBase):
+    def __init__(
+        self,
+        measurements: ModelMeasurements,
+        max_bar_length: int = 20,
+        limit_chars: int = 50,
+    ):
+        super().__init__(
+            title="Attention Rollout",
+            border_style="bright_cyan",
+            max_bar_length=max_bar_length,
+            limit_chars=limit_chars,
+        )
+        self.measurements = measurements
+
+    def get_panel_content(self):
+        m = self.measurements
+        if m.attention_rollout_tokens is None:
+            return "[dim]attention rollout not tracked (--attention-rollout-top-k 0)[/]"
+
+        weights = m.attention_rollout_weights.float().numpy()
+        peak = weights.max() if len(weights) and weights.max() > 0 else 1.0
+        rows = render_bar_rows(
+            [
+                f"{token:<10} @{position:<5d}"
+                for token, position in zip(
+                    m.attention_rollout_tokens, m.attention_rollout_positions.tolist()
+                )
+            ],
+            weights / peak * self.max_bar_length,
+            np.char.mod("%.3f", weights),
+            self.max_bar_length,
+            bar_styles="bright_cyan",
+            label_style="bold magenta",
+        )
+        return Text.assemble(
+            rows, (f"prompt share {m.attention_rollout_prompt_share:.2f}", "dim")
+        )
+
+
+class SaeFeaturesPanel(PanelBase):
+    def __init__(
+        self,
+        measurements: ModelMeasurements,
+        max_bar_length: int = 20,
+        limit_chars: int = 50,
+    ):
+        super().__init__(
+            title="SAE Features",
+            border_style="bright_green",
+            max_bar_length=max_bar_length,
+            limit_chars=limit_chars,
+        )
+        self.measurements = measurements
+
+    def get_panel_content(self):
+        m = self.measurements
+        if m.sae_feature_ids is None:
+            return "[dim]no SAE loaded (--sae-path)[/]"
+
+        values = m.sae_feature_values.numpy()
+        peak = values.max() if len(values) and values.max() > 0 else 1.0
+        return render_bar_rows(
+            [
+                f"f{feature:<6d} {label[: self.limit_chars // 2]:<{self.limit_chars // 2}}"
+                for feature, label in zip(
+                    m.sae_feature_ids.tolist(), m.sae_feature_labels
+                )
+            ],
+            values / peak * self.max_bar_length,
+            np.char.mod("%.2f", values),
+            self.max_bar_length,
+            bar_styles="bright_green",
+        )
+
+
+# heatmap shades, index grows with the score's share of the largest one
+HEATMAP_SHADES = np.array([" ", "░", "▒", "▓", "█"])
+
+
+class HeadImportancePanel(PanelBase):
+    def __init__(
+        self,
+        measurements: ModelMeasurements,
+        max_bar_length: int = 20,
+        limit_chars: int = 50,
+    ):
+        super().__init__(
+            title="Head Importance",
+            border_style="bright_red",
+            max_bar_length=max_bar_length,
+            limit_chars=limit_chars,
+        )
+        self.measurements = measurements
+
+    def get_panel_content(self):
+        m = self.measurements
+        if m.head_importance is None:
+            return "[dim]no head ablation scan (mav ablate)[/]"
+
+        scores = np.asarray(m.head_importance, dtype=float)
+        measured = ~np.isnan(scores)
+        peak = np.abs(scores[measured]).max() if measured.any() else 0.0
+        shades = np.rint(np.abs(np.nan_to_num(scores)) / (peak or 1.0) * 4).astype(int)
+        # logit changes are signed: a drop of the clean top token is red
+        styles = np.where(scores < 0, "bright_red", "bright_green")
+        if m.head_importance_metric == "kl":
+            styles[:] = "bright_red"
+
+        text = Text(
+            f"{'head':<9}" + "".join(str(head % 10) for head in range(scores.shape[1])) + "\n",
+            style="dim",
+        )
+        for layer, label in enumerate(layer_labels(len(scores))):
+            text.append(f"{label} ", style="bold white")
+            for head in range(scores.shape[1]):
+                if not measured[layer, head]:
+                    text.append("·", style="dim")
+                else:
+                    text.append(HEATMAP_SHADES[shades[layer, head]], style=styles[layer, head])
+            top = np.nanargmax(np.abs(scores[layer])) if measured[layer].any() else None
+            if top is not None:
+                text.append(f" h{top:<2d} {scores[layer, top]:+.3f}", style="bold yellow")
+            text.append("\n")
+
+        metric = "KL(clean || ablated)" if m.head_importance_metric == "kl" else "Δ top-1 logit"
+        text.append(
+            f"{metric} | max {peak:.3f} | {int(measured.sum())}/{scores.size} heads",
+            style="dim",
+        )
+        return text
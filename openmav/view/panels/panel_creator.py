@@ -1,11 +1,27 @@
 import inspect
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from typing import List, Optional
 
+from rich.panel import Panel
+from rich.text import Text
+
 from openmav.api.measurements import ModelMeasurements
 from openmav.view.panels import internal_panels
 from openmav.view.panels.panel_base import PanelBase
 
+# shown when no panels are selected, the newer panels cost extra work per
+# step and are opt-in by name
+DEFAULT_PANELS = (
+    "generated_text",
+    "top_predictions",
+    "output_distribution",
+    "mlp_activations",
+    "attention_entropy",
+)
+
 
 def capital_to_snake(text):
     result = [text[0].lower()]
@@ -18,6 +34,15 @@ def capital_to_snake(text):
     return "".join(result)
 
 
+@dataclass
+class PluginStats:
+    renders: int = 0
+    misses: int = 0
+    consecutive_misses: int = 0
+    errors: int = 0
+    last_seconds: float = 0.0
+
+
 class PanelCreator:
     def __init__(
         self,
@@ -26,6 +51,8 @@ class PanelCreator:
         num_bins=20,
         selected_panels=None,
         external_panels: Optional[List[PanelBase]] = None,
+        plugin_time_budget=0.05,
+        plugin_workers=4,
     ):
         self.max_bar_length = max_bar_length
         self.limit_chars = limit_chars
@@ -35,7 +62,24 @@ class PanelCreator:
             external_panels or []
         )  # Ensure external_panels is never None
 
-    def get_panels(self, measurements: ModelMeasurements):
+        # external panels render on a worker pool, a frame waits for them at
+        # most plugin_time_budget seconds and falls back to their last render.
+        # Threads bound the frame latency only: a CPU-bound plugin in pure
+        # Python still holds the GIL and slows the UI thread down
+        self.plugin_time_budget = plugin_time_budget
+        self.plugin_workers = plugin_workers
+        self.plugin_stats = {}
+        self._plugin_executor = None
+        self._plugin_futures = {}
+        self._plugin_last_good = {}
+
+    def get_panels(self, measurements: ModelMeasurements, slot=0):
+        """
+        Builds the selected panels for one set of measurements.
+
+        slot separates plugin renders of views shown in the same frame (e.g.
+        one per branch) so they don't pick up each other's results.
+        """
         # Get internal panel classes (still removing "Panel" suffix)
         internal_panel_classes = {
             capital_to_snake(name[: -len("Panel")]): cls
@@ -56,7 +100,19 @@ class PanelCreator:
                     panel_name = capital_to_snake(panel.__class__.__name__)
                     external_panel_classes[panel_name] = panel.__class__
 
-        all_panel_classes = {**internal_panel_classes, **external_panel_classes}
+        if self.selected_panels is None:
+            self.selected_panels = list(DEFAULT_PANELS) + list(external_panel_classes)
+
+        internal_panel_classes = {
+            name: cls
+            for name, cls in internal_panel_classes.items()
+            if name in self.selected_panels
+        }
+        external_panel_classes = {
+            name: cls
+            for name, cls in external_panel_classes.items()
+            if name in self.selected_panels
+        }
 
         panel_definitions = {
             name: panel_cls(
@@ -64,11 +120,12 @@ class PanelCreator:
                 max_bar_length=self.max_bar_length,
                 limit_chars=self.limit_chars,
             ).get_panel()
-            for name, panel_cls in all_panel_classes.items()
+            for name, panel_cls in internal_panel_classes.items()
+            if name not in external_panel_classes
         }
-
-        if self.selected_panels is None:
-            self.selected_panels = list(panel_definitions.keys())
+        panel_definitions.update(
+            self._render_external(external_panel_classes, measurements, slot)
+        )
 
         panels = [
             panel_definitions[key]
@@ -80,3 +137,100 @@ class PanelCreator:
             raise ValueError("No valid panels provided")
 
         return panels
+
+    def _timed_render(self, panel_cls, measurements):
+        start = time.perf_counter()
+        panel = panel_cls(
+            measurements,
+            max_bar_length=self.max_bar_length,
+            limit_chars=self.limit_chars,
+        ).get_panel()
+        return panel, time.perf_counter() - start
+
+    def _collect(self, name, key, future, on_time):
+        stats = self.plugin_stats.setdefault(name, PluginStats())
+        try:
+            panel, seconds = future.result()
+        except Exception as e:
+            stats.errors += 1
+            panel, seconds = (
+                Panel(Text(f"{type(e).__name__}: {e}", style="red"), title=name),
+                0.0,
+            )
+        stats.renders += 1
+        stats.last_seconds = seconds
+        if on_time:
+            stats.consecutive_misses = 0
+        self._plugin_last_good[key] = panel
+
+    def _stale_panel(self, name, key):
+        last_good = self._plugin_last_good.get(key)
+        if last_good is None:
+            return Panel(Text("rendering...", style="dim"), title=f"{name} (stale)")
+        return Panel(
+            last_good.renderable,
+            title=f"{last_good.title or name} (stale)",
+            border_style="dim",
+        )
+
+    def _render_external(self, panel_classes, measurements, slot=0):
+        if not panel_classes:
+            return {}
+        if self._plugin_executor is None:
+            self._plugin_executor = ThreadPoolExecutor(
+                max_workers=self.plugin_workers, thread_name_prefix="mav-plugin"
+            )
+
+        deadline = time.perf_counter() + self.plugin_time_budget
+        in_flight = {}
+        for name, panel_cls in panel_classes.items():
+            key = (name, slot)
+            # (future, measurements it was submitted for)
+            pending = self._plugin_futures.get(key)
+            if pending is not None and pending[0].done():
+                # finished after its own frame was drawn
+                self._collect(name, key, pending[0], on_time=False)
+                pending = None
+            if pending is None:
+                future = self._plugin_executor.submit(
+                    self._timed_render, panel_cls, measurements
+                )
+                pending = (future, measurements)
+                self._plugin_futures[key] = pending
+            in_flight[name] = pending
+
+        wait(
+            [future for future, _ in in_flight.values()],
+            timeout=max(0.0, deadline - time.perf_counter()),
+        )
+
+        panels = {}
+        for name, (future, submitted_for) in in_flight.items():
+            key = (name, slot)
+            current = submitted_for is measurements
+            done = future.done()
+            if done:
+                del self._plugin_futures[key]
+                self._collect(name, key, future, on_time=current)
+            if done and current:
+                panels[name] = self._plugin_last_good[key]
+            else:
+                # still running, or a render of an older frame
+                stats = self.plugin_stats.setdefault(name, PluginStats())
+                stats.misses += 1
+                stats.consecutive_misses += 1
+                panels[name] = self._stale_panel(name, key)
+        return panels
+
+    def slow_plugins(self, min_consecutive_misses=3):
+        """Plugins that keep missing the frame budget, with their miss counts."""
+        return {
+            name: stats.misses
+            for name, stats in self.plugin_stats.items()
+            if stats.consecutive_misses >= min_consecutive_misses
+        }
+
+    def close(self):
+        if self._plugin_executor is not None:
+            self._plugin_executor.shutdown(wait=False)
+            self._plugin_executor = None
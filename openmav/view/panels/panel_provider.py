@@ -1,6 +1,8 @@
 import numpy as np
 from rich.text import Text
 
+from openmav.view.panels.bar_renderer import layer_labels, render_bar_rows
+
 
 # this should majorly go to plugins system
 class PanelProvider:
@@ -10,33 +12,27 @@ class PanelProvider:
         self.limit_chars = limit_chars
 
     def create_activations_panel_content(self, mlp_normalized, mlp_activations):
-        activations_str = ""
-        for i, (mlp_act, raw_mlp) in enumerate(zip(mlp_normalized, mlp_activations)):
-            mlp_act_scalar = (
-                mlp_act.item() if isinstance(mlp_act, np.ndarray) else mlp_act
-            )
-            raw_mlp_scalar = (
-                raw_mlp.item() if isinstance(raw_mlp, np.ndarray) else raw_mlp
-            )
-            mlp_bar = "█" * int(abs(mlp_act_scalar))
-            mlp_color = "yellow" if raw_mlp_scalar >= 0 else "magenta"
-
-            activations_str += (
-                f"[bold white]Layer {i:2d}[/] | "
-                f"[bold yellow]:[/] [{mlp_color}]{mlp_bar.ljust(self.max_bar_length)}[/] [bold yellow]{raw_mlp_scalar:+.1f}[/]\n"
-            )
-        return activations_str
+        raw = np.asarray(mlp_activations, dtype=float).reshape(-1)
+        return render_bar_rows(
+            layer_labels(len(raw)),
+            np.asarray(mlp_normalized, dtype=float).reshape(-1),
+            np.char.mod("%+.1f", raw),
+            self.max_bar_length,
+            bar_styles=np.where(raw >= 0, "yellow", "magenta").tolist(),
+        )
 
     def create_entropy_panel_content(self, entropy_values, entropy_normalized):
-        entropy_str = ""
-        for i, (entropy_val, entropy_norm) in enumerate(
-            zip(entropy_values, entropy_normalized)
-        ):
-            entropy_val = float(entropy_val)
-            entropy_norm = int(abs(float(entropy_norm)))
-            entropy_bar = "█" * entropy_norm
-            entropy_str += f"[bold white]Layer {i + 1:2d}[/] | [bold yellow]:[/] [{entropy_bar.ljust(self.max_bar_length)}] {entropy_val:.1f}\n"
-        return entropy_str
+        values = np.asarray(entropy_values, dtype=float).reshape(-1)
+        return render_bar_rows(
+            layer_labels(len(values), start=1),
+            np.asarray(entropy_normalized, dtype=float).reshape(-1),
+            np.char.mod("%.1f", values),
+            self.max_bar_length,
+            bar_styles="default",
+            value_style="default",
+            bar_open="[",
+            bar_close="]",
+        )
 
     def create_top_predictions_panel_content(
         self, decoded_tokens, top_ids, top_probs, logits